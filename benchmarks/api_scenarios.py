@@ -0,0 +1,149 @@
+"""
+Load scenarios through the HTTP API.
+
+By default the app of src/main.py is served in-process through the FastAPI test client, so the whole request path
+(routing, validation, CRUD, database) is measured without a server. With --url the requests go to a running server
+instead, e.g. one started with gunicorn, and the database options are ignored. Both need the httpx package.
+
+    python benchmarks/api_scenarios.py --scenario catalog --threads 16 --seconds 30
+    python benchmarks/api_scenarios.py --scenario sales --hot 5 --url http://localhost:8000
+    python benchmarks/api_scenarios.py --scenario catalog sales mixed --save_baseline
+
+Scenarios:
+    catalog  read-heavy, product lookups and listing pages
+    sales    write-heavy, sales and restocks of a few hot products
+    mixed    lookups, listings, stock reads, and sales and restocks of the hot products
+"""
+import argparse
+import random
+
+from common import (OperationFailed, add_common_arguments, configure, run_workers, summarize_run, print_results,
+                    database_name, build_report, save_report)
+
+# Stock given to each hot product before a run, so sales don't run out of it.
+HOT_STOCK = 10 ** 7
+# Product ids sampled from the API when running against a server.
+MAX_SAMPLED_PRODUCTS = 10000
+
+
+def _request(client, name: str, method: str, url: str, **kwargs) -> str:
+    response = client.request(method, url, **kwargs)
+    if response.status_code >= 400:
+        raise OperationFailed(name)
+    return name
+
+
+def get_product(client, rng, context):
+    return _request(client, 'get_product', 'GET', f"/products/{rng.choice(context['products'])}")
+
+
+def list_products(client, rng, context):
+    return _request(client, 'list_products', 'GET', '/products/',
+                    params={'after': rng.choice(context['products']), 'limit': 50})
+
+
+def get_stock(client, rng, context):
+    return _request(client, 'get_stock', 'GET', f"/products/{rng.choice(context['hot'])}/stock")
+
+
+def sell_hot(client, rng, context):
+    return _request(client, 'sell_hot', 'PUT', f"/products/{rng.choice(context['hot'])}/stock",
+                    json={'quantity': 1, 'operation': 'SALE'})
+
+
+def restock_hot(client, rng, context):
+    return _request(client, 'restock_hot', 'PUT', f"/products/{rng.choice(context['hot'])}/stock",
+                    json={'quantity': 10, 'operation': 'ADD'})
+
+
+# Scenario -> (weight, operation) pairs.
+SCENARIOS = {
+    'catalog': [(85, get_product), (15, list_products)],
+    'sales': [(90, sell_hot), (10, restock_hot)],
+    'mixed': [(60, get_product), (10, list_products), (5, get_stock), (20, sell_hot), (5, restock_hot)],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--threads', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each scenario')
+    parser.add_argument('--hot', type=int, default=10, help='Products that get all the sales')
+    parser.add_argument('--url', help='Base URL of a running server, the in-process app by default')
+    parser.add_argument('--seed', type=int, default=42)
+    add_common_arguments(parser)
+    return parser.parse_args()
+
+
+def sample_products(client) -> list[int]:
+    products = []
+    after = None
+    while len(products) < MAX_SAMPLED_PRODUCTS:
+        params = {'name_prefix': 'Benchmark product', 'fields': 'id', 'limit': 1000}
+        if after is not None:
+            params['after'] = after
+        page = client.get('/products/', params=params).json()
+        products.extend(product['id'] for product in page['products'])
+        after = page['next_cursor']
+        if after is None:
+            break
+    return products
+
+
+def run_scenario(client, scenario: str, context: dict, threads: int, seconds: float, seed: int) -> dict:
+    weights, operations = zip(*SCENARIOS[scenario])
+    generators = [random.Random(seed + index) for index in range(threads)]
+
+    def operation(index: int) -> str:
+        rng = generators[index]
+        return rng.choices(operations, weights)[0](client, rng, context)
+
+    latencies, errors, elapsed = run_workers(operation, threads, seconds=seconds)
+    results = {f'{scenario}.{name}': result for name, result in summarize_run(latencies, errors, elapsed).items()}
+    results[f'{scenario}.all'] = summarize_run({'all': [value for values in latencies.values() for value in values]},
+                                               {'all': sum(errors.values())}, elapsed)['all']
+    return results
+
+
+def main():
+    args = parse_args()
+    if args.url:
+        import httpx
+        client = httpx.Client(base_url=args.url, timeout=30, limits=httpx.Limits(max_connections=args.threads))
+    else:
+        configure(args, pool_size=args.threads)
+        from fastapi.testclient import TestClient
+        from main import app
+        client = TestClient(app)
+
+    with client:
+        products = sample_products(client)
+        if not products and not args.url:
+            from orm_setup import SessionLocal
+            from generate import generate
+            print("No benchmark products found, generating 1000")
+            with SessionLocal() as session:
+                generate(session, 1000, 10, 2, 365, 1000, args.seed)
+            products = sample_products(client)
+        if not products:
+            raise SystemExit("No benchmark products found, run benchmarks/generate.py against the server's database")
+
+        context = {'products': products, 'hot': products[:args.hot]}
+        for product_id in context['hot']:
+            client.put(f'/products/{product_id}/stock', json={'quantity': HOT_STOCK, 'operation': 'ADD'})
+
+        results = {}
+        for scenario in args.scenario:
+            results.update(run_scenario(client, scenario, context, args.threads, args.seconds, args.seed))
+
+    print_results(results)
+    report = build_report('api', results, {'scenarios': args.scenario, 'threads': args.threads,
+                                           'seconds': args.seconds, 'hot': args.hot, 'url': args.url,
+                                           'products': len(products)},
+                          None if args.url else database_name())
+    raise SystemExit(save_report(report, args))
+
+
+if __name__ == '__main__':
+    main()
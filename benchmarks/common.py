@@ -0,0 +1,239 @@
+"""
+Shared setup, timing and reporting of the benchmark scripts.
+
+Every script accepts `--database_url` to run against another database than the one configured in `.env`, e.g. a
+throwaway SQLite file, and writes its results as a JSON report that can be compared with a stored baseline.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, 'baselines')
+# Benchmark products and suppliers are recognised by this prefix of their SKU and email.
+PREFIX = 'BENCH'
+# Relative change of a latency percentile or of the throughput that counts as a regression.
+DEFAULT_THRESHOLD = 0.10
+
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+
+def add_common_arguments(parser: argparse.ArgumentParser, report: bool = True) -> None:
+    parser.add_argument('--database_url', help='SQLAlchemy URL of the database, the one of .env by default')
+    if not report:
+        return
+    parser.add_argument('--report', help='Path of the JSON report, benchmarks/results/<suite>-<time>.json by default')
+    parser.add_argument('--baseline', help='Report to compare with, benchmarks/baselines/<suite>.json by default')
+    parser.add_argument('--save_baseline', action='store_true', help='Store the report as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative slowdown reported as a regression')
+
+
+def configure(args: argparse.Namespace, pool_size: int = 5) -> None:
+    """
+    Points the application at the benchmark database and creates its tables. Call it before importing the
+    application modules that read their configuration at import time.
+    """
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('DB_POOL_SIZE', str(pool_size))
+    os.environ.setdefault('DB_MAX_OVERFLOW', '0')
+    # The CRUD layer is measured against the database, not the cache, unless a backend is chosen explicitly.
+    os.environ.setdefault('CACHE_BACKEND', 'none')
+
+    import logging
+    logging.disable(logging.WARNING)
+    from orm_setup import setup_database
+
+    setup_database()
+
+
+def benchmark_product_ids(session) -> list[int]:
+    from models import Product
+    return [product_id for product_id, in
+            session.query(Product.id).filter(Product.sku.startswith(f'{PREFIX}-')).order_by(Product.id)]
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    # Nearest-rank percentile of an ascending list.
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int = 0) -> dict:
+    """
+    :param latencies: Seconds taken by each successful operation.
+    :param elapsed: Wall-clock seconds of the whole run.
+    :return: Operation count, throughput and latency percentiles in milliseconds.
+    """
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'errors': errors,
+        'throughput': len(ordered) / elapsed if elapsed else 0.0,
+        'mean_ms': sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+
+def summarize_run(latencies: dict[str, list[float]], errors: dict[str, int], elapsed: float) -> dict[str, dict]:
+    return {name: summarize(latencies.get(name, []), elapsed, errors.get(name, 0))
+            for name in sorted(set(latencies) | set(errors))}
+
+
+class OperationFailed(Exception):
+    """
+    Raised by a benchmarked operation to count an error under its name.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.name = name
+
+
+def run_workers(operation: Callable[[int], str | None], threads: int, seconds: float | None = None,
+                iterations: int | None = None) -> tuple[dict[str, list[float]], dict[str, int], float]:
+    """
+    Calls `operation(worker)` from `threads` threads until `seconds` have passed or `iterations` calls were made
+    in total.
+
+    :param operation: Returns the name the call is reported under. Raising `OperationFailed` counts an error
+        under its name, any other exception under the exception class.
+    :return: The latencies and the error count of each name, and the elapsed seconds.
+    """
+    latencies: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    lock = threading.Lock()
+    remaining = [iterations]
+    deadline = time.perf_counter() + seconds if seconds else None
+
+    def keep_going() -> bool:
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        if remaining[0] is None:
+            return True
+        with lock:
+            remaining[0] -= 1
+            return remaining[0] >= 0
+
+    def worker(index: int):
+        own_latencies: dict[str, list[float]] = {}
+        own_errors: dict[str, int] = {}
+        while keep_going():
+            start = time.perf_counter()
+            try:
+                name = operation(index)
+            except OperationFailed as e:
+                own_errors[e.name] = own_errors.get(e.name, 0) + 1
+                continue
+            except Exception as e:
+                name = type(e).__name__
+                own_errors[name] = own_errors.get(name, 0) + 1
+                continue
+            own_latencies.setdefault(name, []).append(time.perf_counter() - start)
+        with lock:
+            for name, values in own_latencies.items():
+                latencies.setdefault(name, []).extend(values)
+            for name, count in own_errors.items():
+                errors[name] = errors.get(name, 0) + count
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def database_name() -> str:
+    from orm_setup import get_engine
+    return get_engine().dialect.name
+
+
+def build_report(suite: str, results: dict[str, dict], parameters: dict, database: str | None) -> dict:
+    return {
+        'suite': suite,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'database': database,
+        'parameters': parameters,
+        'results': results,
+    }
+
+
+def print_results(results: dict[str, dict]) -> None:
+    print(f"{'benchmark':<32} {'count':>8} {'errors':>7} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, result in results.items():
+        print(f"{name:<32} {result['count']:>8} {result['errors']:>7} {result['throughput']:>10.1f} "
+              f"{result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f}")
+
+
+def compare(report: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> list[str]:
+    """
+    :return: A description of every benchmark whose p95 latency or throughput is more than `threshold` worse
+        than in the baseline.
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            continue
+        if before['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.2f} ms -> {result['p95_ms']:.2f} ms")
+        if before['throughput'] and result['throughput'] < before['throughput'] * (1 - threshold):
+            regressions.append(f"{name}: {before['throughput']:.1f} -> {result['throughput']:.1f} ops/s")
+    return regressions
+
+
+def save_report(report: dict, args: argparse.Namespace) -> int:
+    """
+    Writes the report, compares it with the baseline and prints the regressions.
+
+    :return: The exit status of the script, 1 if there are regressions.
+    """
+    suite = report['suite']
+    path = args.report or os.path.join(RESULTS_DIR, f"{suite}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {path}")
+
+    baseline_path = args.baseline or os.path.join(BASELINES_DIR, f'{suite}.json')
+    status = 0
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if not regressions:
+            print(f"No regressions against {baseline_path}")
+        status = 1 if regressions else 0
+    elif args.baseline:
+        print(f"Baseline {baseline_path} does not exist")
+
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(os.path.join(BASELINES_DIR, f'{suite}.json'), 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Baseline of {suite} updated")
+    return status
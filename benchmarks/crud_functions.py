@@ -0,0 +1,202 @@
+"""
+Micro-benchmarks of the CRUD functions, called directly with a session, without the API in front of them.
+
+Runs on the products of generate.py, which creates 1000 of them first if there are none:
+
+    python benchmarks/crud_functions.py --iterations 500
+    python benchmarks/crud_functions.py --only get_product update_stock_sale --threads 8 --save_baseline
+"""
+import argparse
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable
+
+from common import (PREFIX, OperationFailed, add_common_arguments, configure, benchmark_product_ids, run_workers,
+                    summarize_run, print_results, database_name, build_report, save_report)
+
+# name -> (benchmark, setup). The benchmark is called with a session, a random generator and the shared context,
+# the optional setup once before the timed calls, with a session, the context and the number of iterations.
+BENCHMARKS: dict[str, tuple[Callable, Callable | None]] = {}
+
+
+def benchmark(name: str, setup: Callable | None = None):
+    def register(function):
+        BENCHMARKS[name] = (function, setup)
+        return function
+    return register
+
+
+def _unique(prefix: str) -> str:
+    return f'{PREFIX}-{prefix}-{uuid.uuid4().hex[:12]}'
+
+
+@benchmark('get_product')
+def _get_product(session, rng, context):
+    from crud.product import get_product
+    get_product(session, rng.choice(context['products']))
+
+
+@benchmark('list_products')
+def _list_products(session, rng, context):
+    from crud.product import list_products
+    list_products(session, after_id=rng.choice(context['products']), limit=100)
+
+
+@benchmark('list_products_filtered')
+def _list_products_filtered(session, rng, context):
+    from crud.product import list_products
+    list_products(session, supplier_id=rng.choice(context['suppliers']), stock_below=500,
+                  fields=['name', 'price', 'stock'])
+
+
+@benchmark('create_product')
+def _create_product(session, rng, context):
+    from crud.product import create_product
+    create_product(session, 'Benchmark product', None, _unique('C'), 9.99, 100, rng.choice(context['suppliers']))
+
+
+@benchmark('update_product')
+def _update_product(session, rng, context):
+    from crud.product import update_product
+    update_product(session, rng.choice(context['products']), price=round(rng.uniform(1, 500), 2))
+
+
+def _create_disposable_products(session, context, iterations):
+    from sqlalchemy import insert
+    from models import Product
+    rows = [{'name': 'Disposable product', 'sku': _unique('D'), 'price': 1.0, 'stock': 0,
+             'supplier_id': context['suppliers'][0]} for _ in range(iterations)]
+    context['disposable'] = list(session.scalars(insert(Product).returning(Product.id), rows))
+    session.commit()
+
+
+@benchmark('delete_product', setup=_create_disposable_products)
+def _delete_product(session, rng, context):
+    from crud.product import delete_product
+    delete_product(session, context['disposable'].pop())
+
+
+@benchmark('update_stock_add')
+def _update_stock_add(session, rng, context):
+    from crud.product import update_stock
+    from models import OperationType
+    update_stock(session, rng.choice(context['products']), 1, OperationType.ADD)
+
+
+@benchmark('update_stock_sale')
+def _update_stock_sale(session, rng, context):
+    from crud.product import update_stock
+    from models import OperationType
+    update_stock(session, rng.choice(context['products']), 1, OperationType.SALE)
+
+
+@benchmark('bulk_update_stock_50')
+def _bulk_update_stock(session, rng, context):
+    from crud.product import bulk_update_stock
+    from models import OperationType
+    bulk_update_stock(session, [(product_id, 1, OperationType.ADD)
+                                for product_id in rng.sample(context['products'], 50)])
+
+
+@benchmark('list_transactions')
+def _list_transactions(session, rng, context):
+    from crud.product import list_transactions
+    list_transactions(session, rng.choice(context['products']), limit=50)
+
+
+@benchmark('get_stock_at')
+def _get_stock_at(session, rng, context):
+    from crud.ledger import get_stock_at
+    get_stock_at(session, rng.choice(context['products']), datetime.now() - timedelta(days=30))
+
+
+@benchmark('reserve_and_release')
+def _reserve_and_release(session, rng, context):
+    from crud.hold import reserve_stock, release_hold
+    hold = reserve_stock(session, rng.choice(context['products']), 1)
+    release_hold(session, hold.id)
+
+
+@benchmark('get_supplier')
+def _get_supplier(session, rng, context):
+    from crud.supplier import get_supplier
+    get_supplier(session, rng.choice(context['suppliers']))
+
+
+@benchmark('create_supplier')
+def _create_supplier(session, rng, context):
+    from crud.supplier import create_supplier
+    create_supplier(session, 'Benchmark supplier', f'{_unique("s").lower()}@example.com', '+15550000000')
+
+
+@benchmark('update_supplier')
+def _update_supplier(session, rng, context):
+    from crud.supplier import update_supplier
+    update_supplier(session, rng.choice(context['suppliers']), phone_number=f'+1555{rng.randrange(10 ** 7):07d}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=500, help='Timed calls of each benchmark')
+    parser.add_argument('--warmup', type=int, default=20, help='Untimed calls before each benchmark')
+    parser.add_argument('--threads', type=int, default=1, help='Concurrent callers, each with its own session')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='Benchmarks to run, all by default')
+    parser.add_argument('--seed', type=int, default=42)
+    add_common_arguments(parser)
+    return parser.parse_args()
+
+
+def load_context(session) -> dict:
+    from models import Supplier
+    products = benchmark_product_ids(session)
+    if not products:
+        from generate import generate
+        print("No benchmark products found, generating 1000")
+        generate(session, 1000, 10, 2, 365, 1000, 42)
+        products = benchmark_product_ids(session)
+    suppliers = [supplier_id for supplier_id, in
+                 session.query(Supplier.id).filter(Supplier.email.startswith(f'{PREFIX.lower()}-'))]
+    session.rollback()
+    return {'products': products, 'suppliers': suppliers}
+
+
+def main():
+    args = parse_args()
+    configure(args, pool_size=args.threads)
+    from orm_setup import SessionLocal
+
+    with SessionLocal() as session:
+        context = load_context(session)
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        function, setup = BENCHMARKS[name]
+        if setup:
+            with SessionLocal() as session:
+                setup(session, context, args.iterations + args.warmup)
+        sessions = [SessionLocal() for _ in range(args.threads)]
+        generators = [random.Random(args.seed + index) for index in range(args.threads)]
+
+        def operation(index: int, function=function, sessions=sessions, generators=generators, name=name) -> str:
+            try:
+                function(sessions[index], generators[index], context)
+            except Exception:
+                sessions[index].rollback()
+                raise OperationFailed(name)
+            return name
+
+        run_workers(operation, args.threads, iterations=args.warmup)
+        latencies, errors, elapsed = run_workers(operation, args.threads, iterations=args.iterations)
+        results.update(summarize_run(latencies, errors, elapsed))
+        for session in sessions:
+            session.close()
+
+    print_results(results)
+    report = build_report('crud', results, {'iterations': args.iterations, 'threads': args.threads,
+                                            'products': len(context['products'])}, database_name())
+    raise SystemExit(save_report(report, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Fills the database with benchmark suppliers, products and stock transactions.
+
+Rows are written with multi-row INSERTs in batches, and every product's stock matches its ledger. SKUs and supplier
+emails start with BENCH, so the data can be removed again with --clean:
+
+    python benchmarks/generate.py --products 10k
+    python benchmarks/generate.py --products 1m --history 5 --database_url postgresql+psycopg2://localhost/bench
+    python benchmarks/generate.py --clean --products 0
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import PREFIX, add_common_arguments, configure
+
+
+def count(value: str) -> int:
+    # Accepts 10000, 10k or 1m.
+    multipliers = {'k': 1000, 'm': 1000000}
+    value = value.lower()
+    if value[-1:] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=count, default=10000, help='Products to create, e.g. 10k or 1m')
+    parser.add_argument('--suppliers', type=count, default=100, help='Suppliers the products are spread over')
+    parser.add_argument('--history', type=int, default=2, help='Sales recorded per product after its initial stock')
+    parser.add_argument('--days', type=int, default=365, help='The transactions are spread over this many days')
+    parser.add_argument('--batch_size', type=int, default=5000, help='Rows per INSERT')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the random data, for repeatable datasets')
+    parser.add_argument('--clean', action='store_true', help='Delete the existing benchmark data first')
+    add_common_arguments(parser, report=False)
+    return parser.parse_args()
+
+
+def clean(session) -> int:
+    from sqlalchemy import delete, select
+    from models import Product, ProductTransaction, ProductStockStripe, StockHold, StockSnapshot, Supplier
+    from crud.summary import rebuild_supplier_summaries
+
+    products = select(Product.id).where(Product.sku.startswith(f'{PREFIX}-'))
+    for model in (ProductTransaction, ProductStockStripe, StockHold, StockSnapshot):
+        session.execute(delete(model).where(model.product_id.in_(products)))
+    deleted = session.execute(delete(Product).where(Product.sku.startswith(f'{PREFIX}-'))).rowcount
+    session.execute(delete(Supplier).where(Supplier.email.startswith(f'{PREFIX.lower()}-')))
+    session.commit()
+    rebuild_supplier_summaries(session)
+    return deleted
+
+
+def _batches(start: int, stop: int, size: int):
+    for batch_start in range(start, stop, size):
+        yield range(batch_start, min(batch_start + size, stop))
+
+
+def generate(session, products: int, suppliers: int, history: int, days: int, batch_size: int,
+             seed: int) -> dict:
+    """
+    :return: The number of rows written to each table.
+    """
+    from sqlalchemy import func, insert
+    from models import OperationType, Product, ProductTransaction, Supplier
+    from crud.summary import rebuild_supplier_summaries
+
+    rng = random.Random(seed)
+    now = datetime.now()
+    written = {'suppliers': 0, 'products': 0, 'transactions': 0}
+
+    existing_suppliers = session.query(func.count(Supplier.id)).filter(
+        Supplier.email.startswith(f'{PREFIX.lower()}-')).scalar()
+    supplier_rows = [{'name': f'Benchmark supplier {index}', 'email': f'{PREFIX.lower()}-{index}@example.com',
+                      'phone_number': f'+1555{index:07d}'}
+                     for index in range(existing_suppliers, max(existing_suppliers, suppliers))]
+    if supplier_rows:
+        session.execute(insert(Supplier), supplier_rows)
+        written['suppliers'] = len(supplier_rows)
+    supplier_ids = [supplier_id for supplier_id, in session.query(Supplier.id).filter(
+        Supplier.email.startswith(f'{PREFIX.lower()}-'))]
+    session.commit()
+
+    offset = session.query(func.count(Product.id)).filter(Product.sku.startswith(f'{PREFIX}-')).scalar()
+    for batch in _batches(offset, offset + products, batch_size):
+        movements = {}
+        rows = []
+        for index in batch:
+            sales = [rng.randint(1, 5) for _ in range(history)]
+            initial = rng.randint(100, 1000) + sum(sales)
+            movements[f'{PREFIX}-{index:08d}'] = [(OperationType.ADD, initial)] + [
+                (OperationType.SALE, quantity) for quantity in sales]
+            rows.append({'name': f'Benchmark product {index}', 'description': f'Generated product {index}',
+                         'sku': f'{PREFIX}-{index:08d}', 'price': round(rng.uniform(1, 500), 2),
+                         'stock': initial - sum(sales), 'supplier_id': rng.choice(supplier_ids)})
+        ids = dict(session.execute(insert(Product).returning(Product.sku, Product.id), rows).all())
+
+        transactions = []
+        for sku, product_movements in movements.items():
+            dates = sorted(now - timedelta(seconds=rng.randrange(days * 86400)) for _ in product_movements)
+            transactions.extend({'product_id': ids[sku], 'operation': operation, 'quantity': quantity, 'date': date}
+                                for (operation, quantity), date in zip(product_movements, dates))
+        session.execute(insert(ProductTransaction), transactions)
+        session.commit()
+        written['products'] += len(rows)
+        written['transactions'] += len(transactions)
+
+    # The rows were inserted around the CRUD functions, which keep the supplier summaries up to date.
+    rebuild_supplier_summaries(session)
+    return written
+
+
+def main():
+    args = parse_args()
+    configure(args)
+    from orm_setup import SessionLocal
+
+    with SessionLocal() as session:
+        if args.clean:
+            print(f"Deleted {clean(session)} benchmark products")
+        if not args.products:
+            return
+        start = time.perf_counter()
+        written = generate(session, args.products, args.suppliers, args.history, args.days, args.batch_size,
+                           args.seed)
+    elapsed = time.perf_counter() - start
+    rows = sum(written.values())
+    print(f"Wrote {written['suppliers']} suppliers, {written['products']} products and {written['transactions']} "
+          f"transactions in {elapsed:.1f} s ({rows / elapsed:.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Serialization cost of the API responses, before and after the routes declared response models and the app switched
+to ORJSONResponse. The responses are built once from the database, then only turned into bytes:
+
+- `before`: `jsonable_encoder` on the raw content, ORM objects included, then `JSONResponse`, which is what FastAPI
+  does for a route without a response model.
+- `after`: validation into the response model with `from_attributes` and a JSON-mode dump by pydantic-core, then
+  the default response class of the app, which is what FastAPI does for a route with a response model.
+
+    python benchmarks/serialization.py --iterations 500
+    python benchmarks/serialization.py --page_size 1000 --batch_size 5000 --save_baseline
+"""
+import argparse
+
+from common import (add_common_arguments, configure, benchmark_product_ids, run_workers, summarize_run, print_results,
+                    database_name, build_report, save_report)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=500, help='Timed serializations of each response')
+    parser.add_argument('--warmup', type=int, default=20, help='Untimed serializations before each benchmark')
+    parser.add_argument('--page_size', type=int, default=1000, help='Products of the listing response')
+    parser.add_argument('--batch_size', type=int, default=1000, help='Products of the batch get response')
+    add_common_arguments(parser)
+    return parser.parse_args()
+
+
+def load_responses(session, page_size: int, batch_size: int) -> dict[str, tuple[type, dict]]:
+    """
+    :return: name -> (response model, content as the route returns it) of a single product, a listing page and a
+        batch get with suppliers.
+    """
+    from crud.product import get_product, get_products, list_products
+    from validation.product import Product, ProductPage, ProductBatchGetResult
+
+    product_ids = benchmark_product_ids(session)
+    if not product_ids:
+        from generate import generate
+        print("No benchmark products found, generating 1000")
+        generate(session, 1000, 10, 2, 365, 1000, 42)
+        product_ids = benchmark_product_ids(session)
+    return {
+        'get': (dict[str, Product], {'product': get_product(session, product_ids[0])}),
+        'list': (ProductPage, {'products': list_products(session, limit=page_size), 'next_cursor': None}),
+        'batch': (dict[str, list[ProductBatchGetResult]],
+                  {'products': get_products(session, ids=product_ids[:batch_size], include_supplier=True)}),
+    }
+
+
+def serialize_before(content) -> bytes:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def serializer_after(model: type):
+    from pydantic import TypeAdapter
+    from main import DEFAULT_RESPONSE_CLASS
+    adapter = TypeAdapter(model)
+
+    def serialize(content) -> bytes:
+        validated = adapter.validate_python(content, from_attributes=True)
+        return DEFAULT_RESPONSE_CLASS(adapter.dump_python(validated, mode='json')).body
+    return serialize
+
+
+def main():
+    args = parse_args()
+    configure(args)
+    from orm_setup import SessionLocal
+
+    with SessionLocal() as session:
+        responses = load_responses(session, args.page_size, args.batch_size)
+        results = {}
+        for name, (model, content) in responses.items():
+            # The ORM product must stay attached, as it is while a route returns it.
+            for variant, serialize in (('before', serialize_before), ('after', serializer_after(model))):
+                benchmark = f'serialize_{name}_{variant}'
+
+                def operation(index: int, serialize=serialize, content=content, benchmark=benchmark) -> str:
+                    serialize(content)
+                    return benchmark
+
+                run_workers(operation, 1, iterations=args.warmup)
+                latencies, errors, elapsed = run_workers(operation, 1, iterations=args.iterations)
+                results.update(summarize_run(latencies, errors, elapsed))
+
+    print_results(results)
+    report = build_report('serialization', results, {'iterations': args.iterations, 'page_size': args.page_size,
+                                                     'batch_size': args.batch_size}, database_name())
+    raise SystemExit(save_report(report, args))
+
+
+if __name__ == '__main__':
+    main()
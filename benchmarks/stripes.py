@@ -0,0 +1,76 @@
+"""
+Sale throughput on a single product as its stock is split across more stripes.
+
+Runs on a product it creates and deletes again:
+
+    python benchmarks/stripes.py --threads 32 --seconds 10 --stripes 0 1 2 4 8 16
+"""
+import argparse
+import uuid
+
+from common import (OperationFailed, add_common_arguments, configure, run_workers, summarize, print_results,
+                    database_name, build_report, save_report)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=32, help='Concurrent sellers')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each run')
+    parser.add_argument('--stripes', type=int, nargs='+', default=[0, 1, 2, 4, 8, 16], help='Stripe counts to compare')
+    add_common_arguments(parser)
+    return parser.parse_args()
+
+
+def run(product_id: int, threads: int, seconds: float) -> dict:
+    from orm_setup import SessionLocal
+    from crud.product import update_stock
+    from models import OperationType
+
+    sessions = [SessionLocal() for _ in range(threads)]
+
+    def sell(index: int) -> str:
+        try:
+            update_stock(sessions[index], product_id, 1, OperationType.SALE)
+        except Exception:
+            sessions[index].rollback()
+            raise OperationFailed('sale')
+        return 'sale'
+
+    latencies, errors, elapsed = run_workers(sell, threads, seconds=seconds)
+    for session in sessions:
+        session.close()
+    return summarize(latencies.get('sale', []), elapsed, errors.get('sale', 0))
+
+
+def main():
+    args = parse_args()
+    # Every seller needs its own connection.
+    configure(args, pool_size=args.threads)
+    from orm_setup import SessionLocal
+    from crud.supplier import create_supplier, delete_supplier
+    from crud.product import create_product
+    from crud.stripe import configure_stripes
+
+    tag = uuid.uuid4().hex[:8]
+    with SessionLocal() as session:
+        supplier = create_supplier(session, f'Benchmark {tag}', f'benchmark-{tag}@example.com', '+000')
+        product = create_product(session, f'Benchmark {tag}', None, f'BENCH-{tag}', 1.0, 10 ** 9, supplier.id)
+        supplier_id, product_id = supplier.id, product.id
+
+    results = {}
+    try:
+        for stripe_count in args.stripes:
+            with SessionLocal() as session:
+                configure_stripes(session, product_id, stripe_count)
+            results[f'stripes_{stripe_count}'] = run(product_id, args.threads, args.seconds)
+    finally:
+        with SessionLocal() as session:
+            delete_supplier(session, supplier_id)
+
+    print_results(results)
+    report = build_report('stripes', results, {'threads': args.threads, 'seconds': args.seconds}, database_name())
+    raise SystemExit(save_report(report, args))
+
+
+if __name__ == '__main__':
+    main()
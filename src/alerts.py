@@ -0,0 +1,221 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+from pydantic_core import to_jsonable_python
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Where low-stock alerts are delivered: log, webhook or none.
+ALERT_NOTIFIER = os.environ.get('ALERT_NOTIFIER', 'log')
+# URL the webhook notifier POSTs each batch of alerts to, as a JSON array.
+ALERT_WEBHOOK_URL = os.environ.get('ALERT_WEBHOOK_URL', '')
+ALERT_WEBHOOK_TIMEOUT = float(os.environ.get('ALERT_WEBHOOK_TIMEOUT', 5))
+# Seconds an alert waits before it is delivered. A product that crosses back over its threshold meanwhile gets no
+# alert at all, so stock going up and down around the threshold doesn't flood the notifier.
+ALERT_DEBOUNCE_SECONDS = float(os.environ.get('ALERT_DEBOUNCE_SECONDS', 30))
+
+# Key of the session info holding the alerts of the current transaction.
+_SESSION_ALERTS = 'stock_alerts'
+
+
+class AlertNotifier:
+    """
+    Interface of the destinations of the low-stock alerts. An alert is a dict with the `product_id`, `supplier_id`,
+    `available` stock, reorder `threshold`, whether the product is now `below` it, and the time it crossed `at`.
+    """
+
+    def notify(self, alerts: list[dict]) -> None:
+        raise NotImplementedError
+
+
+class NullNotifier(AlertNotifier):
+    def notify(self, alerts: list[dict]) -> None:
+        pass
+
+
+class LogNotifier(AlertNotifier):
+    def notify(self, alerts: list[dict]) -> None:
+        for alert in alerts:
+            if alert['below']:
+                logger.warning(f"Product {alert['product_id']} is low on stock: {alert['available']} available, "
+                               f"reorder threshold {alert['threshold']}")
+            else:
+                logger.info(f"Product {alert['product_id']} is restocked: {alert['available']} available")
+
+
+class MemoryNotifier(AlertNotifier):
+    """
+    Keeps the alerts in the process, e.g. for tests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.alerts: list[dict] = []
+
+    def notify(self, alerts: list[dict]) -> None:
+        with self._lock:
+            self.alerts.extend(alerts)
+
+
+class WebhookNotifier(AlertNotifier):
+    def __init__(self, url: str = ALERT_WEBHOOK_URL, timeout: float = ALERT_WEBHOOK_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+
+    def notify(self, alerts: list[dict]) -> None:
+        request = urllib.request.Request(self.url, data=json.dumps(to_jsonable_python(alerts)).encode(),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def build_notifier(name: str = ALERT_NOTIFIER) -> AlertNotifier:
+    if name == 'none':
+        return NullNotifier()
+    if name == 'webhook':
+        return WebhookNotifier()
+    if name != 'log':
+        logger.warning(f"Unknown alert notifier {name!r}, alerts are logged")
+    return LogNotifier()
+
+
+notifier = build_notifier()
+
+
+def configure_notifier(alert_notifier: AlertNotifier) -> None:
+    """
+    Replaces the notifier alerts are delivered to.
+    """
+    global notifier
+    notifier = alert_notifier
+
+
+def get_notifier() -> AlertNotifier:
+    return notifier
+
+
+def _deliver(alerts: list[dict]) -> None:
+    try:
+        notifier.notify(alerts)
+    except Exception as e:
+        # Alerts are best effort, the products under their threshold can always be listed.
+        logger.error(f"Delivering {len(alerts)} stock alerts failed: {e}")
+
+
+class AlertDispatcher:
+    """
+    Delivers the threshold crossings of a process to the notifier from a background thread, `debounce` seconds
+    after the first crossing of each product. Only the last crossing of a product within that time is delivered,
+    and nothing if it is back on the side of the threshold it started from.
+    """
+
+    def __init__(self, debounce: float = ALERT_DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self._lock = threading.Condition()
+        # product_id -> (time the first crossing is due, whether the product was below before it, last crossing)
+        self._pending: dict[int, tuple[float, bool, dict]] = {}
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the thread once the pending alerts are delivered, without waiting for their debounce.
+        """
+        with self._lock:
+            self._stop = True
+            self._lock.notify()
+        self._thread.join()
+
+    def submit(self, alerts: list[dict]) -> None:
+        with self._lock:
+            for alert in alerts:
+                product_id = alert['product_id']
+                if product_id in self._pending:
+                    due, was_below, _ = self._pending[product_id]
+                else:
+                    due, was_below = time.monotonic() + self.debounce, not alert['below']
+                self._pending[product_id] = (due, was_below, alert)
+            self._lock.notify()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _take_due(self) -> list[dict]:
+        """
+        Waits until alerts are due, or the dispatcher stops.
+
+        :return: The due alerts whose product is still across its threshold.
+        """
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                due = [product_id for product_id, (due_at, _, _) in self._pending.items() if self._stop or due_at <= now]
+                if due or self._stop:
+                    break
+                self._lock.wait(min(due_at for due_at, _, _ in self._pending.values()) - now if self._pending else None)
+            taken = [self._pending.pop(product_id) for product_id in due]
+        return [alert for _, was_below, alert in taken if alert['below'] != was_below]
+
+    def _run(self) -> None:
+        while True:
+            alerts = self._take_due()
+            if alerts:
+                _deliver(alerts)
+            elif self._stop:
+                return
+
+
+_dispatcher: AlertDispatcher | None = None
+
+
+def start_alert_dispatcher() -> AlertDispatcher:
+    global _dispatcher
+    _dispatcher = AlertDispatcher()
+    _dispatcher.start()
+    return _dispatcher
+
+
+def stop_alert_dispatcher() -> None:
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop()
+        _dispatcher = None
+
+
+def get_alert_dispatcher() -> AlertDispatcher | None:
+    return _dispatcher
+
+
+def queue_alerts(session: Session, alerts: list[dict]) -> None:
+    """
+    Holds the threshold crossings of the current transaction of `session` until it commits.
+    """
+    if alerts:
+        session.info.setdefault(_SESSION_ALERTS, []).extend(alerts)
+
+
+@event.listens_for(Session, 'after_commit')
+def _send_alerts(session: Session) -> None:
+    # Without a dispatcher, e.g. in the CLI, alerts are delivered right away.
+    alerts = session.info.pop(_SESSION_ALERTS, None)
+    if not alerts:
+        return
+    if _dispatcher is not None:
+        _dispatcher.submit(alerts)
+    else:
+        _deliver(alerts)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_alerts(session: Session) -> None:
+    session.info.pop(_SESSION_ALERTS, None)
@@ -0,0 +1,6 @@
+# Formats and sizes shared with the CLI, which reads them without importing the importer and exporter.
+FILE_FORMATS = ('csv', 'jsonl')
+DEFAULT_BATCH_SIZE = 1000
+EXPORT_ENTITIES = ('product', 'transaction')
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+DEFAULT_CHUNK_SIZE = 5000
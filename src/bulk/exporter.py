@@ -0,0 +1,160 @@
+import csv
+import enum
+import io
+import json
+import logging
+from datetime import datetime
+from typing import Iterator, TextIO
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from bulk import EXPORT_ENTITIES, EXPORT_FORMATS, DEFAULT_CHUNK_SIZE
+from models import Product, ProductTransaction
+from crud.stripe import TOTAL_STOCK
+
+logger = logging.getLogger(__name__)
+
+# Formats that can be written to a stream, Parquet needs a file to write its footer.
+STREAM_FORMATS = ('csv', 'jsonl')
+
+MEDIA_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def _statement(entity: str, supplier_id: int | None, start: datetime | None, end: datetime | None):
+    if entity == 'product':
+        statement = select(Product.id, Product.name, Product.description, Product.sku, Product.price,
+                           Product.supplier_id, TOTAL_STOCK.label('stock')).order_by(Product.id)
+        if supplier_id is not None:
+            statement = statement.where(Product.supplier_id == supplier_id)
+        return statement
+
+    if entity != 'transaction':
+        raise ValueError(f"Unknown entity {entity!r}, expected one of {', '.join(EXPORT_ENTITIES)}")
+    statement = select(ProductTransaction.id, ProductTransaction.product_id, ProductTransaction.operation,
+                       ProductTransaction.quantity, ProductTransaction.date).order_by(ProductTransaction.date,
+                                                                                      ProductTransaction.id)
+    if supplier_id is not None:
+        statement = statement.join(Product, Product.id == ProductTransaction.product_id).where(
+            Product.supplier_id == supplier_id)
+    if start is not None:
+        statement = statement.where(ProductTransaction.date >= start)
+    if end is not None:
+        statement = statement.where(ProductTransaction.date < end)
+    return statement
+
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def iter_chunks(session: Session,
+                entity: str,
+                supplier_id: int | None = None,
+                start: datetime | None = None,
+                end: datetime | None = None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> tuple[list[str], Iterator[list[tuple]]]:
+    """
+    Runs the export query on a server-side cursor and returns its column names and an iterator over chunks
+    of at most `chunk_size` rows, so only one chunk is held in memory at a time.
+
+    :param start: Only export transactions on or after this date.
+    :param end: Only export transactions before this date.
+    """
+    result = session.execute(_statement(entity, supplier_id, start, end), execution_options={'yield_per': chunk_size})
+    columns = list(result.keys())
+
+    def chunks():
+        for partition in result.partitions():
+            yield [tuple(_plain(value) for value in row) for row in partition]
+
+    return columns, chunks()
+
+
+def iter_csv(columns: list[str], chunks: Iterator[list[tuple]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_jsonl(columns: list[str], chunks: Iterator[list[tuple]]) -> Iterator[str]:
+    for chunk in chunks:
+        yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in chunk)
+
+
+def stream_export(session: Session, entity: str, file_format: str, **filters) -> Iterator[str]:
+    """
+    Yields the export as CSV or JSON lines text, one chunk of rows at a time.
+    """
+    if file_format not in STREAM_FORMATS:
+        raise ValueError(f"Format {file_format!r} can't be streamed, expected one of {', '.join(STREAM_FORMATS)}")
+    columns, chunks = iter_chunks(session, entity, **filters)
+    return iter_csv(columns, chunks) if file_format == 'csv' else iter_jsonl(columns, chunks)
+
+
+def write_parquet(path: str, columns: list[str], chunks: Iterator[list[tuple]]) -> int:
+    """
+    Writes the chunks as consecutive row groups of a Parquet file. Requires the optional `pyarrow` package.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export requires the pyarrow package")
+
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.table({column: [row[index] for row in chunk] for index, column in enumerate(columns)})
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def export_to_file(session: Session, entity: str, file_format: str, output: str | TextIO, **filters) -> int:
+    """
+    Writes the export to a path, or to an open text stream for CSV and JSON lines.
+
+    :return: The number of exported rows.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format {file_format!r}, expected one of {', '.join(EXPORT_FORMATS)}")
+    columns, chunks = iter_chunks(session, entity, **filters)
+
+    rows = 0
+
+    def counted():
+        nonlocal rows
+        for chunk in chunks:
+            rows += len(chunk)
+            yield chunk
+
+    if file_format == 'parquet':
+        if not isinstance(output, str):
+            raise ValueError("Parquet can only be exported to a file")
+        write_parquet(output, columns, counted())
+    else:
+        lines = iter_csv(columns, counted()) if file_format == 'csv' else iter_jsonl(columns, counted())
+        if isinstance(output, str):
+            with open(output, 'w', newline='') as stream:
+                stream.writelines(lines)
+        else:
+            output.writelines(lines)
+    logger.info(f"Exported {rows} {entity} rows as {file_format}")
+    return rows
@@ -0,0 +1,289 @@
+import csv
+import json
+import logging
+import time
+from itertools import islice
+from typing import Callable, Iterator, TextIO
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from bulk import FILE_FORMATS, DEFAULT_BATCH_SIZE
+from cache import invalidate_product, invalidate_supplier
+from crud.summary import product_deltas
+from crud.outbox import change_events
+from crud.alert import detect_crossings
+from search_index import invalidate_search_index
+from models import Product, ProductTransaction, Supplier, OperationType, ChangeType
+from validation.product import ProductCreate
+from validation.supplier import SupplierCreate
+
+logger = logging.getLogger(__name__)
+
+
+def detect_format(path: str) -> str:
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(stream: TextIO, file_format: str) -> Iterator[tuple[int, dict | None, str | None]]:
+    """
+    Yields (line number, row, parse error) for every record of a CSV file with a header row or of
+    a JSON lines file. Only one line is held in memory at a time.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            if None in row:
+                yield reader.line_num, None, 'Too many fields'
+                continue
+            # Empty CSV cells are missing values, not empty strings.
+            yield reader.line_num, {key: value if value != '' else None for key, value in row.items()}, None
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f'Invalid JSON: {e}'
+            continue
+        if isinstance(row, dict):
+            yield line_number, row, None
+        else:
+            yield line_number, None, 'Expected a JSON object'
+
+
+def _batches(iterable, size: int):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _upsert(session: Session, model, rows: list[dict], conflict_column: str, update_columns: list[str],
+            restore_deleted: bool = False) -> list[tuple[int, str]]:
+    """
+    Inserts the rows with one multi-row INSERT, updating `update_columns` of the rows that already exist.
+
+    :param restore_deleted: Also update, and restore, the existing rows that are soft-deleted, which are otherwise
+        left as they are.
+    :return: The id and conflict key of the inserted or updated rows.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f'Upserts are not supported on {dialect}')
+
+    statement = insert(model).values(rows)
+    set_ = {column: statement.excluded[column] for column in update_columns}
+    if restore_deleted:
+        set_['deleted_at'] = None
+    statement = statement.on_conflict_do_update(
+        index_elements=[conflict_column],
+        set_=set_,
+        where=None if restore_deleted else model.deleted_at.is_(None),
+    )
+    return [tuple(row) for row in session.execute(statement.returning(model.id, getattr(model, conflict_column)))]
+
+
+class _Importer:
+    model = None
+    schema: type[BaseModel] = None
+    conflict_column: str = None
+    update_columns: list[str] = None
+
+    def __init__(self, session: Session, on_reject: Callable[[dict], None] | None = None,
+                 restore_deleted: bool = False):
+        self.session = session
+        self.on_reject = on_reject
+        self.restore_deleted = restore_deleted
+        self.report = {'read': 0, 'imported': 0, 'rejected': 0}
+
+    def reject(self, line: int, row: dict | None, errors: list[str]) -> None:
+        self.report['rejected'] += 1
+        if self.on_reject:
+            self.on_reject({'line': line, 'row': row, 'errors': errors})
+
+    def prepare(self, rows: list[tuple[int, dict]]) -> list[tuple[int, dict]]:
+        return rows
+
+    def invalidate(self, ids: list[int]) -> None:
+        pass
+
+    def upsert_rows(self, rows: list[tuple[int, dict]]) -> list[tuple[int, str]]:
+        """
+        Upserts the rows and rejects those of soft-deleted rows, unless they are restored.
+
+        :return: The id and conflict key of the written rows.
+        """
+        written = _upsert(self.session, self.model, [values for _, values in rows], self.conflict_column,
+                          self.update_columns, self.restore_deleted)
+        keys = {key for _, key in written}
+        for line, values in rows:
+            if values[self.conflict_column] not in keys:
+                self.reject(line, values, [f"{self.conflict_column}: {values[self.conflict_column]} belongs to a "
+                                           f"deleted {self.model.__tablename__}, import with restore_deleted to "
+                                           f"restore it"])
+        return written
+
+    def upsert(self, rows: list[tuple[int, dict]]) -> list[int]:
+        return [row_id for row_id, _ in self.upsert_rows(rows)]
+
+    def validate(self, batch: list[tuple[int, dict | None, str | None]]) -> list[tuple[int, dict]]:
+        parsed = []
+        for line, row, error in batch:
+            if error:
+                self.reject(line, row, [error])
+            else:
+                parsed.append((line, row))
+
+        valid = {}
+        for line, row in self.prepare(parsed):
+            try:
+                values = self.schema.model_validate(row).model_dump()
+            except ValidationError as e:
+                self.reject(line, row, [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()])
+                continue
+            # A statement can't upsert the same row twice, the last occurrence in the batch wins.
+            valid[values[self.conflict_column]] = (line, values)
+        return list(valid.values())
+
+    def write(self, rows: list[tuple[int, dict]]) -> None:
+        try:
+            ids = self.upsert(rows)
+            self.session.commit()
+        except IntegrityError:
+            self.session.rollback()
+            # Isolate the offending rows one by one, which only happens for batches with bad references.
+            ids = []
+            for line, values in rows:
+                try:
+                    ids += self.upsert([(line, values)])
+                    self.session.commit()
+                except IntegrityError as e:
+                    self.session.rollback()
+                    self.reject(line, values, [str(e.orig).strip()])
+        self.report['imported'] += len(ids)
+        self.invalidate(ids)
+
+    def run(self, stream: TextIO, file_format: str, batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unsupported format {file_format!r}, expected one of {', '.join(FILE_FORMATS)}")
+        start = time.perf_counter()
+        for batch in _batches(read_rows(stream, file_format), batch_size):
+            self.report['read'] += len(batch)
+            rows = self.validate(batch)
+            if rows:
+                self.write(rows)
+        seconds = time.perf_counter() - start
+        self.report['seconds'] = round(seconds, 3)
+        self.report['rows_per_second'] = round(self.report['read'] / seconds) if seconds else 0
+        logger.info(f"Imported {self.report['imported']} {self.model.__tablename__} rows, rejected "
+                    f"{self.report['rejected']}, in {seconds:.1f} s ({self.report['rows_per_second']} rows/s)")
+        return self.report
+
+
+class SupplierImporter(_Importer):
+    model = Supplier
+    schema = SupplierCreate
+    conflict_column = 'email'
+    update_columns = ['name', 'phone_number']
+
+    def invalidate(self, ids: list[int]) -> None:
+        for supplier_id in ids:
+            invalidate_supplier(supplier_id)
+
+
+class ProductImporter(_Importer):
+    """
+    Imports products, whose supplier is given either as `supplier_id` or as `supplier_email`.
+    Existing SKUs are updated, except for their stock, which only changes through stock movements.
+    The stock of new SKUs is recorded as their first ADD transaction. Existing products are taken out of the
+    summaries of their suppliers before the upsert and every written product is added back after it, which
+    accounts for changes of price and supplier.
+    """
+    model = Product
+    schema = ProductCreate
+    conflict_column = 'sku'
+    update_columns = ['name', 'description', 'price', 'supplier_id']
+
+    def __init__(self, session: Session, on_reject: Callable[[dict], None] | None = None,
+                 restore_deleted: bool = False):
+        super().__init__(session, on_reject, restore_deleted)
+        self.supplier_ids: dict[str, int] = {}
+
+    def prepare(self, rows: list[tuple[int, dict]]) -> list[tuple[int, dict]]:
+        emails = {row['supplier_email'] for _, row in rows
+                  if row.get('supplier_email') and row['supplier_email'] not in self.supplier_ids}
+        if emails:
+            # One query per batch for the suppliers not seen yet.
+            self.supplier_ids.update(
+                self.session.execute(select(Supplier.email, Supplier.id).where(Supplier.email.in_(emails))).all())
+
+        prepared = []
+        for line, row in rows:
+            email = row.get('supplier_email')
+            if email and row.get('supplier_id') is None:
+                if email not in self.supplier_ids:
+                    self.reject(line, row, [f'supplier_email: Supplier with email {email} not found'])
+                    continue
+                row = {**row, 'supplier_id': self.supplier_ids[email]}
+            prepared.append((line, row))
+        return prepared
+
+    def upsert(self, rows: list[tuple[int, dict]]) -> list[int]:
+        skus = [values['sku'] for _, values in rows]
+        existing = set(self.session.scalars(select(Product.sku).where(Product.sku.in_(skus))
+                                            .execution_options(include_deleted=True)))
+        if existing:
+            self.session.execute(product_deltas(Product.sku.in_(existing), -1))
+        initial_stock = {values['sku']: values['stock'] for _, values in rows
+                         if values['sku'] not in existing and values['stock']}
+        written = self.upsert_rows(rows)
+        transactions = [{'product_id': product_id, 'operation': OperationType.ADD, 'quantity': initial_stock[sku]}
+                        for product_id, sku in written if sku in initial_stock]
+        if transactions:
+            self.session.execute(insert(ProductTransaction), transactions)
+        ids = [product_id for product_id, _ in written]
+        self.session.execute(product_deltas(Product.id.in_(ids)))
+        created = [product_id for product_id, sku in written if sku not in existing]
+        updated = [product_id for product_id, sku in written if sku in existing]
+        if created:
+            self.session.execute(change_events(Product.id.in_(created), ChangeType.CREATED))
+        if updated:
+            self.session.execute(change_events(Product.id.in_(updated), ChangeType.UPDATED))
+        detect_crossings(self.session, Product.id.in_(ids))
+        return ids
+
+    def invalidate(self, ids: list[int]) -> None:
+        invalidate_product(*ids)
+        invalidate_search_index()
+
+
+def import_suppliers(session: Session, stream: TextIO, file_format: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                     on_reject: Callable[[dict], None] | None = None, restore_deleted: bool = False) -> dict:
+    """
+    Streams suppliers from a CSV or JSON lines file into the database, upserting on email.
+
+    :param on_reject: Called with the line number, row and errors of every rejected row.
+    :param restore_deleted: Restore the soft-deleted suppliers of the file, which are rejected otherwise.
+    :return: A report with the number of rows read, imported and rejected, and the throughput.
+    """
+    return SupplierImporter(session, on_reject, restore_deleted).run(stream, file_format, batch_size)
+
+
+def import_products(session: Session, stream: TextIO, file_format: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                    on_reject: Callable[[dict], None] | None = None, restore_deleted: bool = False) -> dict:
+    """
+    Streams products from a CSV or JSON lines file into the database, upserting on SKU.
+
+    :param on_reject: Called with the line number, row and errors of every rejected row.
+    :param restore_deleted: Restore the soft-deleted products of the file, which are rejected otherwise.
+    :return: A report with the number of rows read, imported and rejected, and the throughput.
+    """
+    return ProductImporter(session, on_reject, restore_deleted).run(stream, file_format, batch_size)
@@ -0,0 +1,270 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from sqlalchemy.orm import make_transient_to_detached
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 300))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000))
+# Stock changes far more often than the rest of a product, so it is cached apart and only when this is above 0.
+CACHE_STOCK_TTL = float(os.environ.get('CACHE_STOCK_TTL', 0))
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+
+class CacheStats:
+    """
+    Thread-safe hit, miss and eviction counters of a cache backend.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'sets': 0, 'deletes': 0, 'evictions': 0, 'expirations': 0}
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counters)
+
+
+class CacheBackend:
+    """
+    Interface of the cache backends. Values must be JSON-serializable.
+    """
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> Any | None:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, *keys: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class NullCache(CacheBackend):
+    def get(self, key: str) -> Any | None:
+        self.stats.incr('misses')
+        return None
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        pass
+
+    def delete(self, *keys: str) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+
+class LRUCache(CacheBackend):
+    """
+    In-process cache that evicts the least recently used entry once `max_entries` is reached,
+    and drops entries older than their TTL when they are read.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.incr('misses')
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.stats.incr('expirations')
+                self.stats.incr('misses')
+                return None
+            self._entries.move_to_end(key)
+        self.stats.incr('hits')
+        return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        self.stats.incr('sets')
+        if evicted:
+            self.stats.incr('evictions', evicted)
+
+    def delete(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        self.stats.incr('deletes', len(keys))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisCache(CacheBackend):
+    """
+    Cache shared between processes, on any client with the `get`, `set(ex=...)` and `delete` methods
+    of redis-py, e.g. a Redis-compatible server or an in-memory stand-in like fakeredis.
+    Evictions happen on the server and are not counted here.
+    """
+
+    def __init__(self, client, ttl: float = CACHE_TTL, prefix: str = 'inventory:'):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Any | None:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats.incr('misses')
+            return None
+        self.stats.incr('hits')
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, round(ttl)))
+        self.stats.incr('sets')
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+        self.stats.incr('deletes', len(keys))
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(f'{self.prefix}*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+def build_cache(backend: str = CACHE_BACKEND) -> CacheBackend:
+    if backend == 'none':
+        return NullCache()
+    if backend == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(REDIS_URL))
+    if backend != 'memory':
+        logger.warning(f"Unknown cache backend {backend!r}, using the in-process cache")
+    return LRUCache()
+
+
+cache = build_cache()
+
+
+def configure_cache(backend: CacheBackend) -> None:
+    """
+    Replaces the cache used by the CRUD functions, e.g. with a `RedisCache` on a stand-in client.
+    """
+    global cache
+    cache = backend
+
+
+def get_cache() -> CacheBackend:
+    return cache
+
+
+def product_key(product_id: int) -> str:
+    return f'product:{product_id}'
+
+
+def product_stock_key(product_id: int) -> str:
+    return f'product_stock:{product_id}'
+
+
+def supplier_key(supplier_id: int) -> str:
+    return f'supplier:{supplier_id}'
+
+
+def get_product_stock(product_id: int) -> tuple[int, int] | None:
+    """
+    :return: The cached stock and reserved stock of a product, None if they aren't cached.
+    """
+    if CACHE_STOCK_TTL <= 0:
+        return None
+    cached = cache.get(product_stock_key(product_id))
+    return tuple(cached) if cached is not None else None
+
+
+def set_product_stock(product_id: int, stock: int, reserved: int | None = None) -> None:
+    """
+    Caches the stock of a product with its reserved stock. Without `reserved`, e.g. after a stock movement, which
+    doesn't change it, the cached one is kept, and nothing is cached if there is none.
+    """
+    if CACHE_STOCK_TTL <= 0:
+        return
+    if reserved is None:
+        cached = get_product_stock(product_id)
+        if cached is None:
+            return
+        reserved = cached[1]
+    cache.set(product_stock_key(product_id), [stock, reserved], ttl=CACHE_STOCK_TTL)
+
+
+def invalidate_product_stock(*product_ids: int) -> None:
+    """
+    Forgets the cached stock of products whose reserved stock changed.
+    """
+    cache.delete(*(product_stock_key(product_id) for product_id in product_ids))
+
+
+def invalidate_product(*product_ids: int) -> None:
+    cache.delete(*(product_key(product_id) for product_id in product_ids),
+                 *(product_stock_key(product_id) for product_id in product_ids))
+
+
+def invalidate_supplier(supplier_id: int) -> None:
+    cache.delete(supplier_key(supplier_id))
+
+
+def get_cached_product(product_id: int) -> dict | None:
+    return cache.get(product_key(product_id))
+
+
+def set_cached_product(product_id: int, fields: dict) -> None:
+    cache.set(product_key(product_id), fields)
+
+
+def get_cached_supplier(supplier_id: int) -> dict | None:
+    return cache.get(supplier_key(supplier_id))
+
+
+def set_cached_supplier(supplier_id: int, fields: dict) -> None:
+    cache.set(supplier_key(supplier_id), fields)
+
+
+def to_detached(model, fields: dict):
+    """
+    Builds an ORM instance from cached column values, in the detached state, so it can be merged into a
+    session with `load=False` without a database round trip.
+    """
+    instance = model(**fields)
+    make_transient_to_detached(instance)
+    return instance
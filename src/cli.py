@@ -1,17 +1,28 @@
 import argparse
-import logging.config
+import json
+import logging
+import shlex
+import sys
+from datetime import datetime, date
 
-from orm_setup import SessionLocal
-from models import OperationType
-from crud.supplier import create_supplier, get_supplier, update_supplier, delete_supplier
-from crud.product import create_product, get_product, update_product, delete_product, update_stock
+from enums import OperationType, STOCK_OPERATIONS
+from bulk import FILE_FORMATS, DEFAULT_BATCH_SIZE, EXPORT_ENTITIES, EXPORT_FORMATS, DEFAULT_CHUNK_SIZE
 
-from logger import LOGGING_CONF
+from logger import configure_logging
 
-logging.config.dictConfig(LOGGING_CONF)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-session = SessionLocal()
+# The database modules are imported by the commands that use them, so `--help` and argument errors return
+# without loading SQLAlchemy or connecting.
+
+
+def add_bulk_delete_arguments(parser: argparse.ArgumentParser) -> None:
+    ids = parser.add_mutually_exclusive_group(required=True)
+    ids.add_argument('--ids', nargs='+', type=int, help='IDs to delete')
+    ids.add_argument('--file', help='File of IDs to delete, one per line, "-" for stdin')
+    parser.add_argument('--soft', action='store_true', help='Only mark them as deleted')
+    parser.add_argument('--batch_size', type=int, help='Products deleted per transaction')
 
 
 def setup_parser():
@@ -35,6 +46,11 @@ def setup_parser():
 
     delete_supplier_parser = subparsers.add_parser('delete_supplier', help='Delete a supplier')
     delete_supplier_parser.add_argument('--id', required=True, type=int, help='ID of the supplier to delete')
+    delete_supplier_parser.add_argument('--soft', action='store_true',
+                                        help='Only mark the supplier and its products as deleted')
+
+    delete_suppliers_parser = subparsers.add_parser('delete_suppliers', help='Delete many suppliers and their products')
+    add_bulk_delete_arguments(delete_suppliers_parser)
 
     # Add subcommands for products
     create_product_parser = subparsers.add_parser('create_product', help='Create a new product')
@@ -57,87 +73,403 @@ def setup_parser():
 
     delete_product_parser = subparsers.add_parser('delete_product', help='Delete a product')
     delete_product_parser.add_argument('--id', required=True, type=int, help='ID of the product to delete')
+    delete_product_parser.add_argument('--soft', action='store_true', help='Only mark the product as deleted')
+
+    delete_products_parser = subparsers.add_parser('delete_products', help='Delete many products')
+    add_bulk_delete_arguments(delete_products_parser)
 
     # Add subcommands for stock operations
     update_stock_parser = subparsers.add_parser('update_stock', help='Update stock for a product')
     update_stock_parser.add_argument('--product_id', required=True, type=int, help='ID of the product')
     update_stock_parser.add_argument('--quantity', required=True, type=int, help='Quantity to add or remove')
-    update_stock_parser.add_argument('--operation', required=True, choices=[op.name for op in OperationType], )
+    update_stock_parser.add_argument('--operation', required=True, choices=[op.name for op in STOCK_OPERATIONS], )
+
+    bulk_update_stock_parser = subparsers.add_parser('bulk_update_stock',
+                                                     help='Apply many stock movements in one transaction')
+    bulk_update_stock_parser.add_argument('--file', required=True,
+                                          help='JSON array or JSON lines file of {product_id, quantity, operation} '
+                                               'objects, "-" for stdin')
+    bulk_update_stock_parser.add_argument('--all_or_nothing', action='store_true',
+                                          help='Roll back the whole batch if any movement fails')
+
+    import_parser = subparsers.add_parser('import', help='Import products or suppliers from a CSV or JSON lines file')
+    import_parser.add_argument('--entity', required=True, choices=['product', 'supplier'], help='What to import')
+    import_parser.add_argument('--file', required=True, help='File to import')
+    import_parser.add_argument('--format', choices=FILE_FORMATS, help='File format, guessed from the extension if omitted')
+    import_parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows written per statement')
+    import_parser.add_argument('--rejected', help='Where to write rejected rows, defaults to <file>.rejected.jsonl')
+    import_parser.add_argument('--restore_deleted', action='store_true',
+                               help='Restore the soft-deleted rows of the file, which are rejected otherwise')
+
+    export_parser = subparsers.add_parser('export', help='Export products or stock transactions')
+    export_parser.add_argument('--entity', required=True, choices=EXPORT_ENTITIES, help='What to export')
+    export_parser.add_argument('--format', default='csv', choices=EXPORT_FORMATS, help='Output format')
+    export_parser.add_argument('--output', default='-', help='File to write, "-" for stdout (not for parquet)')
+    export_parser.add_argument('--supplier_id', type=int, help='Only export products of this supplier')
+    export_parser.add_argument('--start', type=datetime.fromisoformat, help='Only transactions on or after this date')
+    export_parser.add_argument('--end', type=datetime.fromisoformat, help='Only transactions before this date')
+    export_parser.add_argument('--chunk_size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows fetched at a time')
+
+    snapshot_parser = subparsers.add_parser('snapshot_stock',
+                                            help='Roll the stock snapshots forward with the latest transactions')
+    snapshot_parser.add_argument('--as_of', type=datetime.fromisoformat,
+                                 help='Point in time of the snapshots, defaults to a few minutes ago')
+    snapshot_parser.add_argument('--baseline', action='store_true',
+                                 help='First snapshot the current stock of products without snapshots')
+
+    reconcile_parser = subparsers.add_parser('reconcile_stock', help='Check product stock against the ledger')
+    reconcile_parser.add_argument('--chunk_size', type=int, help='Products checked per query')
+    reconcile_parser.add_argument('--workers', type=int, default=4, help='Chunks checked in parallel')
+
+    expire_holds_parser = subparsers.add_parser('expire_holds', help='Release the stock of expired holds')
+    expire_holds_parser.add_argument('--batch_size', type=int, help='Holds released per transaction')
+
+    purge_keys_parser = subparsers.add_parser('purge_idempotency_keys', help='Delete the expired idempotency keys')
+    purge_keys_parser.add_argument('--batch_size', type=int, help='Keys deleted per transaction')
+
+    relay_parser = subparsers.add_parser('relay_changes', help='Publish the new change events to the outbox sink')
+    relay_parser.add_argument('--batch_size', type=int, help='Events published per transaction')
+
+    thresholds_parser = subparsers.add_parser('evaluate_reorder_thresholds',
+                                              help='Check every product against its reorder threshold')
+    thresholds_parser.add_argument('--supplier_id', type=int, help='Only check the products of this supplier')
+
+    stripes_parser = subparsers.add_parser('configure_stripes',
+                                           help='Split the stock of a hot product across several rows')
+    stripes_parser.add_argument('--product_id', required=True, type=int, help='ID of the product')
+    stripes_parser.add_argument('--stripe_count', required=True, type=int, help='Number of stripes, 0 to stop')
+
+    subparsers.add_parser('rebalance_stripes', help='Even out the stock stripes of striped products')
+
+    subparsers.add_parser('rebuild_supplier_summaries',
+                          help='Recompute the supplier summaries from the products, to repair them')
+
+    partitions_parser = subparsers.add_parser('partitions',
+                                              help='Create upcoming transaction partitions and detach old ones')
+    partitions_parser.add_argument('--months_ahead', type=int,
+                                   help='Months of partitions to create ahead of the current one')
+    partitions_parser.add_argument('--retain_months', type=int,
+                                   help='Detach partitions older than this many months, keeps all if omitted')
+    partitions_parser.add_argument('--drop', action='store_true', help='Drop the detached partitions')
+
+    batch_parser = subparsers.add_parser('batch', help='Run many commands, one per line, over one session')
+    batch_parser.add_argument('--file', default='-',
+                              help='File of commands, "-" for stdin, which prompts for them on a terminal')
+    batch_parser.add_argument('--stop_on_error', action='store_true', help='Stop at the first failed command')
 
     return parser
 
 
+def read_ids(args) -> list[int]:
+    if args.ids is not None:
+        return args.ids
+    stream = sys.stdin if args.file == '-' else open(args.file)
+    try:
+        return [int(line) for line in stream if line.strip()]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def read_movements(path: str) -> list[tuple[int, int, OperationType]]:
+    stream = sys.stdin if path == '-' else open(path)
+    try:
+        content = stream.read().strip()
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    if content.startswith('['):
+        items = json.loads(content)
+    else:
+        items = [json.loads(line) for line in content.splitlines() if line.strip()]
+    return [(int(item['product_id']), int(item['quantity']), OperationType[item['operation']]) for item in items]
+
+
+def run_create_supplier(session, args):
+    from crud.supplier import create_supplier
+    supplier = create_supplier(session, args.name, args.email, args.phone_number)
+    logger.info(f"Created new supplier {supplier}")
+
+
+def run_get_supplier(session, args):
+    from crud.supplier import get_supplier
+    supplier = get_supplier(session, args.id)
+    if supplier:
+        logger.info(f"Retrieved supplier: {supplier}")
+    else:
+        logger.info(f"Supplier with ID {args.id} not found")
+
+
+def run_update_supplier(session, args):
+    from crud.supplier import update_supplier
+    supplier = update_supplier(session, args.id, args.name, args.email, args.phone_number)
+    if supplier:
+        logger.info(f"Updated supplier {supplier}")
+    else:
+        logger.info(f"Supplier with ID {args.id} not found")
+
+
+def run_delete_supplier(session, args):
+    from crud.supplier import delete_supplier
+    if delete_supplier(session, args.id, args.soft):
+        logger.info(f"Deleted supplier with ID {args.id}")
+    else:
+        logger.info(f"Supplier with ID {args.id} not found")
+
+
+def run_create_product(session, args):
+    from crud.product import create_product
+    product = create_product(session, args.name, args.description, args.sku, args.price, args.stock, args.supplier_id)
+    logger.info(f"Created new product {product.id} with stock {product.stock}")
+
+
+def run_get_product(session, args):
+    from crud.product import get_product
+    product = get_product(session, args.id)
+    if product:
+        logger.info(f"Retrieved product {product}")
+    else:
+        logger.info(f"Product with ID {args.id} not found")
+
+
+def run_update_product(session, args):
+    from crud.product import update_product
+    product = update_product(session, args.id, args.name, args.description, args.sku, args.price)
+    if product:
+        logger.info(f"Updated product {product}")
+    else:
+        logger.info(f"Product with ID {args.id} not found")
+
+
+def run_delete_product(session, args):
+    from crud.product import delete_product
+    if delete_product(session, args.id, args.soft):
+        logger.info(f"Deleted product with ID {args.id}")
+    else:
+        logger.info(f"Product with ID {args.id} not found")
+
+
+def run_delete_suppliers(session, args):
+    from crud.delete import delete_suppliers, DELETE_BATCH_SIZE
+    ids = read_ids(args)
+    deleted = delete_suppliers(session, ids, args.soft, args.batch_size or DELETE_BATCH_SIZE)
+    logger.info(f"Deleted {deleted} of {len(set(ids))} suppliers")
+
+
+def run_delete_products(session, args):
+    from crud.delete import delete_products, DELETE_BATCH_SIZE
+    ids = read_ids(args)
+    deleted = delete_products(session, ids, args.soft, args.batch_size or DELETE_BATCH_SIZE)
+    logger.info(f"Deleted {deleted} of {len(set(ids))} products")
+
+
+def run_update_stock(session, args):
+    from crud.product import update_stock
+    stock = update_stock(session, args.product_id, args.quantity, OperationType[args.operation])
+    logger.info(f"Updated stock for product {args.product_id}, it is now {stock}")
+
+
+def run_bulk_update_stock(session, args):
+    from crud.product import bulk_update_stock
+    for result in bulk_update_stock(session, read_movements(args.file), all_or_nothing=args.all_or_nothing):
+        if result['success']:
+            logger.info(f"Movement {result['index']}: product {result['product_id']} stock is now {result['stock']}")
+        else:
+            logger.info(f"Movement {result['index']}: {result['detail']}")
+
+
+def run_import(session, args):
+    from bulk.importer import import_products, import_suppliers, detect_format
+    importer = import_products if args.entity == 'product' else import_suppliers
+    file_format = args.format or detect_format(args.file)
+    with open(args.file, newline='') as stream, open(args.rejected or f'{args.file}.rejected.jsonl', 'w') as rejected:
+        report = importer(session, stream, file_format, args.batch_size,
+                          on_reject=lambda row: rejected.write(json.dumps(row, default=str) + '\n'),
+                          restore_deleted=args.restore_deleted)
+    logger.info(f"Read {report['read']} rows: {report['imported']} imported, {report['rejected']} rejected, "
+                f"{report['seconds']} s, {report['rows_per_second']} rows/s")
+
+
+def run_export(session, args):
+    from bulk.exporter import export_to_file
+    rows = export_to_file(session, args.entity, args.format, sys.stdout if args.output == '-' else args.output,
+                          supplier_id=args.supplier_id, start=args.start, end=args.end, chunk_size=args.chunk_size)
+    logger.info(f"Exported {rows} rows")
+
+
+def run_snapshot_stock(session, args):
+    from crud.ledger import roll_snapshots, baseline_snapshots
+    if args.baseline:
+        logger.info(f"Wrote {baseline_snapshots(session)} baseline snapshots")
+    logger.info(f"Wrote {roll_snapshots(session, args.as_of)} snapshots")
+
+
+def run_reconcile_stock(session, args):
+    from orm_setup import SessionLocal
+    from crud.ledger import reconcile_stock, DEFAULT_RECONCILE_CHUNK_SIZE
+    mismatches = reconcile_stock(SessionLocal, args.chunk_size or DEFAULT_RECONCILE_CHUNK_SIZE, args.workers)
+    for mismatch in mismatches:
+        logger.warning(f"Product {mismatch['product_id']} has stock {mismatch['stock']}, "
+                       f"the ledger says {mismatch['ledger']}")
+    logger.info(f"{len(mismatches)} products differ from the ledger")
+
+
+def run_expire_holds(session, args):
+    from crud.hold import expire_holds, DEFAULT_EXPIRE_BATCH_SIZE
+    logger.info(f"Expired {expire_holds(session, args.batch_size or DEFAULT_EXPIRE_BATCH_SIZE)} holds")
+
+
+def run_purge_idempotency_keys(session, args):
+    from crud.idempotency import purge_idempotency_keys, DEFAULT_PURGE_BATCH_SIZE
+    logger.info(f"Purged {purge_idempotency_keys(session, args.batch_size or DEFAULT_PURGE_BATCH_SIZE)} "
+                f"idempotency keys")
+
+
+def run_relay_changes(session, args):
+    from crud.outbox import relay_change_events, DEFAULT_RELAY_BATCH_SIZE
+    from outbox import get_sink
+    published = relay_change_events(session, get_sink().publish, args.batch_size or DEFAULT_RELAY_BATCH_SIZE)
+    logger.info(f"Published {published} change events")
+
+
+def run_evaluate_reorder_thresholds(session, args):
+    from crud.alert import evaluate_reorder_thresholds
+    from models import Product
+    product_filter = Product.supplier_id == args.supplier_id if args.supplier_id is not None else None
+    logger.info(f"{evaluate_reorder_thresholds(session, product_filter)} products crossed their reorder threshold")
+
+
+def run_configure_stripes(session, args):
+    from crud.stripe import configure_stripes
+    stock = configure_stripes(session, args.product_id, args.stripe_count)
+    if stock is None:
+        logger.info(f"Product with ID {args.product_id} not found")
+    else:
+        logger.info(f"Product {args.product_id} stock of {stock} is split across {args.stripe_count} stripes")
+
+
+def run_rebalance_stripes(session, args):
+    from crud.stripe import rebalance_stripes
+    logger.info(f"Rebalanced the stripes of {rebalance_stripes(session)} products")
+
+
+def run_rebuild_supplier_summaries(session, args):
+    from crud.summary import rebuild_supplier_summaries
+    logger.info(f"Rebuilt the summaries of {rebuild_supplier_summaries(session)} suppliers")
+
+
+def run_partitions(session, args):
+    from orm_setup import get_engine
+    from partitions import ensure_partitions, detach_partitions, add_months, month_start, DEFAULT_MONTHS_AHEAD
+    with get_engine().begin() as connection:
+        ensure_partitions(connection, DEFAULT_MONTHS_AHEAD if args.months_ahead is None else args.months_ahead)
+        if args.retain_months is not None:
+            cutoff = add_months(month_start(date.today()), -args.retain_months)
+            detached = detach_partitions(connection, cutoff, drop=args.drop)
+            logger.info(f"{len(detached)} partitions older than {cutoff} {'dropped' if args.drop else 'detached'}")
+
+
+COMMANDS = {
+    'create_supplier': run_create_supplier,
+    'get_supplier': run_get_supplier,
+    'update_supplier': run_update_supplier,
+    'delete_supplier': run_delete_supplier,
+    'delete_suppliers': run_delete_suppliers,
+    'create_product': run_create_product,
+    'get_product': run_get_product,
+    'update_product': run_update_product,
+    'delete_product': run_delete_product,
+    'delete_products': run_delete_products,
+    'update_stock': run_update_stock,
+    'bulk_update_stock': run_bulk_update_stock,
+    'import': run_import,
+    'export': run_export,
+    'snapshot_stock': run_snapshot_stock,
+    'reconcile_stock': run_reconcile_stock,
+    'expire_holds': run_expire_holds,
+    'purge_idempotency_keys': run_purge_idempotency_keys,
+    'relay_changes': run_relay_changes,
+    'evaluate_reorder_thresholds': run_evaluate_reorder_thresholds,
+    'configure_stripes': run_configure_stripes,
+    'rebalance_stripes': run_rebalance_stripes,
+    'rebuild_supplier_summaries': run_rebuild_supplier_summaries,
+    'partitions': run_partitions,
+}
+
+
+def read_commands(path: str):
+    """
+    Yields (line number, command line) for the commands of a file, or of stdin. Blank lines and lines starting
+    with # are skipped. On a terminal, prompts for each command until `exit` or end of input.
+    """
+    if path == '-' and sys.stdin.isatty():
+        number = 0
+        while True:
+            try:
+                line = input('inventory> ').strip()
+            except EOFError:
+                return
+            number += 1
+            if line in ('exit', 'quit'):
+                return
+            if line and not line.startswith('#'):
+                yield number, line
+        return
+
+    stream = sys.stdin if path == '-' else open(path)
+    try:
+        for number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield number, line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def run_batch(session, parser: argparse.ArgumentParser, path: str, stop_on_error: bool = False) -> int:
+    """
+    Runs the commands of `path` one after the other over the same session, so they share one process and one
+    pooled connection. A failed command is logged and rolled back, and the next one runs unless `stop_on_error`.
+
+    :return: The number of failed commands.
+    """
+    failed = 0
+    for number, line in read_commands(path):
+        try:
+            args = parser.parse_args(shlex.split(line))
+            if args.command == 'batch':
+                raise ValueError("Batches can't be nested")
+            COMMANDS[args.command](session, args)
+            # Ends the read transaction of a lookup too, so the next command sees fresh data.
+            session.commit()
+        except (Exception, SystemExit) as e:
+            # argparse exits on invalid arguments, after printing why.
+            session.rollback()
+            failed += 1
+            logger.error(f"Line {number} failed: {line}" + (f": {e}" if isinstance(e, Exception) else ''))
+            if stop_on_error:
+                break
+    return failed
+
+
 def main():
     parser = setup_parser()
     args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return
 
-    log_messages = []
-    with session.begin():
-        if args.command == 'create_supplier':
-            supplier = create_supplier(session, args.name, args.email, args.phone_number)
-            session.flush()
-            log_messages.append(f"Created new supplier {supplier}")
-
-        elif args.command == 'get_supplier':
-            supplier = get_supplier(session, args.id)
-            if supplier:
-                log_messages.append(f"Retrieved supplier: {supplier}")
-            else:
-                log_messages.append(f"Supplier with ID {args.id} not found")
-
-        elif args.command == 'update_supplier':
-            supplier = update_supplier(session, args.id, args.name, args.email, args.phone_number)
-            if supplier:
-                session.flush()
-                log_messages.append(f"Updated supplier {supplier}")
-            else:
-                log_messages.append(f"Supplier with ID {args.id} not found")
-
-        elif args.command == 'delete_supplier':
-            deleted = delete_supplier(session, args.id)
-            if deleted:
-                log_messages.append(f"Deleted supplier with ID {args.id}")
-            else:
-                log_messages.append(f"Supplier with ID {args.id} not found")
-
-        elif args.command == 'create_product':
-            product = create_product(session, args.name, args.description, args.sku, args.price, args.supplier_id)
-            session.flush()
-            log_messages.append(f"Created new product {product.id}")
-            update_stock(session, product.id, args.stock, OperationType.ADD)
-            log_messages.append(f"Updated stock for product {product.id} to {args.stock}")
-
-        elif args.command == 'get_product':
-            product = get_product(session, args.id)
-            if product:
-                log_messages.append(f"Retrieved product {product}")
-            else:
-                log_messages.append(f"Product with ID {args.id} not found")
-
-        elif args.command == 'update_product':
-            product = update_product(session, args.id, args.name, args.description, args.sku, args.price)
-            if product:
-                session.flush()
-                log_messages.append(f"Updated product {product}")
-            else:
-                log_messages.append(f"Product with ID {args.id} not found")
-
-        elif args.command == 'delete_product':
-            deleted = delete_product(session, args.id)
-            if deleted:
-                log_messages.append(f"Deleted product with ID {args.id}")
-            else:
-                log_messages.append(f"Product with ID {args.id} not found")
-
-        elif args.command == 'update_stock':
-            updated = update_stock(session, args.product_id, args.quantity, OperationType[args.operation])
-            if updated:
-                log_messages.append(f"Updated stock for product {args.product_id}")
-            else:
-                log_messages.append(f"Not possible to update stock for product {args.product_id}")
-
-    for message in log_messages:
-        logger.info(message)
+    from orm_setup import SessionLocal, init_engine
+    init_engine()
+    with SessionLocal() as session:
+        if args.command == 'batch':
+            failed = run_batch(session, parser, args.file, args.stop_on_error)
+            if failed:
+                logger.error(f"{failed} commands failed")
+                sys.exit(1)
+            return
+        COMMANDS[args.command](session, args)
 
 
 if __name__ == '__main__':
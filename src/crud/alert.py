@@ -0,0 +1,87 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import select, update, and_, or_, not_, case, func, true
+from sqlalchemy.orm import Session
+from alerts import queue_alerts
+from decorators import handle_exceptions, retry_on_conflict
+from models import Product, Supplier
+from crud.stripe import TOTAL_STOCK
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOW_STOCK_LIMIT = 100
+
+# Reorder threshold of the product of the enclosing query: its own, otherwise the one of its supplier.
+REORDER_THRESHOLD = func.coalesce(Product.reorder_threshold,
+                                  select(Supplier.reorder_threshold)
+                                  .where(Supplier.id == Product.supplier_id)
+                                  .correlate(Product)
+                                  .scalar_subquery())
+# Stock of the product that is not reserved by a hold.
+AVAILABLE_STOCK = TOTAL_STOCK - Product.reserved
+_BELOW = and_(REORDER_THRESHOLD.is_not(None), AVAILABLE_STOCK < REORDER_THRESHOLD)
+
+LOW_STOCK_FIELDS = ('id', 'sku', 'name', 'supplier_id', 'available', 'threshold', 'low_stock_since')
+
+
+def detect_crossings(session: Session, product_filter) -> int:
+    """
+    Flags or unflags the products matching `product_filter` that crossed their reorder threshold, in the
+    transaction of the stock change, and queues an alert for each of them, delivered once it commits.
+
+    A single UPDATE only touches the products whose flag is wrong, so a change that stays on the same side of the
+    threshold costs one indexed read and no write.
+
+    :return: The number of products that crossed.
+    """
+    now = datetime.now()
+    crossed = or_(and_(Product.low_stock_since.is_(None), _BELOW),
+                  and_(Product.low_stock_since.is_not(None), not_(_BELOW)))
+    rows = session.execute(update(Product)
+                           .where(product_filter, Product.deleted_at.is_(None), crossed)
+                           .values(low_stock_since=case((_BELOW, now), else_=None))
+                           .returning(Product.id, Product.supplier_id, AVAILABLE_STOCK, REORDER_THRESHOLD,
+                                      Product.low_stock_since)
+                           .execution_options(synchronize_session=False)).all()
+    queue_alerts(session, [{'product_id': product_id, 'supplier_id': supplier_id, 'available': available,
+                            'threshold': threshold, 'below': since is not None, 'at': now}
+                           for product_id, supplier_id, available, threshold, since in rows])
+    return len(rows)
+
+
+@handle_exceptions()
+@retry_on_conflict()
+def evaluate_reorder_thresholds(session: Session, product_filter=None) -> int:
+    """
+    Checks every product against its reorder threshold, e.g. after the thresholds were changed in the database or
+    to flag the existing products once the columns are added.
+
+    :return: The number of products that crossed.
+    """
+    crossed = detect_crossings(session, product_filter if product_filter is not None else true())
+    session.commit()
+    if crossed:
+        logger.info(f"{crossed} products crossed their reorder threshold")
+    return crossed
+
+
+@handle_exceptions()
+def list_low_stock_products(session: Session, after_id: int | None = None, limit: int = DEFAULT_LOW_STOCK_LIMIT,
+                            supplier_id: int | None = None) -> list[dict]:
+    """
+    Lists the products below their reorder threshold, in id order, from the partial index on the flagged products.
+
+    :param after_id: Id of the last product of the previous page.
+    :return: Up to `limit` products, as dicts of `LOW_STOCK_FIELDS`.
+    """
+    query = (select(Product.id, Product.sku, Product.name, Product.supplier_id, AVAILABLE_STOCK.label('available'),
+                    REORDER_THRESHOLD.label('threshold'), Product.low_stock_since)
+             .where(Product.low_stock_since.is_not(None))
+             .order_by(Product.id)
+             .limit(limit))
+    if after_id is not None:
+        query = query.where(Product.id > after_id)
+    if supplier_id is not None:
+        query = query.where(Product.supplier_id == supplier_id)
+    return [row._asdict() for row in session.execute(query)]
@@ -0,0 +1,103 @@
+import logging
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import set_product_stock
+from decorators import handle_exceptions, retry_on_conflict
+from models import Product, ProductTransaction, OperationType, ChangeType
+from crud.stripe import TOTAL_STOCK
+from crud.product import (STOCK_ISOLATION_LEVEL, _stock_update_statement, _stock_error_message, _write_stock_movements,
+                          _apply_striped_movement, _check_stock_operation, _stock_change)
+from crud.summary import stock_change_delta
+from crud.outbox import change_events
+from crud.alert import detect_crossings
+from crud import search, delete, product
+
+logger = logging.getLogger(__name__)
+
+
+@handle_exceptions()
+async def create_product(session: AsyncSession,
+                         name: str,
+                         description: str,
+                         sku: str,
+                         price: float,
+                         stock: int,
+                         supplier_id: int) -> Product | None:
+    return await session.run_sync(product.create_product, name, description, sku, price, stock, supplier_id)
+
+
+@handle_exceptions()
+async def get_product(session: AsyncSession, product_id: int) -> Product | None:
+    return await session.run_sync(product.get_product, product_id)
+
+
+@handle_exceptions()
+async def update_product(session: AsyncSession, product_id: int, name: str = None, description: str = None,
+                         sku: str = None, price: float = None) -> Product | None:
+    return await session.run_sync(product.update_product, product_id, name, description, sku, price)
+
+
+@handle_exceptions()
+async def delete_product(session: AsyncSession, product_id: int, soft: bool = False) -> bool:
+    return await session.run_sync(delete.delete_products, [product_id], soft) == 1
+
+
+@handle_exceptions()
+async def get_transaction(session: AsyncSession, transaction_id: int) -> ProductTransaction | None:
+    return await session.scalar(select(ProductTransaction).filter_by(id=transaction_id))
+
+
+async def _use_stock_isolation(session: AsyncSession) -> None:
+    if not session.in_transaction() and session.bind.dialect.name == 'postgresql':
+        await session.connection(execution_options={'isolation_level': STOCK_ISOLATION_LEVEL})
+
+
+@handle_exceptions()
+@retry_on_conflict()
+async def update_stock(
+        session: AsyncSession,
+        product_id: int,
+        quantity: int,
+        operation: OperationType) -> int:
+    _check_stock_operation(operation)
+    await _use_stock_isolation(session)
+    stock = await session.scalar(_stock_update_statement(product_id, quantity, operation))
+    if stock is None:
+        stock = await session.run_sync(_apply_striped_movement, product_id, quantity, operation)
+    if stock is None:
+        available = await session.scalar(select(TOTAL_STOCK - Product.reserved).filter(Product.id == product_id))
+        await session.rollback()
+        message = _stock_error_message(product_id, quantity, available)
+        logger.error(message)
+        raise ValueError(message)
+
+    session.add(ProductTransaction(product_id=product_id, operation=operation, quantity=quantity))
+    await session.execute(stock_change_delta(product_id, _stock_change(quantity, operation)))
+    await session.execute(change_events(Product.id == product_id, ChangeType.STOCK))
+    await session.run_sync(detect_crossings, Product.id == product_id)
+    await session.commit()
+    set_product_stock(product_id, stock)
+    return stock
+
+
+@handle_exceptions()
+@retry_on_conflict()
+async def bulk_update_stock(
+        session: AsyncSession,
+        movements: list[tuple[int, int, OperationType]],
+        all_or_nothing: bool = False) -> list[dict]:
+    await _use_stock_isolation(session)
+    results, stock = await session.run_sync(_write_stock_movements, movements, all_or_nothing)
+    if not stock:
+        await session.rollback()
+        return results
+    await session.commit()
+    for product_id, product_stock in stock.items():
+        set_product_stock(product_id, product_stock)
+    return results
+
+
+@handle_exceptions()
+async def search_products(session: AsyncSession, query: str, limit: int = 20, offset: int = 0) -> list[dict]:
+    return await session.run_sync(search.search_products, query, limit, offset)
@@ -0,0 +1,88 @@
+import logging
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import get_cached_supplier, set_cached_supplier, invalidate_supplier, to_detached
+from decorators import handle_exceptions
+from models import Supplier
+from crud.supplier import SUPPLIER_FIELDS
+from crud import summary, delete
+
+logger = logging.getLogger(__name__)
+
+
+@handle_exceptions()
+async def create_supplier(session: AsyncSession, name: str, email: str, phone_number: str) -> Supplier:
+    try:
+        new_supplier = Supplier(
+            name=name,
+            email=email,
+            phone_number=phone_number
+        )
+        session.add(new_supplier)
+        await session.commit()
+        await session.refresh(new_supplier)
+        return new_supplier
+    except IntegrityError:
+        await session.rollback()
+        raise ValueError(f"Supplier with email {email} already exists.")
+    except Exception as e:
+        await session.rollback()
+        logger.error(f"Error creating supplier: {e}")
+        raise ValueError("An error occurred while creating the supplier.")
+
+
+@handle_exceptions()
+async def get_supplier(session: AsyncSession, supplier_id: int) -> Supplier | None:
+    fields = get_cached_supplier(supplier_id)
+    if fields is not None:
+        return await session.merge(to_detached(Supplier, fields), load=False)
+
+    supplier = await session.scalar(select(Supplier).filter_by(id=supplier_id))
+    if supplier:
+        set_cached_supplier(supplier_id, {field: getattr(supplier, field) for field in SUPPLIER_FIELDS})
+    return supplier
+
+
+@handle_exceptions()
+async def update_supplier(session: AsyncSession, supplier_id: int, name: str = None, email: str = None,
+                          phone_number: str = None) -> Supplier | None:
+    supplier = await session.scalar(select(Supplier).filter_by(id=supplier_id))
+    if not supplier:
+        return None
+
+    try:
+        if name:
+            supplier.name = name
+        if email:
+            supplier.email = email
+        if phone_number:
+            supplier.phone_number = phone_number
+        await session.commit()
+        invalidate_supplier(supplier_id)
+        await session.refresh(supplier)
+        return supplier
+    except IntegrityError:
+        await session.rollback()
+        raise ValueError(f"Supplier with email {email} already exists.")
+    except Exception as e:
+        await session.rollback()
+        logger.error(f"Error updating supplier: {e}")
+        raise ValueError("An error occurred while updating the supplier.")
+
+
+@handle_exceptions()
+async def delete_supplier(session: AsyncSession, supplier_id: int, soft: bool = False) -> bool:
+    return await session.run_sync(delete.delete_suppliers, [supplier_id], soft) == 1
+
+
+@handle_exceptions()
+async def list_supplier_summaries(session: AsyncSession, after_id: int | None = None,
+                                  limit: int = 100) -> list[dict]:
+    return await session.run_sync(summary.list_supplier_summaries, after_id, limit)
+
+
+@handle_exceptions()
+async def get_supplier_summary(session: AsyncSession, supplier_id: int) -> dict | None:
+    return await session.run_sync(summary.get_supplier_summary, supplier_id)
@@ -0,0 +1,130 @@
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+from cache import invalidate_supplier, invalidate_product
+from decorators import handle_exceptions
+from search_index import invalidate_search_index
+from models import (Product, ProductTransaction, ProductStockStripe, StockHold, StockSnapshot, Supplier, SupplierSummary,
+                    ChangeType)
+from crud.summary import product_deltas
+from crud.outbox import change_events
+
+logger = logging.getLogger(__name__)
+
+# Products deleted per transaction. Bounds the rows locked, and the memory used, by a delete however many products
+# and transactions it removes in total.
+DELETE_BATCH_SIZE = int(os.environ.get('DELETE_BATCH_SIZE', 1000))
+
+# Rows that reference a product. Their foreign keys cascade on databases created with ON DELETE CASCADE, deleting
+# them explicitly also covers older databases, and SQLite without foreign key enforcement.
+_PRODUCT_CHILDREN = (ProductTransaction, StockHold, StockSnapshot, ProductStockStripe)
+
+
+def _delete_product_batch(session: Session, product_filter, soft: bool, batch_size: int, now: datetime) -> list[int]:
+    """
+    Deletes, or soft-deletes, up to `batch_size` products matching `product_filter` with set-based statements,
+    without committing. Nothing is loaded into the session.
+
+    :return: The ids of the deleted products.
+    """
+    # Locked in id order, so concurrent deletes and stock movements can't deadlock each other. A hard delete also
+    # purges the products that were soft-deleted before.
+    product_ids = list(session.scalars(select(Product.id)
+                                       .where(product_filter)
+                                       .order_by(Product.id)
+                                       .limit(batch_size)
+                                       .with_for_update()
+                                       .execution_options(include_deleted=not soft)))
+    if not product_ids:
+        return []
+
+    in_batch = Product.id.in_(product_ids)
+    session.execute(product_deltas(in_batch, -1))
+    session.execute(change_events(in_batch, ChangeType.DELETED))
+    if soft:
+        session.execute(update(Product).where(in_batch).values(deleted_at=now))
+        return product_ids
+    for model in _PRODUCT_CHILDREN:
+        session.execute(delete(model).where(model.product_id.in_(product_ids)))
+    session.execute(delete(Product).where(in_batch))
+    return product_ids
+
+
+@handle_exceptions()
+def delete_products(session: Session,
+                    product_ids: list[int],
+                    soft: bool = False,
+                    batch_size: int = DELETE_BATCH_SIZE) -> int:
+    """
+    Deletes many products, `batch_size` products per transaction, with their transactions, holds, snapshots and
+    stock stripes.
+
+    :param soft: Only set their `deleted_at`, which hides them from every query, see `soft_delete`.
+    :return: The number of deleted products, missing ids are skipped.
+    """
+    now = datetime.now()
+    product_ids = sorted(set(product_ids))
+    deleted = 0
+    try:
+        for start in range(0, len(product_ids), batch_size):
+            chunk = product_ids[start:start + batch_size]
+            deleted_ids = _delete_product_batch(session, Product.id.in_(chunk), soft, batch_size, now)
+            session.commit()
+            invalidate_product(*deleted_ids)
+            deleted += len(deleted_ids)
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error deleting products after deleting {deleted}: {e}")
+        raise ValueError("An error occurred while deleting the products.")
+    if deleted:
+        invalidate_search_index()
+    return deleted
+
+
+@handle_exceptions()
+def delete_suppliers(session: Session,
+                     supplier_ids: list[int],
+                     soft: bool = False,
+                     batch_size: int = DELETE_BATCH_SIZE) -> int:
+    """
+    Deletes many suppliers with all their products. The products go `batch_size` per transaction and the supplier
+    with the last batch, so a failed delete leaves the supplier with fewer products, and can be run again.
+
+    :param soft: Only set the `deleted_at` of the suppliers and their products.
+    :return: The number of deleted suppliers, missing ids are skipped.
+    """
+    now = datetime.now()
+    deleted = 0
+    try:
+        for supplier_id in sorted(set(supplier_ids)):
+            exists = session.scalar(select(Supplier.id)
+                                    .where(Supplier.id == supplier_id)
+                                    .execution_options(include_deleted=not soft))
+            if exists is None:
+                continue
+            while True:
+                product_ids = _delete_product_batch(session, Product.supplier_id == supplier_id, soft, batch_size, now)
+                if len(product_ids) < batch_size:
+                    break
+                session.commit()
+                invalidate_product(*product_ids)
+
+            if soft:
+                session.execute(update(Supplier).where(Supplier.id == supplier_id).values(deleted_at=now))
+            else:
+                session.execute(delete(SupplierSummary).where(SupplierSummary.supplier_id == supplier_id))
+                session.execute(delete(Supplier).where(Supplier.id == supplier_id))
+            session.commit()
+            invalidate_product(*product_ids)
+            invalidate_supplier(supplier_id)
+            deleted += 1
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Error deleting suppliers after deleting {deleted}: {e}")
+        raise ValueError("An error occurred while deleting the suppliers.")
+    if deleted:
+        invalidate_search_index()
+    return deleted
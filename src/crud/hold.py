@@ -0,0 +1,216 @@
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, insert, bindparam
+from sqlalchemy.orm import Session
+from cache import set_product_stock, invalidate_product_stock
+from decorators import handle_exceptions, retry_on_conflict
+from models import Product, ProductTransaction, StockHold, HoldStatus, OperationType, ChangeType
+from crud.product import _use_stock_isolation, _create_transaction, _stock_error_message
+from crud.stripe import TOTAL_STOCK, get_total_stock, take_stock
+from crud.summary import stock_change_delta
+from crud.outbox import change_events
+from crud.alert import detect_crossings
+
+logger = logging.getLogger(__name__)
+
+# How long a checkout can hold stock before the sweeper gives it back.
+HOLD_TTL = int(os.environ.get('HOLD_TTL_SECONDS', 900))
+DEFAULT_EXPIRE_BATCH_SIZE = 500
+
+_products = Product.__table__
+# Gives back the quantity of many expired holds with one executemany.
+_RELEASE_RESERVED = (update(_products)
+                     .where(_products.c.id == bindparam('product_id'))
+                     .values(reserved=_products.c.reserved - bindparam('released')))
+
+
+def _end_hold(session: Session, hold_id: int, status: HoldStatus, now: datetime | None = None) -> StockHold | None:
+    """
+    Moves an active hold to `status`. Only one of concurrent calls for the same hold succeeds.
+
+    :param now: If given, the hold must not have expired at this time.
+    :return: The hold, None if it wasn't active.
+    """
+    statement = update(StockHold).where(StockHold.id == hold_id, StockHold.status == HoldStatus.ACTIVE)
+    if now is not None:
+        statement = statement.where(StockHold.expires_at > now)
+    return session.scalars(statement.values(status=status).returning(StockHold)).one_or_none()
+
+
+def _hold_error(session: Session, hold_id: int) -> ValueError | None:
+    hold = session.get(StockHold, hold_id)
+    session.rollback()
+    if hold is None:
+        return None
+    if hold.status == HoldStatus.ACTIVE:
+        return ValueError(f'Hold {hold_id} expired at {hold.expires_at}')
+    return ValueError(f'Hold {hold_id} is already {hold.status.value.lower()}')
+
+
+def _reserve_from_stripes(session: Session, product_id: int, quantity: int) -> bool:
+    # Held stock is kept on the product row, so it is moved there from the stripes of a striped product.
+    stripe_count = (session.query(Product.stripe_count)
+                    .filter(Product.id == product_id, Product.deleted_at.is_(None))
+                    .scalar())
+    if not stripe_count or not take_stock(session, product_id, quantity, stripe_count):
+        return False
+    session.execute(update(Product)
+                    .where(Product.id == product_id, Product.deleted_at.is_(None))
+                    .values(stock=Product.stock + quantity, reserved=Product.reserved + quantity))
+    return True
+
+
+@handle_exceptions()
+@retry_on_conflict()
+def reserve_stock(session: Session, product_id: int, quantity: int, ttl: int | None = None) -> StockHold:
+    """
+    Holds part of the available stock of a product for a checkout.
+
+    The quantity is moved to `Product.reserved` with one conditional UPDATE, so the product row is only
+    locked for the duration of that statement, not while the customer pays.
+
+    :param ttl: Seconds until the hold expires, `HOLD_TTL` by default.
+    :return: The new hold.
+    """
+    _use_stock_isolation(session)
+    updated = session.execute(update(Product)
+                              .where(Product.id == product_id, Product.deleted_at.is_(None),
+                                     Product.available >= quantity)
+                              .values(reserved=Product.reserved + quantity)
+                              .returning(Product.id)).scalar_one_or_none()
+    if updated is None and _reserve_from_stripes(session, product_id, quantity):
+        updated = product_id
+    if updated is None:
+        available = session.query(TOTAL_STOCK - Product.reserved).filter(Product.id == product_id).scalar()
+        session.rollback()
+        message = _stock_error_message(product_id, quantity, available)
+        logger.error(message)
+        raise ValueError(message)
+
+    hold = StockHold(product_id=product_id, quantity=quantity,
+                     expires_at=datetime.now() + timedelta(seconds=ttl or HOLD_TTL))
+    session.add(hold)
+    _create_transaction(session, product_id, operation=OperationType.RESERVE, quantity=quantity)
+    session.execute(change_events(Product.id == product_id, ChangeType.STOCK))
+    detect_crossings(session, Product.id == product_id)
+    session.commit()
+    invalidate_product_stock(product_id)
+    session.refresh(hold)
+    return hold
+
+
+@handle_exceptions()
+def get_hold(session: Session, hold_id: int) -> StockHold | None:
+    return session.query(StockHold).filter_by(id=hold_id).first()
+
+
+@handle_exceptions()
+@retry_on_conflict()
+def confirm_hold(session: Session, hold_id: int) -> StockHold | None:
+    """
+    Turns an active, unexpired hold into a sale of its quantity.
+
+    :return: The confirmed hold, None if it does not exist.
+    """
+    _use_stock_isolation(session)
+    hold = _end_hold(session, hold_id, HoldStatus.CONFIRMED, now=datetime.now())
+    if hold is None:
+        error = _hold_error(session, hold_id)
+        if error:
+            raise error
+        return None
+
+    stock, reserved, stripe_count = session.execute(update(Product)
+                                                    .where(Product.id == hold.product_id)
+                                                    .values(stock=Product.stock - hold.quantity,
+                                                            reserved=Product.reserved - hold.quantity)
+                                                    .returning(Product.stock, Product.reserved,
+                                                               Product.stripe_count)).one()
+    if stripe_count:
+        stock = get_total_stock(session, hold.product_id)
+    _create_transaction(session, hold.product_id, operation=OperationType.SALE, quantity=hold.quantity)
+    session.execute(stock_change_delta(hold.product_id, -hold.quantity))
+    session.execute(change_events(Product.id == hold.product_id, ChangeType.STOCK))
+    detect_crossings(session, Product.id == hold.product_id)
+    session.commit()
+    set_product_stock(hold.product_id, stock, reserved)
+    return hold
+
+
+@handle_exceptions()
+@retry_on_conflict()
+def release_hold(session: Session, hold_id: int) -> StockHold | None:
+    """
+    Gives the quantity of an active hold back to the available stock.
+
+    :return: The released hold, None if it does not exist.
+    """
+    _use_stock_isolation(session)
+    hold = _end_hold(session, hold_id, HoldStatus.RELEASED)
+    if hold is None:
+        error = _hold_error(session, hold_id)
+        if error:
+            raise error
+        return None
+
+    session.execute(update(Product)
+                    .where(Product.id == hold.product_id)
+                    .values(reserved=Product.reserved - hold.quantity))
+    _create_transaction(session, hold.product_id, operation=OperationType.RELEASE, quantity=hold.quantity)
+    session.execute(change_events(Product.id == hold.product_id, ChangeType.STOCK))
+    detect_crossings(session, Product.id == hold.product_id)
+    session.commit()
+    invalidate_product_stock(hold.product_id)
+    return hold
+
+
+@handle_exceptions()
+def expire_holds(session: Session, batch_size: int = DEFAULT_EXPIRE_BATCH_SIZE, now: datetime | None = None) -> int:
+    """
+    Releases the active holds that expired before `now`, `batch_size` holds per transaction.
+
+    Holds are claimed with FOR UPDATE SKIP LOCKED, so several sweepers can run at once without waiting on
+    each other or on a checkout confirming one of the holds.
+
+    :return: The number of expired holds.
+    """
+    now = now or datetime.now()
+    expired = 0
+    while True:
+        _use_stock_isolation(session)
+        claimed = (select(StockHold.id)
+                   .where(StockHold.status == HoldStatus.ACTIVE, StockHold.expires_at <= now)
+                   .order_by(StockHold.expires_at)
+                   .limit(batch_size)
+                   .with_for_update(skip_locked=True))
+        holds = session.execute(update(StockHold)
+                                .where(StockHold.id.in_(claimed))
+                                .values(status=HoldStatus.EXPIRED)
+                                .returning(StockHold.product_id, StockHold.quantity)).all()
+        if not holds:
+            session.rollback()
+            break
+
+        released = defaultdict(int)
+        for product_id, quantity in holds:
+            released[product_id] += quantity
+        # Products are updated in id order, so concurrent sweepers can't deadlock each other.
+        session.connection().execute(_RELEASE_RESERVED, [{'product_id': product_id, 'released': released[product_id]}
+                                                         for product_id in sorted(released)])
+        session.execute(insert(ProductTransaction), [
+            {'product_id': product_id, 'operation': OperationType.RELEASE, 'quantity': quantity}
+            for product_id, quantity in holds])
+        session.execute(change_events(Product.id.in_(sorted(released)), ChangeType.STOCK))
+        detect_crossings(session, Product.id.in_(sorted(released)))
+        session.commit()
+        invalidate_product_stock(*released)
+        expired += len(holds)
+        if len(holds) < batch_size:
+            break
+
+    if expired:
+        logger.info(f"Expired {expired} stock holds")
+    return expired
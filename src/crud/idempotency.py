@@ -0,0 +1,105 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+from decorators import handle_exceptions
+from models import IdempotencyKey
+from crud.product import _use_stock_isolation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PURGE_BATCH_SIZE = 1000
+
+
+def _insert(session: Session):
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f'Upserts are not supported on {dialect}')
+    return insert(IdempotencyKey)
+
+
+@handle_exceptions()
+def claim_idempotency_key(session: Session, key: str, fingerprint: str, lease: float) -> IdempotencyKey | None:
+    """
+    Records that the request of `key` is being processed, in its own transaction, unless the key is already taken.
+
+    Claiming is a single INSERT ... ON CONFLICT, so of concurrent requests with the same key, in any process, only
+    one claims it. An expired key is claimed again, as if it were new.
+
+    :param lease: Seconds the claim lasts without a stored response, so the key of a request whose process died
+        can be claimed again.
+
+    :return: None if the key was claimed, otherwise its row, with the stored response or without one if the request
+        is still being processed.
+    """
+    # READ COMMITTED, so a concurrent claim waits for the other one instead of failing to serialize.
+    _use_stock_isolation(session)
+    now = datetime.now()
+    statement = _insert(session).values(key=key, fingerprint=fingerprint, created_at=now,
+                                        expires_at=now + timedelta(seconds=lease))
+    statement = statement.on_conflict_do_update(
+        index_elements=['key'],
+        set_={'fingerprint': statement.excluded.fingerprint, 'status_code': None, 'response': None,
+              'created_at': statement.excluded.created_at, 'expires_at': statement.excluded.expires_at},
+        where=IdempotencyKey.expires_at <= now,
+    )
+    claimed = session.execute(statement.returning(IdempotencyKey.key)).first()
+    existing = None if claimed else session.scalar(select(IdempotencyKey).where(IdempotencyKey.key == key))
+    session.commit()
+    return existing
+
+
+@handle_exceptions()
+def complete_idempotency_key(session: Session, key: str, status_code: int, response: str, ttl: float) -> None:
+    """
+    Stores the response of the request of a claimed key, kept for `ttl` seconds instead of the lease of the claim.
+    """
+    session.rollback()
+    session.execute(update(IdempotencyKey)
+                    .where(IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None))
+                    .values(status_code=status_code, response=response,
+                            expires_at=datetime.now() + timedelta(seconds=ttl)))
+    session.commit()
+
+
+@handle_exceptions()
+def release_idempotency_key(session: Session, key: str) -> None:
+    """
+    Forgets a claimed key whose request failed without a response worth repeating, so a retry runs it again.
+    """
+    session.rollback()
+    session.execute(delete(IdempotencyKey)
+                    .where(IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None)))
+    session.commit()
+
+
+@handle_exceptions()
+def purge_idempotency_keys(session: Session, batch_size: int = DEFAULT_PURGE_BATCH_SIZE,
+                           now: datetime | None = None) -> int:
+    """
+    Deletes the expired keys, `batch_size` keys per transaction, so the purge never holds many row locks.
+
+    :return: The number of purged keys.
+    """
+    now = now or datetime.now()
+    purged = 0
+    while True:
+        expired = (select(IdempotencyKey.key)
+                   .where(IdempotencyKey.expires_at <= now)
+                   .order_by(IdempotencyKey.expires_at)
+                   .limit(batch_size)
+                   .with_for_update(skip_locked=True))
+        result = session.execute(delete(IdempotencyKey).where(IdempotencyKey.key.in_(expired)))
+        session.commit()
+        purged += result.rowcount
+        if result.rowcount < batch_size:
+            break
+
+    if purged:
+        logger.debug(f"Purged {purged} expired idempotency keys")
+    return purged
@@ -0,0 +1,152 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, func, case, and_, or_, literal
+from sqlalchemy.orm import Session, sessionmaker
+from decorators import handle_exceptions
+from models import Product, ProductTransaction, StockSnapshot, OperationType
+from crud.stripe import TOTAL_STOCK
+
+logger = logging.getLogger(__name__)
+
+# Transactions are dated when their database transaction starts, but only become visible when it commits.
+# Snapshots stay this far behind the clock, so a transaction that commits late is never left out of one.
+SNAPSHOT_LAG = timedelta(minutes=5)
+DEFAULT_RECONCILE_CHUNK_SIZE = 10000
+
+
+def signed_quantity():
+    """
+    SQL expression of the change in stock made by a transaction.
+    """
+    return case(
+        (ProductTransaction.operation == OperationType.ADD, ProductTransaction.quantity),
+        (ProductTransaction.operation.in_([OperationType.SUBTRACT, OperationType.SALE]), -ProductTransaction.quantity),
+        else_=0,
+    )
+
+
+def _latest_snapshots(product_filter=None):
+    """
+    Subquery of the latest snapshot of every product.
+    """
+    latest = select(StockSnapshot.product_id, func.max(StockSnapshot.as_of).label('as_of'))
+    if product_filter is not None:
+        latest = latest.where(product_filter(StockSnapshot.product_id))
+    latest = latest.group_by(StockSnapshot.product_id).subquery()
+    return (select(StockSnapshot.product_id, StockSnapshot.as_of, StockSnapshot.stock)
+            .join(latest, and_(StockSnapshot.product_id == latest.c.product_id, StockSnapshot.as_of == latest.c.as_of))
+            .subquery())
+
+
+def _deltas_since(last, as_of: datetime | None = None, product_filter=None):
+    """
+    Subquery of the stock change of every product since its snapshot in `last`, up to `as_of` if given.
+    """
+    deltas = (select(ProductTransaction.product_id, func.sum(signed_quantity()).label('delta'))
+              .outerjoin(last, last.c.product_id == ProductTransaction.product_id)
+              .where(or_(last.c.as_of.is_(None), ProductTransaction.date > last.c.as_of)))
+    if as_of is not None:
+        deltas = deltas.where(ProductTransaction.date <= as_of)
+    if product_filter is not None:
+        deltas = deltas.where(product_filter(ProductTransaction.product_id))
+    return deltas.group_by(ProductTransaction.product_id).subquery()
+
+
+@handle_exceptions()
+def roll_snapshots(session: Session, as_of: datetime | None = None) -> int:
+    """
+    Writes a new snapshot for every product with transactions since its latest snapshot, in one
+    INSERT ... SELECT that only reads the transactions that followed that snapshot. Snapshots only move
+    forward, products whose latest snapshot is after `as_of` are left alone.
+
+    :param as_of: Point in time of the new snapshots, `SNAPSHOT_LAG` before now by default.
+    :return: The number of snapshots written.
+    """
+    as_of = as_of or datetime.now() - SNAPSHOT_LAG
+    last = _latest_snapshots()
+    deltas = _deltas_since(last, as_of)
+    rows = (select(deltas.c.product_id, literal(as_of, StockSnapshot.as_of.type),
+                   func.coalesce(last.c.stock, 0) + deltas.c.delta)
+            .outerjoin(last, last.c.product_id == deltas.c.product_id))
+    result = session.execute(insert(StockSnapshot).from_select(['product_id', 'as_of', 'stock'], rows))
+    session.commit()
+    logger.info(f"Wrote {result.rowcount} stock snapshots as of {as_of}")
+    return result.rowcount
+
+
+@handle_exceptions()
+def baseline_snapshots(session: Session) -> int:
+    """
+    Starts the ledger of products that have no snapshot yet from their current stock, for stock levels
+    that predate the transaction history.
+
+    :return: The number of snapshots written.
+    """
+    rows = (select(Product.id, literal(datetime.now(), StockSnapshot.as_of.type), TOTAL_STOCK)
+            .where(~select(StockSnapshot.product_id).where(StockSnapshot.product_id == Product.id).exists()))
+    result = session.execute(insert(StockSnapshot).from_select(['product_id', 'as_of', 'stock'], rows))
+    session.commit()
+    logger.info(f"Wrote {result.rowcount} baseline stock snapshots")
+    return result.rowcount
+
+
+@handle_exceptions()
+def get_stock_at(session: Session, product_id: int, as_of: datetime) -> int | None:
+    """
+    Computes the stock of a product at a point in time from its latest snapshot before that point and the
+    transactions that followed it.
+
+    :return: The stock level, None if the product does not exist.
+    """
+    if not session.query(Product.id).filter_by(id=product_id).first():
+        return None
+    snapshot = (session.query(StockSnapshot)
+                .filter(StockSnapshot.product_id == product_id, StockSnapshot.as_of <= as_of)
+                .order_by(StockSnapshot.as_of.desc())
+                .first())
+    delta = session.query(func.coalesce(func.sum(signed_quantity()), 0)).filter(
+        ProductTransaction.product_id == product_id, ProductTransaction.date <= as_of)
+    if snapshot:
+        delta = delta.filter(ProductTransaction.date > snapshot.as_of)
+    return (snapshot.stock if snapshot else 0) + delta.scalar()
+
+
+def _reconcile_chunk(session_factory: sessionmaker, first_id: int, last_id: int) -> list[dict]:
+    def in_chunk(column):
+        return column.between(first_id, last_id)
+
+    with session_factory() as session:
+        last = _latest_snapshots(product_filter=in_chunk)
+        deltas = _deltas_since(last, product_filter=in_chunk)
+        ledger = func.coalesce(last.c.stock, 0) + func.coalesce(deltas.c.delta, 0)
+        rows = session.execute(
+            select(Product.id, TOTAL_STOCK.label('stock'), ledger.label('ledger'))
+            .outerjoin(last, last.c.product_id == Product.id)
+            .outerjoin(deltas, deltas.c.product_id == Product.id)
+            .where(in_chunk(Product.id), TOTAL_STOCK != ledger)
+            .order_by(Product.id))
+        return [{'product_id': row.id, 'stock': row.stock, 'ledger': row.ledger} for row in rows]
+
+
+@handle_exceptions()
+def reconcile_stock(session_factory: sessionmaker, chunk_size: int = DEFAULT_RECONCILE_CHUNK_SIZE,
+                    workers: int = 4) -> list[dict]:
+    """
+    Compares `Product.stock` with the stock derived from the ledger for every product. The id range is
+    split into chunks that are checked in parallel, each on its own session.
+
+    :return: The products whose stock differs from the ledger.
+    """
+    with session_factory() as session:
+        first_id, last_id = session.query(func.min(Product.id), func.max(Product.id)).one()
+    if first_id is None:
+        return []
+
+    chunks = [(start, min(start + chunk_size - 1, last_id)) for start in range(first_id, last_id + 1, chunk_size)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda chunk: _reconcile_chunk(session_factory, *chunk), chunks)
+        mismatches = [mismatch for chunk in results for mismatch in chunk]
+    logger.info(f"Reconciled {len(chunks)} chunks of products, {len(mismatches)} differ from the ledger")
+    return mismatches
@@ -0,0 +1,135 @@
+import logging
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import select, insert, update, delete, func, literal, null, text
+from sqlalchemy.orm import Session
+from decorators import handle_exceptions
+from models import Product, ChangeEvent, ChangeType
+from crud.stripe import TOTAL_STOCK
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RELAY_BATCH_SIZE = 500
+DEFAULT_PURGE_BATCH_SIZE = 1000
+# Key of the PostgreSQL advisory lock held while events are numbered, so relays in several processes take turns.
+RELAY_LOCK_KEY = 7_242_011
+
+CHANGE_FIELDS = ('id', 'sequence', 'product_id', 'change', 'stock', 'reserved', 'created_at')
+_EVENT_COLUMNS = ['product_id', 'change', 'stock', 'reserved']
+
+
+def change_events(product_filter, change: ChangeType):
+    """
+    INSERT ... SELECT of a `change` event for each product matching `product_filter`, with its stock after the
+    change. Executed in the transaction of the change, and before the products are deleted for `DELETED`.
+    """
+    if change == ChangeType.DELETED:
+        stock, reserved = null(), null()
+    else:
+        stock, reserved = TOTAL_STOCK, Product.reserved
+    rows = (select(Product.id, literal(change, ChangeEvent.change.type), stock, reserved)
+            .where(product_filter, Product.deleted_at.is_(None)))
+    return insert(ChangeEvent).from_select(_EVENT_COLUMNS, rows)
+
+
+def _lock_relay(session: Session) -> bool:
+    # SQLite serializes writers anyway.
+    if session.get_bind().dialect.name != 'postgresql':
+        return True
+    # READ COMMITTED, so the events numbered by the previous holder of the lock are seen once it is taken.
+    session.connection(execution_options={'isolation_level': 'READ COMMITTED'})
+    return session.scalar(text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': RELAY_LOCK_KEY})
+
+
+@handle_exceptions()
+def relay_change_events(session: Session,
+                        publish: Callable[[list[dict]], None],
+                        batch_size: int = DEFAULT_RELAY_BATCH_SIZE) -> int:
+    """
+    Numbers the events not yet published, in id order, and hands them to `publish`, `batch_size` events per
+    transaction. Does nothing while another relay is running.
+
+    An event is only numbered once its transaction has committed, so the sequence of the change stream follows the
+    commit order even when the ids don't. `publish` runs before the commit, a failed commit publishes the events
+    again with other sequences, consumers tell duplicates by their `id`.
+
+    :param publish: Called with the events of each batch, as dicts of `CHANGE_FIELDS`.
+    :return: The number of published events.
+    """
+    published = 0
+    while True:
+        if not _lock_relay(session):
+            session.rollback()
+            break
+        rows = session.execute(select(ChangeEvent.id, ChangeEvent.product_id, ChangeEvent.change, ChangeEvent.stock,
+                                      ChangeEvent.reserved, ChangeEvent.created_at)
+                               .where(ChangeEvent.sequence.is_(None))
+                               .order_by(ChangeEvent.id)
+                               .limit(batch_size)).all()
+        if not rows:
+            session.rollback()
+            break
+
+        last = session.scalar(select(func.max(ChangeEvent.sequence))) or 0
+        events = [{**row._asdict(), 'sequence': last + index} for index, row in enumerate(rows, 1)]
+        now = datetime.now()
+        session.execute(update(ChangeEvent), [{'id': event['id'], 'sequence': event['sequence'], 'published_at': now}
+                                              for event in events])
+        publish([{field: event[field] for field in CHANGE_FIELDS} for event in events])
+        session.commit()
+        published += len(events)
+        if len(events) < batch_size:
+            break
+
+    if published:
+        logger.debug(f"Published {published} change events")
+    return published
+
+
+@handle_exceptions()
+def list_changes(session: Session, since: int = 0, limit: int = 100) -> list[dict]:
+    """
+    :param since: Sequence of the last change already read, 0 to read from the oldest change kept.
+    :return: Up to `limit` published changes after `since`, in sequence order.
+    """
+    rows = session.execute(select(*[getattr(ChangeEvent, field) for field in CHANGE_FIELDS])
+                           .where(ChangeEvent.sequence > since)
+                           .order_by(ChangeEvent.sequence)
+                           .limit(limit))
+    return [row._asdict() for row in rows]
+
+
+@handle_exceptions()
+def latest_sequence(session: Session) -> int:
+    """
+    :return: The sequence of the last published change, 0 if there is none.
+    """
+    return session.scalar(select(func.max(ChangeEvent.sequence))) or 0
+
+
+@handle_exceptions()
+def purge_change_events(session: Session, before: datetime, batch_size: int = DEFAULT_PURGE_BATCH_SIZE) -> int:
+    """
+    Deletes the events published before `before`, `batch_size` events per transaction. The last published event is
+    always kept, as the relay numbers the next events after its sequence, so cursors stay valid after a purge.
+
+    :return: The number of purged events.
+    """
+    purged = 0
+    last = select(func.max(ChangeEvent.sequence)).scalar_subquery()
+    while True:
+        expired = (select(ChangeEvent.id)
+                   .where(ChangeEvent.published_at < before, ChangeEvent.sequence < last)
+                   .order_by(ChangeEvent.published_at)
+                   .limit(batch_size)
+                   .with_for_update(skip_locked=True))
+        result = session.execute(delete(ChangeEvent).where(ChangeEvent.id.in_(expired)))
+        session.commit()
+        purged += result.rowcount
+        if result.rowcount < batch_size:
+            break
+
+    if purged:
+        logger.debug(f"Purged {purged} change events")
+    return purged
@@ -1,12 +1,33 @@
 import logging
+from datetime import datetime
 
+from sqlalchemy import select, insert, update, tuple_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from decorators import handle_exceptions
-from models import Product, ProductTransaction, OperationType
+from sqlalchemy.orm.attributes import set_committed_value
+from cache import (get_cached_product, set_cached_product, get_product_stock, set_product_stock, invalidate_product,
+                   to_detached)
+from decorators import handle_exceptions, retry_on_conflict
+from search_index import invalidate_search_index
+from models import (Product, ProductTransaction, ProductStockStripe, Supplier, SupplierSummaryDelta, OperationType,
+                    ChangeType)
+from enums import STOCK_OPERATIONS
+from crud.stripe import TOTAL_STOCK, get_total_stock, add_stock, take_stock
+from crud.summary import product_deltas, stock_change_delta, stock_change_row
+from crud.outbox import change_events
+from crud.alert import detect_crossings
+from crud.supplier import SUPPLIER_FIELDS
+from crud.delete import delete_products
 
 logger = logging.getLogger(__name__)
 
+PRODUCT_FIELDS = ('id', 'name', 'description', 'sku', 'price', 'supplier_id', 'stock', 'reserved', 'stripe_count')
+# Fields that are safe to cache for long, `stock` is cached separately, if at all, and `reserved` never is.
+PRODUCT_STATIC_FIELDS = tuple(field for field in PRODUCT_FIELDS if field not in ('stock', 'reserved'))
+
+# Stock mutations are single conditional UPDATEs or explicit row locks, so they don't need SERIALIZABLE.
+STOCK_ISOLATION_LEVEL = 'READ COMMITTED'
+
 
 @handle_exceptions()
 def create_product(session: Session,
@@ -25,8 +46,16 @@ def create_product(session: Session,
             stock=stock,
             supplier_id=supplier_id,
         )
+        if stock:
+            # The initial stock is the first entry of the product's ledger.
+            new_product.transactions.append(ProductTransaction(operation=OperationType.ADD, quantity=stock))
         session.add(new_product)
+        session.flush()
+        session.execute(product_deltas(Product.id == new_product.id))
+        session.execute(change_events(Product.id == new_product.id, ChangeType.CREATED))
+        detect_crossings(session, Product.id == new_product.id)
         session.commit()
+        invalidate_search_index()
         session.refresh(new_product)
         return new_product
     except IntegrityError:
@@ -40,8 +69,115 @@ def create_product(session: Session,
 
 @handle_exceptions()
 def get_product(session: Session, product_id: int) -> Product | None:
-    product = session.query(Product).filter_by(id=product_id).first()
-    return product
+    fields = get_cached_product(product_id)
+    if fields is None:
+        product = session.query(Product).filter_by(id=product_id).first()
+        if product and product.stripe_count:
+            # Reported as the total, without marking the column as modified.
+            set_committed_value(product, 'stock', get_total_stock(session, product_id))
+        if product:
+            set_cached_product(product_id, {field: getattr(product, field) for field in PRODUCT_STATIC_FIELDS})
+            set_product_stock(product_id, product.stock, product.reserved)
+        return product
+
+    cached = get_product_stock(product_id)
+    if cached is None:
+        # Unless CACHE_STOCK_TTL is set, stock is read from the database so availability is never stale.
+        row = session.query(TOTAL_STOCK.label('stock'), Product.reserved).filter(Product.id == product_id).first()
+        if row is None:
+            invalidate_product(product_id)
+            return None
+        set_product_stock(product_id, row.stock, row.reserved)
+        return session.merge(to_detached(Product, {**fields, 'stock': row.stock, 'reserved': row.reserved}),
+                             load=False)
+    stock, reserved = cached
+    return session.merge(to_detached(Product, {**fields, 'stock': stock, 'reserved': reserved}), load=False)
+
+
+@handle_exceptions()
+def get_products(session: Session,
+                 ids: list[int] | None = None,
+                 skus: list[str] | None = None,
+                 include_supplier: bool = False) -> list[dict]:
+    """
+    Looks up many products by id or by SKU with a single query, e.g. to resolve a cart.
+
+    :param include_supplier: Also return the supplier of each product, joined in the same query.
+    :return: One result per requested id or SKU, in request order, with `found`, the `product` if it was, and
+        its `supplier` with `include_supplier`.
+    """
+    if (ids is None) == (skus is None):
+        raise ValueError("Pass either ids or skus")
+    key, keys = ('id', ids) if ids is not None else ('sku', skus)
+    if not keys:
+        return []
+
+    columns = [TOTAL_STOCK.label('stock') if field == 'stock' else getattr(Product, field) for field in PRODUCT_FIELDS]
+    query = select(*columns).where(getattr(Product, key).in_(set(keys)))
+    if include_supplier:
+        query = (query.add_columns(*[getattr(Supplier, field) for field in SUPPLIER_FIELDS])
+                 .outerjoin(Supplier, Supplier.id == Product.supplier_id))
+
+    products = {}
+    for row in session.execute(query):
+        # The supplier columns follow the product ones.
+        product = dict(zip(PRODUCT_FIELDS, row))
+        supplier = dict(zip(SUPPLIER_FIELDS, row[len(PRODUCT_FIELDS):])) if include_supplier else {}
+        products[product[key]] = (product, supplier if supplier.get('id') is not None else None)
+
+    results = []
+    for value in keys:
+        product, supplier = products.get(value, (None, None))
+        result = {key: value, 'found': product is not None, 'product': product}
+        if include_supplier:
+            result['supplier'] = supplier
+        results.append(result)
+    return results
+
+
+@handle_exceptions()
+def list_products(session: Session,
+                  after_id: int | None = None,
+                  limit: int = 100,
+                  supplier_id: int | None = None,
+                  min_price: float | None = None,
+                  max_price: float | None = None,
+                  stock_below: int | None = None,
+                  name_prefix: str | None = None,
+                  fields: list[str] | None = None) -> list[dict]:
+    """
+    Lists products in ascending id order using keyset pagination.
+
+    Pages are requested with the id of the last product of the previous page instead of an offset,
+    so every page costs an index range scan no matter how deep into the listing it is.
+
+    :param after_id: Only return products with a greater id, None for the first page.
+    :param stock_below: Only return products whose stock is lower than this value.
+    :param name_prefix: Only return products whose name starts with this value.
+    :param fields: Columns to return, all of `PRODUCT_FIELDS` if None. `id` is always included.
+    """
+    fields = fields or PRODUCT_FIELDS
+    unknown = set(fields) - set(PRODUCT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown product fields: {', '.join(sorted(unknown))}")
+    columns = [TOTAL_STOCK.label('stock') if field == 'stock' else getattr(Product, field)
+               for field in PRODUCT_FIELDS if field == 'id' or field in fields]
+
+    query = session.query(*columns)
+    if after_id is not None:
+        query = query.filter(Product.id > after_id)
+    if supplier_id is not None:
+        query = query.filter(Product.supplier_id == supplier_id)
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    if stock_below is not None:
+        # The first condition can use the stock index, the second one adds the stock of striped products.
+        query = query.filter(Product.stock < stock_below, TOTAL_STOCK < stock_below)
+    if name_prefix:
+        query = query.filter(Product.name.startswith(name_prefix, autoescape=True))
+    return [row._asdict() for row in query.order_by(Product.id).limit(limit)]
 
 
 @handle_exceptions()
@@ -58,9 +194,16 @@ def update_product(session: Session, product_id: int, name: str = None, descript
             product.description = description
         if sku:
             product.sku = sku
-        if price:
+        if price and price != product.price:
+            # The product leaves the summary of its supplier with the old price and comes back with the new one.
+            session.execute(product_deltas(Product.id == product_id, -1))
             product.price = price
+            session.flush()
+            session.execute(product_deltas(Product.id == product_id))
+        session.execute(change_events(Product.id == product_id, ChangeType.UPDATED))
         session.commit()
+        invalidate_product(product_id)
+        invalidate_search_index()
         session.refresh(product)
         return product
     except IntegrityError:
@@ -73,18 +216,34 @@ def update_product(session: Session, product_id: int, name: str = None, descript
 
 
 @handle_exceptions()
-def delete_product(session: Session, product_id: int) -> bool:
-    try:
-        product = session.query(Product).filter_by(id=product_id).first()
-        if product:
-            session.delete(product)
-            session.commit()
-            return True
-        return False
-    except Exception as e:
+@retry_on_conflict()
+def set_reorder_threshold(session: Session, product_id: int, threshold: int | None) -> bool:
+    """
+    Sets the reorder threshold of a product, None to use the one of its supplier, and checks the product against it.
+
+    :return: False if the product doesn't exist.
+    """
+    _use_stock_isolation(session)
+    found = session.execute(update(Product)
+                            .where(Product.id == product_id, Product.deleted_at.is_(None))
+                            .values(reorder_threshold=threshold)
+                            .returning(Product.id)).first()
+    if found is None:
         session.rollback()
-        logger.error(f"Error deleting product: {e}")
-        raise ValueError("An error occurred while deleting the product.")
+        return False
+    detect_crossings(session, Product.id == product_id)
+    session.commit()
+    return True
+
+
+@handle_exceptions()
+def delete_product(session: Session, product_id: int, soft: bool = False) -> bool:
+    """
+    Deletes a product and its transactions with set-based statements, see `crud.delete`.
+
+    :param soft: Only set its `deleted_at`, which hides it from every query.
+    """
+    return delete_products(session, [product_id], soft=soft) == 1
 
 
 # Transaction operations
@@ -106,21 +265,246 @@ def get_transaction(session: Session, transaction_id: int) -> ProductTransaction
 
 
 @handle_exceptions()
+def list_transactions(session: Session,
+                      product_id: int,
+                      before: tuple[datetime, int] | None = None,
+                      limit: int = 100,
+                      start: datetime | None = None,
+                      end: datetime | None = None) -> list[ProductTransaction]:
+    """
+    Lists the transactions of a product, most recent first, using keyset pagination on (date, id).
+
+    Each page is an index range scan of `ix_product_transaction_product_id_date`, and the date bounds let
+    PostgreSQL skip the monthly partitions outside of them.
+
+    :param before: (date, id) of the last transaction of the previous page, None for the first page.
+    :param start: Only return transactions on or after this date.
+    :param end: Only return transactions before this date.
+    """
+    query = session.query(ProductTransaction).filter(ProductTransaction.product_id == product_id)
+    if before is not None:
+        query = query.filter(tuple_(ProductTransaction.date, ProductTransaction.id) < before)
+    if start is not None:
+        query = query.filter(ProductTransaction.date >= start)
+    if end is not None:
+        query = query.filter(ProductTransaction.date < end)
+    return query.order_by(ProductTransaction.date.desc(), ProductTransaction.id.desc()).limit(limit).all()
+
+
+def _use_stock_isolation(session: Session) -> None:
+    # The isolation level can only be chosen before the session's transaction begins.
+    if not session.in_transaction() and session.get_bind().dialect.name == 'postgresql':
+        session.connection(execution_options={'isolation_level': STOCK_ISOLATION_LEVEL})
+
+
+def _stock_change(quantity: int, operation: OperationType) -> int:
+    return quantity if operation == OperationType.ADD else -quantity
+
+
+def _stock_update_statement(product_id: int, quantity: int, operation: OperationType):
+    # Striped products don't match, their stock is updated through `crud.stripe`.
+    if operation == OperationType.ADD:
+        statement = (update(Product)
+                     .where(Product.id == product_id, Product.stripe_count == 0, Product.deleted_at.is_(None))
+                     .values(stock=Product.stock + quantity))
+    else:
+        # Stock held by active holds can't be sold or removed.
+        statement = (update(Product)
+                     .where(Product.id == product_id, Product.stripe_count == 0, Product.deleted_at.is_(None),
+                            Product.available >= quantity)
+                     .values(stock=Product.stock - quantity))
+    return statement.returning(Product.stock)
+
+
+def _apply_striped_movement(session: Session, product_id: int, quantity: int, operation: OperationType) -> int | None:
+    """
+    Applies a stock movement to a striped product.
+
+    :return: The new total stock, None if the product isn't striped or hasn't enough available stock.
+    """
+    stripe_count = session.query(Product.stripe_count).filter_by(id=product_id).scalar()
+    if not stripe_count:
+        return None
+    if operation == OperationType.ADD:
+        add_stock(session, product_id, quantity, stripe_count)
+    elif not take_stock(session, product_id, quantity, stripe_count):
+        return None
+    return get_total_stock(session, product_id)
+
+
+def _check_stock_operation(operation: OperationType) -> None:
+    if operation not in STOCK_OPERATIONS:
+        raise ValueError(f"Operation {operation.value} can't be applied directly, use the hold endpoints")
+
+
+def _stock_error_message(product_id: int, quantity: int, available: int | None) -> str:
+    if available is None:
+        return f'Product {product_id} not found'
+    return f'Not enough stock for product {product_id}. Available: {available}, Requested: {quantity}'
+
+
+def _apply_stock_movement(session: Session, product_id: int, quantity: int, operation: OperationType) -> int:
+    stock = session.execute(_stock_update_statement(product_id, quantity, operation)).scalar_one_or_none()
+    if stock is not None:
+        return stock
+
+    # Nothing was updated, the product is striped or the movement is invalid.
+    stock = _apply_striped_movement(session, product_id, quantity, operation)
+    if stock is not None:
+        return stock
+    available = session.query(TOTAL_STOCK - Product.reserved).filter(Product.id == product_id).scalar()
+    message = _stock_error_message(product_id, quantity, available)
+    logger.error(message)
+    raise ValueError(message)
+
+
+@handle_exceptions()
+@retry_on_conflict()
 def update_stock(
         session: Session,
         product_id: int,
         quantity: int,
-        operation: OperationType) -> None:
-    product = session.query(Product).filter_by(id=product_id).first()
-    if not product:
-        message = f'Product {product_id} not found'
-        raise ValueError(message)
+        operation: OperationType) -> int:
+    _check_stock_operation(operation)
+    _use_stock_isolation(session)
+    try:
+        stock = _apply_stock_movement(session, product_id, quantity, operation)
+    except ValueError:
+        session.rollback()
+        raise
+    _create_transaction(session, product_id, operation=operation, quantity=quantity)
+    session.execute(stock_change_delta(product_id, _stock_change(quantity, operation)))
+    session.execute(change_events(Product.id == product_id, ChangeType.STOCK))
+    detect_crossings(session, Product.id == product_id)
+    session.commit()
+    set_product_stock(product_id, stock)
+    return stock
 
-    if operation in [OperationType.SUBTRACT, OperationType.SALE] and product.stock < quantity:
-        message = f'Not enough stock for product {product_id}. Available: {product.stock}, Requested: {quantity}'
-        logger.error(message)
-        raise ValueError(message)
 
-    product.stock += quantity if operation == OperationType.ADD else -quantity
-    _create_transaction(session, product_id, operation=operation, quantity=quantity)
+@handle_exceptions()
+@retry_on_conflict()
+def bulk_update_stock(
+        session: Session,
+        movements: list[tuple[int, int, OperationType]],
+        all_or_nothing: bool = False) -> list[dict]:
+    """
+    Applies many stock movements in a single transaction.
+
+    The affected products are locked in ascending id order, so concurrent batches can't deadlock each other.
+    Movements are checked in request order against the running stock of each product, the
+    `ProductTransaction` rows are written with one multi-row insert and the session is committed once.
+
+    :param movements: (product_id, quantity, operation) tuples.
+    :param all_or_nothing: If True, a single failed line rolls back the whole batch.
+    :return: One result per movement, in request order.
+    """
+    _use_stock_isolation(session)
+    try:
+        results, stock = _write_stock_movements(session, movements, all_or_nothing)
+    except ValueError:
+        session.rollback()
+        raise
+    if not stock:
+        session.rollback()
+        return results
     session.commit()
+    for product_id, product_stock in stock.items():
+        set_product_stock(product_id, product_stock)
+    return results
+
+
+def _write_stock_movements(
+        session: Session,
+        movements: list[tuple[int, int, OperationType]],
+        all_or_nothing: bool) -> tuple[list[dict], dict[int, int]]:
+    """
+    Locks the products of a batch of movements, plans them and writes the new stock levels and the
+    transactions, without committing. Shared with the async CRUD through `AsyncSession.run_sync`.
+
+    :return: The per-movement results and the new stock of the updated products, empty if nothing was written.
+    """
+    product_ids = sorted({product_id for product_id, _, _ in movements})
+    rows = session.query(Product.id, Product.stock, Product.reserved, Product.stripe_count, Product.supplier_id,
+                         Product.price).filter(Product.id.in_(product_ids)).order_by(Product.id).with_for_update().all()
+    stock = {row.id: row.stock for row in rows}
+    reserved = {row.id: row.reserved for row in rows}
+    striped = {row.id: row.stripe_count for row in rows if row.stripe_count}
+    if striped:
+        # Stripes are locked after their product rows, the batch is planned against the total stock.
+        stripes = session.execute(select(ProductStockStripe.product_id, ProductStockStripe.stock)
+                                  .where(ProductStockStripe.product_id.in_(striped))
+                                  .order_by(ProductStockStripe.product_id, ProductStockStripe.stripe)
+                                  .with_for_update())
+        for product_id, stripe_stock in stripes:
+            stock[product_id] += stripe_stock
+    initial = dict(stock)
+
+    results, transactions = _plan_stock_movements(stock, reserved, movements, all_or_nothing)
+    if not transactions:
+        return results, {}
+
+    touched = sorted({transaction['product_id'] for transaction in transactions})
+    unstriped = [{'id': product_id, 'stock': stock[product_id]} for product_id in touched if product_id not in striped]
+    if unstriped:
+        session.execute(update(Product), unstriped)
+    for product_id in touched:
+        change = stock[product_id] - initial[product_id]
+        if product_id not in striped or not change:
+            continue
+        if change > 0:
+            add_stock(session, product_id, change, striped[product_id])
+        else:
+            # Can't fail, the product and its stripes are locked and the movements were checked against them.
+            take_stock(session, product_id, -change, striped[product_id])
+    session.execute(insert(ProductTransaction), transactions)
+    products = {row.id: row for row in rows}
+    deltas = [stock_change_row(products[product_id].supplier_id, products[product_id].price, initial[product_id],
+                               stock[product_id])
+              for product_id in touched
+              if stock[product_id] != initial[product_id] and products[product_id].supplier_id is not None]
+    if deltas:
+        session.execute(insert(SupplierSummaryDelta), deltas)
+    session.execute(change_events(Product.id.in_(touched), ChangeType.STOCK))
+    detect_crossings(session, Product.id.in_(touched))
+    return results, {product_id: stock[product_id] for product_id in touched}
+
+
+def _plan_stock_movements(
+        stock: dict[int, int],
+        reserved: dict[int, int],
+        movements: list[tuple[int, int, OperationType]],
+        all_or_nothing: bool) -> tuple[list[dict], list[dict]]:
+    """
+    Checks movements in order against the running stock levels, which are updated in place. Removals can
+    only take the stock that isn't `reserved`.
+
+    :return: The per-movement results and the transaction rows to insert, empty if nothing must be written.
+    """
+    results = []
+    transactions = []
+    for index, (product_id, quantity, operation) in enumerate(movements):
+        result = {'index': index, 'product_id': product_id, 'success': False}
+        results.append(result)
+        if operation not in STOCK_OPERATIONS:
+            result['detail'] = f"Operation {operation.value} can't be applied directly, use the hold endpoints"
+            continue
+        available = stock[product_id] - reserved[product_id] if product_id in stock else None
+        if available is None or (operation in [OperationType.SUBTRACT, OperationType.SALE] and available < quantity):
+            result['detail'] = _stock_error_message(product_id, quantity, available)
+            continue
+        stock[product_id] += quantity if operation == OperationType.ADD else -quantity
+        transactions.append({'product_id': product_id, 'operation': operation, 'quantity': quantity})
+        result['success'] = True
+        result['stock'] = stock[product_id]
+
+    failed = len(movements) - len(transactions)
+    if failed and all_or_nothing:
+        for result in results:
+            if result['success']:
+                result['success'] = False
+                del result['stock']
+                result['detail'] = 'Batch rolled back'
+        return results, []
+    if failed:
+        logger.warning(f'Bulk stock update applies {len(transactions)} movements, {failed} failed')
+    return results, transactions
@@ -0,0 +1,83 @@
+import logging
+
+from sqlalchemy import select, func, case, or_, literal_column
+from sqlalchemy.orm import Session
+from decorators import handle_exceptions
+from models import Product, PRODUCT_SEARCH_VECTOR
+from crud.stripe import TOTAL_STOCK
+from search_index import SEARCH_SIMILARITY_THRESHOLD, SKU_PREFIX_SCORE, get_search_index, tokenize
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELDS = ('id', 'name', 'description', 'sku', 'price', 'supplier_id', 'stock')
+MAX_QUERY_LENGTH = 200
+
+# Literal, not a bound parameter, so the query's expression is the indexed one whatever the driver.
+_TEXT_SEARCH_CONFIG = literal_column("'simple'::regconfig")
+
+
+def _columns():
+    return [TOTAL_STOCK.label('stock') if field == 'stock' else getattr(Product, field) for field in SEARCH_FIELDS]
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _search_postgresql(session: Session, query: str, limit: int, offset: int) -> list[dict]:
+    """
+    Ranks the products with the GIN indexes of `Product`: the full-text document matches every word of the query
+    as a prefix, the trigram index of the name tolerates typos, and the one of the SKU serves prefixes in any case.
+    """
+    # Lower than the default of 0.6, so a word with a typo or two still matches. Reset when the transaction ends.
+    session.execute(select(func.set_config('pg_trgm.word_similarity_threshold', str(SEARCH_SIMILARITY_THRESHOLD),
+                                           True)))
+    words = tokenize(query)
+    document = literal_column(PRODUCT_SEARCH_VECTOR)
+    sku_prefix = Product.sku.ilike(f'{_escape_like(query)}%', escape='\\')
+    conditions = [Product.name.op('%>')(query), sku_prefix]
+    score = func.word_similarity(query, Product.name) + case((sku_prefix, SKU_PREFIX_SCORE), else_=0.0)
+    if words:
+        # The words only hold letters, digits and underscores, so they can't break the tsquery syntax.
+        tsquery = func.to_tsquery(_TEXT_SEARCH_CONFIG, ' & '.join(f'{word}:*' for word in words))
+        conditions.append(document.op('@@')(tsquery))
+        score = score + func.ts_rank(document, tsquery)
+
+    score = score.label('score')
+    rows = session.execute(select(*_columns(), score)
+                           .where(or_(*conditions))
+                           .order_by(score.desc(), Product.id)
+                           .offset(offset)
+                           .limit(limit))
+    return [row._asdict() for row in rows]
+
+
+def _search_in_memory(session: Session, query: str, limit: int, offset: int) -> list[dict]:
+    ranked = get_search_index().search(session, query, limit, offset)
+    if not ranked:
+        return []
+    rows = {row.id: row._asdict() for row in session.execute(
+        select(*_columns()).where(Product.id.in_([product_id for product_id, _ in ranked])))}
+    # Products deleted since the index was built are skipped.
+    return [{**rows[product_id], 'score': round(score, 4)} for product_id, score in ranked if product_id in rows]
+
+
+@handle_exceptions()
+def search_products(session: Session, query: str, limit: int = 20, offset: int = 0) -> list[dict]:
+    """
+    Searches the products by name, description and SKU prefix, best matches first.
+
+    On PostgreSQL the search runs on the full-text and trigram indexes of `Product`, elsewhere on the in-memory
+    index of `search_index`.
+
+    :param query: Words to look for, misspelled ones included, or the start of a SKU.
+    :return: The products of the requested page, with their `score`.
+    """
+    query = query.strip()
+    if not query:
+        raise ValueError("The search query can't be empty")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f"The search query can't be longer than {MAX_QUERY_LENGTH} characters")
+    if session.get_bind().dialect.name == 'postgresql':
+        return _search_postgresql(session, query, limit, offset)
+    return _search_in_memory(session, query, limit, offset)
@@ -0,0 +1,200 @@
+import logging
+import random
+
+from sqlalchemy import select, update, delete, insert, func
+from sqlalchemy.orm import Session
+from cache import invalidate_product
+from decorators import handle_exceptions, retry_on_conflict
+from models import Product, ProductStockStripe
+
+logger = logging.getLogger(__name__)
+
+MAX_STRIPES = 64
+
+# Stock held by the stripes of the product of the enclosing query, NULL if it isn't striped.
+STRIPED_STOCK = (select(func.sum(ProductStockStripe.stock))
+                 .where(ProductStockStripe.product_id == Product.id)
+                 .correlate(Product)
+                 .scalar_subquery())
+# The exact stock of a product, whether it is striped or not. Stripes are never negative, so it is never
+# lower than `Product.stock`.
+TOTAL_STOCK = Product.stock + func.coalesce(STRIPED_STOCK, 0)
+
+
+def split_evenly(quantity: int, parts: int) -> list[int]:
+    share, remainder = divmod(quantity, parts)
+    return [share + 1 if index < remainder else share for index in range(parts)]
+
+
+def get_total_stock(session: Session, product_id: int) -> int | None:
+    return session.query(TOTAL_STOCK).filter(Product.id == product_id).scalar()
+
+
+def add_stock(session: Session, product_id: int, quantity: int, stripe_count: int) -> None:
+    """
+    Adds stock to a random stripe of a striped product.
+
+    :raises ValueError: If the stripe doesn't exist, e.g. the stripe count was set without `configure_stripes`.
+    """
+    stripe = random.randrange(stripe_count)
+    added = session.execute(update(ProductStockStripe)
+                            .where(ProductStockStripe.product_id == product_id, ProductStockStripe.stripe == stripe)
+                            .values(stock=ProductStockStripe.stock + quantity)
+                            .returning(ProductStockStripe.stripe)).scalar_one_or_none()
+    if added is None:
+        raise ValueError(f"Stripe {stripe} of product {product_id} is missing, configure its stripes again")
+
+
+def _gather(session: Session, product_id: int, quantity: int) -> bool:
+    # Locks the product row before its stripes, in the same order as `configure_stripes`.
+    row = session.execute(select(Product.stock, Product.reserved).where(Product.id == product_id)
+                          .with_for_update()).one()
+    stripes = session.execute(select(ProductStockStripe.stripe, ProductStockStripe.stock)
+                              .where(ProductStockStripe.product_id == product_id)
+                              .order_by(ProductStockStripe.stripe)
+                              .with_for_update()).all()
+    if sum(stock for _, stock in stripes) + row.stock - row.reserved < quantity:
+        return False
+
+    remaining = quantity
+    taken = []
+    for stripe, stock in sorted(stripes, key=lambda stripe: stripe[1], reverse=True):
+        if not remaining:
+            break
+        take = min(stock, remaining)
+        taken.append({'product_id': product_id, 'stripe': stripe, 'stock': stock - take})
+        remaining -= take
+    if taken:
+        session.execute(update(ProductStockStripe), taken)
+    if remaining:
+        session.execute(update(Product).where(Product.id == product_id).values(stock=Product.stock - remaining))
+    return True
+
+
+def take_stock(session: Session, product_id: int, quantity: int, stripe_count: int) -> bool:
+    """
+    Removes stock from a striped product.
+
+    Stripes are tried in random order with one conditional UPDATE each, so
+    concurrent sales rarely wait on the same row. If no single stripe holds enough, the unreserved stock of
+    the product row is tried, and then the stock is gathered from all the stripes under a lock.
+
+    :return: Whether there was enough available stock.
+    """
+    stripes = random.sample(range(stripe_count), stripe_count)
+    for stripe in stripes:
+        taken = session.execute(update(ProductStockStripe)
+                                .where(ProductStockStripe.product_id == product_id,
+                                       ProductStockStripe.stripe == stripe,
+                                       ProductStockStripe.stock >= quantity)
+                                .values(stock=ProductStockStripe.stock - quantity)
+                                .returning(ProductStockStripe.stripe)).scalar_one_or_none()
+        if taken is not None:
+            return True
+
+    taken = session.execute(update(Product)
+                            .where(Product.id == product_id, Product.available >= quantity)
+                            .values(stock=Product.stock - quantity)
+                            .returning(Product.id)).scalar_one_or_none()
+    if taken is not None:
+        return True
+    logger.info(f"No stripe of product {product_id} holds {quantity}, gathering its stock")
+    return _gather(session, product_id, quantity)
+
+
+def _redistribute(session: Session, product_id: int, stripe_count: int | None = None) -> int | None:
+    """
+    Spreads the unreserved stock of a product evenly over `stripe_count` stripes, or moves it all back to
+    the product row if `stripe_count` is 0. The reserved stock stays on the product row, where holds are
+    confirmed.
+
+    :param stripe_count: The new number of stripes, the current one if None.
+    :return: The total stock, None if the product does not exist.
+    """
+    row = session.execute(select(Product.stock, Product.reserved, Product.stripe_count)
+                          .where(Product.id == product_id)
+                          .with_for_update()).one_or_none()
+    if row is None:
+        return None
+    if stripe_count is None:
+        stripe_count = row.stripe_count
+    stripes = dict(session.execute(select(ProductStockStripe.stripe, ProductStockStripe.stock)
+                                   .where(ProductStockStripe.product_id == product_id)
+                                   .with_for_update()).all())
+    total = row.stock + sum(stripes.values())
+    unreserved = total - row.reserved
+
+    shares = split_evenly(unreserved, stripe_count) if stripe_count else []
+    session.execute(delete(ProductStockStripe).where(ProductStockStripe.product_id == product_id,
+                                                     ProductStockStripe.stripe >= stripe_count))
+    existing = [{'product_id': product_id, 'stripe': stripe, 'stock': share}
+                for stripe, share in enumerate(shares) if stripe in stripes]
+    new = [{'product_id': product_id, 'stripe': stripe, 'stock': share}
+           for stripe, share in enumerate(shares) if stripe not in stripes]
+    if existing:
+        session.execute(update(ProductStockStripe), existing)
+    if new:
+        session.execute(insert(ProductStockStripe), new)
+    session.execute(update(Product).where(Product.id == product_id).values(
+        stock=total - sum(shares), stripe_count=stripe_count))
+    return total
+
+
+@handle_exceptions()
+@retry_on_conflict()
+def configure_stripes(session: Session, product_id: int, stripe_count: int) -> int | None:
+    """
+    Splits the stock of a product across `stripe_count` stripes, 0 to stop striping it.
+
+    :return: The total stock, unchanged, None if the product does not exist.
+    """
+    if not 0 <= stripe_count <= MAX_STRIPES:
+        raise ValueError(f"The stripe count must be between 0 and {MAX_STRIPES}")
+    total = _redistribute(session, product_id, stripe_count)
+    if total is None:
+        session.rollback()
+        return None
+    session.commit()
+    invalidate_product(product_id)
+    logger.info(f"Product {product_id} stock is now split across {stripe_count} stripes")
+    return total
+
+
+def _is_unbalanced(stock: int, reserved: int, lowest: int, highest: int, total: int, count: int) -> bool:
+    # Unreserved stock left on the product row, e.g. by released holds, or stripes that drifted apart.
+    return stock > reserved or highest - lowest > max(1, total // (2 * count))
+
+
+@handle_exceptions()
+def rebalance_stripes(session: Session) -> int:
+    """
+    Evens out the stripes of the striped products whose stock drifted between them, one product per
+    transaction.
+
+    :return: The number of rebalanced products.
+    """
+    # Driven by the stripes, so only the striped products are read, by primary key, never the whole product table.
+    stripes = (select(ProductStockStripe.product_id,
+                      func.min(ProductStockStripe.stock).label('lowest'),
+                      func.max(ProductStockStripe.stock).label('highest'),
+                      func.sum(ProductStockStripe.stock).label('total'),
+                      func.count().label('count'))
+               .group_by(ProductStockStripe.product_id)
+               .subquery())
+    rows = session.execute(select(Product.id, Product.stock, Product.reserved, stripes.c.lowest, stripes.c.highest,
+                                  stripes.c.total, stripes.c.count)
+                           .join(stripes, stripes.c.product_id == Product.id)).all()
+    session.rollback()
+
+    rebalanced = 0
+    for row in rows:
+        if not _is_unbalanced(row.stock, row.reserved, row.lowest, row.highest, row.total, row.count):
+            continue
+        # The stripe count is read again under the lock, in case the product was reconfigured meanwhile.
+        total = _redistribute(session, row.id)
+        session.commit()
+        if total is not None:
+            rebalanced += 1
+    if rebalanced:
+        logger.info(f"Rebalanced the stripes of {rebalanced} products")
+    return rebalanced
@@ -0,0 +1,189 @@
+import logging
+import os
+from collections import defaultdict
+
+from sqlalchemy import select, insert, delete, func, case, literal, text
+from sqlalchemy.orm import Session
+from decorators import handle_exceptions
+from models import Product, Supplier, SupplierSummary, SupplierSummaryDelta
+from crud.stripe import TOTAL_STOCK
+
+logger = logging.getLogger(__name__)
+
+# Products with less stock than this count as low on stock in the supplier summaries.
+LOW_STOCK_THRESHOLD = int(os.environ.get('LOW_STOCK_THRESHOLD', 10))
+DEFAULT_COMPACT_BATCH_SIZE = 10000
+
+SUMMARY_FIELDS = ('product_count', 'units', 'inventory_value', 'low_stock_count')
+_DELTA_COLUMNS = ['supplier_id', *SUMMARY_FIELDS]
+
+
+def _is_low(stock):
+    return case((stock < LOW_STOCK_THRESHOLD, 1), else_=0)
+
+
+def product_deltas(product_filter, sign: int = 1):
+    """
+    INSERT ... SELECT of the deltas that add the products matching `product_filter` to the summaries of their
+    suppliers, or remove them with `sign=-1`. Removing products before a change and adding them back after it
+    accounts for any change of their supplier, price or stock. Soft-deleted products are not counted.
+    """
+    rows = (select(Product.supplier_id, literal(sign), TOTAL_STOCK * sign, Product.price * TOTAL_STOCK * sign,
+                   _is_low(TOTAL_STOCK) * sign)
+            .where(product_filter, Product.supplier_id.is_not(None), Product.deleted_at.is_(None)))
+    return insert(SupplierSummaryDelta).from_select(_DELTA_COLUMNS, rows)
+
+
+def stock_change_delta(product_id: int, change: int):
+    """
+    INSERT ... SELECT of the delta of a stock movement of `change` units, executed after the movement.
+    """
+    rows = (select(Product.supplier_id, literal(0), literal(change), Product.price * change,
+                   _is_low(TOTAL_STOCK) - _is_low(TOTAL_STOCK - change))
+            .where(Product.id == product_id, Product.supplier_id.is_not(None), Product.deleted_at.is_(None)))
+    return insert(SupplierSummaryDelta).from_select(_DELTA_COLUMNS, rows)
+
+
+def stock_change_row(supplier_id: int, price: float, before: int, after: int) -> dict:
+    """
+    Delta of a change of the stock of a product from `before` to `after`, for writers that know both.
+    """
+    return {'supplier_id': supplier_id, 'product_count': 0, 'units': after - before,
+            'inventory_value': price * (after - before),
+            'low_stock_count': (after < LOW_STOCK_THRESHOLD) - (before < LOW_STOCK_THRESHOLD)}
+
+
+def _summary(supplier_id: int, totals) -> dict:
+    product_count, units, inventory_value, low_stock_count = (value or 0 for value in totals)
+    return {'supplier_id': supplier_id, 'product_count': product_count, 'units': units,
+            'inventory_value': round(inventory_value, 2), 'low_stock_count': low_stock_count}
+
+
+@handle_exceptions()
+def list_supplier_summaries(session: Session,
+                            after_id: int | None = None,
+                            limit: int = 100,
+                            supplier_ids: list[int] | None = None) -> list[dict]:
+    """
+    Lists the summaries of the suppliers in ascending id order, using keyset pagination like `list_products`.
+
+    Each summary is its rollup row plus the deltas not compacted yet, so it reflects every committed change
+    without reading the products.
+
+    :param after_id: Only return suppliers with a greater id, None for the first page.
+    :param supplier_ids: Only return these suppliers.
+    """
+    query = (select(Supplier.id, *[getattr(SupplierSummary, field) for field in SUMMARY_FIELDS])
+             .outerjoin(SupplierSummary, SupplierSummary.supplier_id == Supplier.id))
+    if after_id is not None:
+        query = query.where(Supplier.id > after_id)
+    if supplier_ids is not None:
+        query = query.where(Supplier.id.in_(supplier_ids))
+    rows = session.execute(query.order_by(Supplier.id).limit(limit)).all()
+    if not rows:
+        return []
+
+    totals = {row[0]: list(row[1:]) for row in rows}
+    pending = session.execute(
+        select(SupplierSummaryDelta.supplier_id,
+               *[func.sum(getattr(SupplierSummaryDelta, field)) for field in SUMMARY_FIELDS])
+        .where(SupplierSummaryDelta.supplier_id.in_(totals))
+        .group_by(SupplierSummaryDelta.supplier_id))
+    for supplier_id, *changes in pending:
+        totals[supplier_id] = [(total or 0) + change for total, change in zip(totals[supplier_id], changes)]
+    return [_summary(supplier_id, values) for supplier_id, values in totals.items()]
+
+
+@handle_exceptions()
+def get_supplier_summary(session: Session, supplier_id: int) -> dict | None:
+    """
+    :return: The summary of the supplier, None if it does not exist.
+    """
+    summaries = list_supplier_summaries(session, supplier_ids=[supplier_id], limit=1)
+    return summaries[0] if summaries else None
+
+
+def _increment_summaries(session: Session, rows: list[dict]):
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    else:
+        raise ValueError(f'Upserts are not supported on {dialect}')
+
+    statement = upsert(SupplierSummary).values(rows)
+    columns = SupplierSummary.__table__.c
+    return statement.on_conflict_do_update(
+        index_elements=['supplier_id'],
+        set_={field: columns[field] + statement.excluded[field] for field in SUMMARY_FIELDS},
+    )
+
+
+@handle_exceptions()
+def compact_supplier_summaries(session: Session, batch_size: int = DEFAULT_COMPACT_BATCH_SIZE) -> int:
+    """
+    Folds the pending deltas into the summary rows, `batch_size` deltas per transaction.
+
+    Deltas are claimed with DELETE ... RETURNING and FOR UPDATE SKIP LOCKED, so deltas committed meanwhile are
+    left for the next batch and concurrent compactions don't fold the same delta twice. Summary rows are updated
+    in supplier id order, so they can't deadlock each other either.
+
+    :return: The number of folded deltas.
+    """
+    compacted = 0
+    while True:
+        claimed = (select(SupplierSummaryDelta.id)
+                   .order_by(SupplierSummaryDelta.id)
+                   .limit(batch_size)
+                   .with_for_update(skip_locked=True))
+        deltas = session.execute(delete(SupplierSummaryDelta)
+                                 .where(SupplierSummaryDelta.id.in_(claimed))
+                                 .returning(*[getattr(SupplierSummaryDelta, column) for column in _DELTA_COLUMNS])
+                                 ).all()
+        if not deltas:
+            session.rollback()
+            break
+
+        totals = defaultdict(lambda: [0, 0, 0.0, 0])
+        for supplier_id, *changes in deltas:
+            totals[supplier_id] = [total + change for total, change in zip(totals[supplier_id], changes)]
+        # Deltas of deleted suppliers are dropped.
+        existing = set(session.scalars(select(Supplier.id).where(Supplier.id.in_(totals))))
+        rows = [dict(zip(_DELTA_COLUMNS, [supplier_id, *totals[supplier_id]]))
+                for supplier_id in sorted(totals) if supplier_id in existing]
+        if rows:
+            session.execute(_increment_summaries(session, rows))
+        session.commit()
+        compacted += len(deltas)
+        if len(deltas) < batch_size:
+            break
+
+    if compacted:
+        logger.debug(f"Folded {compacted} supplier summary deltas")
+    return compacted
+
+
+@handle_exceptions()
+def rebuild_supplier_summaries(session: Session) -> int:
+    """
+    Recomputes every supplier summary from the products, to repair drifted totals or after loading products
+    around the CRUD functions.
+
+    On PostgreSQL the delta table is locked first, so the writers in flight commit before the products are read,
+    and the writers that follow wait and add their deltas on top of the rebuilt summaries.
+
+    :return: The number of summaries written.
+    """
+    if session.get_bind().dialect.name == 'postgresql':
+        session.execute(text(f'LOCK TABLE {SupplierSummaryDelta.__tablename__} IN EXCLUSIVE MODE'))
+    session.execute(delete(SupplierSummaryDelta))
+    session.execute(delete(SupplierSummary))
+    rows = (select(Product.supplier_id, func.count(Product.id), func.sum(TOTAL_STOCK),
+                   func.sum(Product.price * TOTAL_STOCK), func.sum(_is_low(TOTAL_STOCK)))
+            .where(Product.supplier_id.is_not(None), Product.deleted_at.is_(None))
+            .group_by(Product.supplier_id))
+    result = session.execute(insert(SupplierSummary).from_select(_DELTA_COLUMNS, rows))
+    session.commit()
+    logger.info(f"Rebuilt the summaries of {result.rowcount} suppliers")
+    return result.rowcount
@@ -1,12 +1,18 @@
 import logging
 
+from sqlalchemy import update
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from decorators import handle_exceptions
-from models import Supplier
+from cache import get_cached_supplier, set_cached_supplier, invalidate_supplier, to_detached
+from decorators import handle_exceptions, retry_on_conflict
+from models import Supplier, Product
+from crud.delete import delete_suppliers
+from crud.alert import detect_crossings
 
 logger = logging.getLogger(__name__)
 
+SUPPLIER_FIELDS = ('id', 'name', 'email', 'phone_number')
+
 
 @handle_exceptions()
 def create_supplier(session: Session, name: str, email: str, phone_number: str) -> Supplier:
@@ -31,7 +37,13 @@ def create_supplier(session: Session, name: str, email: str, phone_number: str)
 
 @handle_exceptions()
 def get_supplier(session: Session, supplier_id: int) -> Supplier | None:
+    fields = get_cached_supplier(supplier_id)
+    if fields is not None:
+        return session.merge(to_detached(Supplier, fields), load=False)
+
     supplier = session.query(Supplier).filter_by(id=supplier_id).first()
+    if supplier:
+        set_cached_supplier(supplier_id, {field: getattr(supplier, field) for field in SUPPLIER_FIELDS})
     return supplier
 
 
@@ -50,6 +62,7 @@ def update_supplier(session: Session, supplier_id: int, name: str = None, email:
         if phone_number:
             supplier.phone_number = phone_number
         session.commit()
+        invalidate_supplier(supplier_id)
         session.refresh(supplier)
         return supplier
     except IntegrityError:
@@ -62,15 +75,30 @@ def update_supplier(session: Session, supplier_id: int, name: str = None, email:
 
 
 @handle_exceptions()
-def delete_supplier(session: Session, supplier_id: int) -> bool:
-    try:
-        supplier = session.query(Supplier).filter_by(id=supplier_id).first()
-        if supplier:
-            session.delete(supplier)
-            session.commit()
-            return True
-        return False
-    except Exception as e:
+@retry_on_conflict()
+def set_supplier_reorder_threshold(session: Session, supplier_id: int, threshold: int | None) -> bool:
+    """
+    Sets the reorder threshold of the products of a supplier without one of their own, and checks them against it.
+
+    :return: False if the supplier doesn't exist.
+    """
+    found = session.execute(update(Supplier)
+                            .where(Supplier.id == supplier_id, Supplier.deleted_at.is_(None))
+                            .values(reorder_threshold=threshold)
+                            .returning(Supplier.id)).first()
+    if found is None:
         session.rollback()
-        logger.error(f"Error deleting supplier: {e}")
-        raise ValueError("An error occurred while deleting the supplier.")
+        return False
+    detect_crossings(session, Product.supplier_id == supplier_id)
+    session.commit()
+    return True
+
+
+@handle_exceptions()
+def delete_supplier(session: Session, supplier_id: int, soft: bool = False) -> bool:
+    """
+    Deletes a supplier and its products in batches, without loading them, see `crud.delete`.
+
+    :param soft: Only set the `deleted_at` of the supplier and its products.
+    """
+    return delete_suppliers(session, [supplier_id], soft=soft) == 1
@@ -1,24 +1,35 @@
-import psycopg2
-import os
-from dotenv import load_dotenv
+import logging
+from contextlib import contextmanager
+from typing import Iterator
 
-load_dotenv()
+from sqlalchemy.pool import PoolProxiedConnection
 
+from orm_setup import get_engine
+
+logger = logging.getLogger(__name__)
 
-def get_db_connection() -> psycopg2.extensions.connection:
-    try:
-        conn = psycopg2.connect(database=os.environ.get("DB_NAME"),
-                                host=os.environ.get("DB_HOST"),
-                                user=os.environ.get("DB_USER"),
-                                password=os.environ.get("DB_PASS"),
-                                port=os.environ.get("DB_PORT"))
-        return conn
-    except psycopg2.OperationalError as e:
-        print(f"Could not connect to the database: {e}")
-        raise e
 
+def get_db_connection() -> PoolProxiedConnection:
+    """
+    Checks out a raw psycopg2 connection from the engine's pool. Closing it returns it to the pool.
+    """
+    return get_engine().raw_connection()
 
-def get_db_cursor() -> psycopg2.extensions.cursor:
+
+@contextmanager
+def get_db_cursor() -> Iterator:
+    """
+    Yields a cursor on a pooled connection, and closes both on exit, which returns the connection to the pool. The
+    connection is held for as long as the cursor is used, so it can't go back to the pool while it still runs.
+    Uncommitted work is rolled back on exit, commit it with `cursor.connection.commit()`.
+    """
     conn = get_db_connection()
-    print("Connected to PostgreSQL")
-    return conn.cursor()
+    logger.debug("Checked out a database connection")
+    try:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
@@ -1,8 +1,25 @@
+import asyncio
+import inspect
 import logging
+import random
+import time
 from functools import wraps
 
+from sqlalchemy.exc import DBAPIError
+
 logger = logging.getLogger()
 
+# serialization_failure and deadlock_detected
+TRANSIENT_PGCODES = {'40001', '40P01'}
+
+
+def _log_exception(func, error: Exception) -> None:
+    # ValueErrors are expected outcomes, such as insufficient stock, and don't need a traceback.
+    if isinstance(error, ValueError):
+        logger.warning(f"{func.__name__} failed: {error}")
+    else:
+        logger.error(f"An error occurred in {func.__name__}: {error}", exc_info=True)
+
 
 def handle_exceptions(suppress: bool = False):
     """
@@ -13,12 +30,25 @@ def handle_exceptions(suppress: bool = False):
     """
 
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    _log_exception(func, e)
+                    if not suppress:
+                        raise
+                    return None
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             try:
                 return func(*args, **kwargs)
             except Exception as e:
-                logger.error(f"An error occurred in {func.__name__}: {e}", exc_info=True)
+                _log_exception(func, e)
                 if not suppress:
                     raise
                 return None
@@ -26,3 +56,66 @@ def handle_exceptions(suppress: bool = False):
         return wrapper
 
     return decorator
+
+
+def is_transient_conflict(error: Exception) -> bool:
+    """
+    Tells whether a database error is a serialization failure or a deadlock, which are safe to retry.
+    """
+    return isinstance(error, DBAPIError) and getattr(error.orig, 'pgcode', None) in TRANSIENT_PGCODES
+
+
+def conflict_backoff(attempt: int, base_delay: float = 0.01, max_delay: float = 0.5) -> float:
+    """
+    :return: Seconds to wait before retrying after the `attempt`-th transient conflict, growing exponentially with
+        full jitter up to `max_delay`, so the conflicting transactions don't retry in lockstep.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def retry_on_conflict(max_attempts: int = 5, base_delay: float = 0.01, max_delay: float = 0.5):
+    """
+    Decorator to retry a database operation that failed with a transient conflict.
+    The session, given as first argument, is rolled back before each new attempt and
+    the wait between attempts grows exponentially with full jitter, up to `max_delay`.
+
+    :param max_attempts: Number of attempts before the error is raised.
+    :param base_delay: Delay in seconds before the second attempt.
+    :param max_delay: Upper bound in seconds of the delay between attempts.
+    """
+
+    def backoff(func, attempt: int) -> float:
+        delay = conflict_backoff(attempt, base_delay, max_delay)
+        logger.warning(f"Transient conflict in {func.__name__}, attempt {attempt}/{max_attempts}, "
+                       f"retrying in {delay * 1000:.0f} ms")
+        return delay
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(session, *args, **kwargs):
+                for attempt in range(1, max_attempts + 1):
+                    try:
+                        return await func(session, *args, **kwargs)
+                    except DBAPIError as e:
+                        await session.rollback()
+                        if not is_transient_conflict(e) or attempt == max_attempts:
+                            raise
+                        await asyncio.sleep(backoff(func, attempt))
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(session, *args, **kwargs):
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    return func(session, *args, **kwargs)
+                except DBAPIError as e:
+                    session.rollback()
+                    if not is_transient_conflict(e) or attempt == max_attempts:
+                        raise
+                    time.sleep(backoff(func, attempt))
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,31 @@
+import enum
+
+# Kept free of SQLAlchemy, so the CLI can build its parser without importing it.
+
+
+class OperationType(enum.Enum):
+    ADD = 'ADD'
+    SUBTRACT = 'SUBTRACT'
+    SALE = 'SALE'
+    # Holds only move stock between available and reserved, they don't change the stock level.
+    RESERVE = 'RESERVE'
+    RELEASE = 'RELEASE'
+
+
+class HoldStatus(enum.Enum):
+    ACTIVE = 'ACTIVE'
+    CONFIRMED = 'CONFIRMED'
+    RELEASED = 'RELEASED'
+    EXPIRED = 'EXPIRED'
+
+
+class ChangeType(enum.Enum):
+    CREATED = 'CREATED'
+    UPDATED = 'UPDATED'
+    # Stock or reserved stock moved, by a stock update or a hold.
+    STOCK = 'STOCK'
+    DELETED = 'DELETED'
+
+
+# Operations of `update_stock`, holds are placed and ended through `crud.hold`.
+STOCK_OPERATIONS = (OperationType.ADD, OperationType.SUBTRACT, OperationType.SALE)
@@ -0,0 +1,188 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import sessionmaker
+
+from cache import set_product_stock
+from crud.product import _check_stock_operation, _use_stock_isolation, _write_stock_movements
+from decorators import is_transient_conflict, conflict_backoff
+from metrics import GROUP_COMMIT_METRICS
+from models import OperationType
+from orm_setup import _env_flag
+
+logger = logging.getLogger(__name__)
+
+
+# Apply single stock updates of the API in shared transactions instead of one commit each.
+GROUP_COMMIT = _env_flag('GROUP_COMMIT')
+# A batch is flushed when it holds this many movements...
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get('GROUP_COMMIT_MAX_BATCH', 100))
+# ...or when its first movement has waited this long, which bounds the added latency.
+GROUP_COMMIT_MAX_DELAY_MS = float(os.environ.get('GROUP_COMMIT_MAX_DELAY_MS', 5))
+GROUP_COMMIT_QUEUE_SIZE = int(os.environ.get('GROUP_COMMIT_QUEUE_SIZE', 10000))
+# How long a request waits for room in a full queue before it is refused.
+GROUP_COMMIT_ENQUEUE_TIMEOUT = float(os.environ.get('GROUP_COMMIT_ENQUEUE_TIMEOUT', 0.1))
+# How long a request waits for its movement to be committed before it gives up on the response.
+GROUP_COMMIT_RESULT_TIMEOUT = float(os.environ.get('GROUP_COMMIT_RESULT_TIMEOUT', 30))
+FLUSH_ATTEMPTS = 3
+
+
+class GroupCommitBusy(Exception):
+    """
+    Raised when the group-commit queue stays full, so callers can back off.
+    """
+
+
+class _Entry:
+    __slots__ = ('product_id', 'quantity', 'operation', 'future', 'enqueued_at')
+
+    def __init__(self, product_id: int, quantity: int, operation: OperationType):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.operation = operation
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class GroupCommitter:
+    """
+    Gathers the stock movements of concurrent requests in a bounded queue and commits them in batches from
+    one flusher thread, so many movements share a single commit.
+
+    A batch is written like `bulk_update_stock` without `all_or_nothing`: each movement succeeds or fails on
+    its own, and every caller's future is resolved once the batch is committed.
+    """
+
+    def __init__(self,
+                 session_factory: sessionmaker,
+                 max_batch: int = GROUP_COMMIT_MAX_BATCH,
+                 max_delay_ms: float = GROUP_COMMIT_MAX_DELAY_MS,
+                 queue_size: int = GROUP_COMMIT_QUEUE_SIZE,
+                 enqueue_timeout: float = GROUP_COMMIT_ENQUEUE_TIMEOUT):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: queue.Queue[_Entry] = queue.Queue(maxsize=queue_size)
+        # Held while checking for a stop and enqueueing, so nothing is enqueued once the flusher may have exited.
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the flusher once the movements already queued are committed.
+        """
+        with self._lock:
+            self._stop.set()
+        self._thread.join()
+
+    def submit(self, product_id: int, quantity: int, operation: OperationType, block: bool = True) -> Future:
+        """
+        Queues a stock movement.
+
+        :param block: Wait up to `enqueue_timeout` seconds for room in a full queue, pass False from the event loop.
+
+        :return: A future resolved with the new stock once the movement is committed, or with a ValueError
+            if it can't be applied.
+        :raises GroupCommitBusy: If the queue stays full for `enqueue_timeout` seconds.
+        """
+        _check_stock_operation(operation)
+        entry = _Entry(product_id, quantity, operation)
+        deadline = time.perf_counter() + (self.enqueue_timeout if block else 0)
+        while True:
+            with self._lock:
+                if self._stop.is_set():
+                    raise GroupCommitBusy("Group commit is shutting down")
+                try:
+                    self._queue.put_nowait(entry)
+                    return entry.future
+                except queue.Full:
+                    pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                GROUP_COMMIT_METRICS.observe_rejected()
+                raise GroupCommitBusy("Too many pending stock updates, please retry")
+            # Waits for room outside of the lock, so a full queue doesn't hold up the shutdown.
+            time.sleep(min(remaining, 0.005))
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def _next_batch(self) -> list[_Entry]:
+        try:
+            first = self._queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = first.enqueued_at + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: list[_Entry]) -> None:
+        movements = [(entry.product_id, entry.quantity, entry.operation) for entry in batch]
+        for attempt in range(1, FLUSH_ATTEMPTS + 1):
+            try:
+                with self.session_factory() as session:
+                    _use_stock_isolation(session)
+                    results, stock = _write_stock_movements(session, movements, all_or_nothing=False)
+                    session.commit()
+                break
+            except Exception as e:
+                if isinstance(e, DBAPIError) and is_transient_conflict(e) and attempt < FLUSH_ATTEMPTS:
+                    time.sleep(conflict_backoff(attempt))
+                    continue
+                logger.error(f"Group commit of {len(batch)} stock movements failed: {e}", exc_info=True)
+                for entry in batch:
+                    entry.future.set_exception(e)
+                return
+
+        for product_id, product_stock in stock.items():
+            set_product_stock(product_id, product_stock)
+        committed_at = time.perf_counter()
+        GROUP_COMMIT_METRICS.observe_flush([committed_at - entry.enqueued_at for entry in batch])
+        for entry, result in zip(batch, results):
+            if result['success']:
+                entry.future.set_result(result['stock'])
+            else:
+                entry.future.set_exception(ValueError(result['detail']))
+
+
+_committer: GroupCommitter | None = None
+
+
+def start_group_commit(session_factory: sessionmaker) -> GroupCommitter:
+    global _committer
+    _committer = GroupCommitter(session_factory)
+    _committer.start()
+    return _committer
+
+
+def stop_group_commit() -> None:
+    global _committer
+    if _committer is not None:
+        _committer.stop()
+        _committer = None
+
+
+def get_group_committer() -> GroupCommitter | None:
+    return _committer
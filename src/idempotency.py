@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable
+
+from fastapi import HTTPException, Header, Response
+from pydantic_core import to_jsonable_python
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from cache import LRUCache
+from models import IdempotencyKey
+from crud.idempotency import claim_idempotency_key, complete_idempotency_key, release_idempotency_key
+
+# Seconds a response is kept for the retries of its request.
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+# Seconds a key stays claimed by a request that stored no response, e.g. because its process died. Longer than the
+# slowest request, or a retry may run it while it still runs.
+IDEMPOTENCY_LEASE = float(os.environ.get('IDEMPOTENCY_LEASE', 60))
+# Responses kept in each process, so most retries are answered without reading the database.
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+
+# Header that tells the client a response was stored, not produced by this request.
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# Errors that depend on the moment, not on the request, so a retry runs the request again.
+TRANSIENT_STATUS_CODES = {409, 429, 503}
+
+# Parameter of the routes that accept an `Idempotency-Key` header.
+IdempotencyKeyHeader = Header(None, alias='Idempotency-Key', min_length=1, max_length=255,
+                              description='Unique key of the request, its retries with the same key get the same '
+                                          'response without applying it again')
+
+
+class IdempotencyConflict(HTTPException):
+    """
+    The key is taken by another request, still running or with different parameters.
+    """
+
+
+def fingerprint(endpoint: str, parameters: dict) -> str:
+    """
+    :return: Hash of a request, the same for every retry of it however its JSON body is ordered.
+    """
+    return hashlib.sha256(json.dumps([endpoint, to_jsonable_python(parameters)], sort_keys=True).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Runs each request with an `Idempotency-Key` at most once, and answers its retries with the stored response.
+
+    Responses are stored in the `IdempotencyKey` table, shared by the processes, with an LRU cache of the recent
+    ones in front, so a retry reaching the same process costs no query. Concurrent duplicates in a process wait
+    for the first one and get its response, in other processes they get a 409 until it completes.
+
+    Successful responses and client errors are stored. Transient errors and failures are not, and the key is
+    released so the request can be retried. If the process dies while a request runs, its key stays claimed for
+    the `lease`, after which a retry runs the request again, whether or not it was applied.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, cache_size: int = IDEMPOTENCY_CACHE_SIZE,
+                 lease: float = IDEMPOTENCY_LEASE):
+        self.ttl = ttl
+        self.lease = lease
+        self._cache = LRUCache(max_entries=cache_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, Future] = {}
+
+    def _lookup(self, key: str) -> tuple[Future, bool]:
+        """
+        :return: The future outcome of the request of `key`, already done if it is cached, and whether this request
+            runs it. Otherwise it is a duplicate, which waits for the future.
+        """
+        future = Future()
+        cached = self._cache.get(key)
+        if cached is not None:
+            future.set_result(cached)
+            return future, False
+        with self._lock:
+            if key in self._in_flight:
+                return self._in_flight[key], False
+            self._in_flight[key] = future
+        return future, True
+
+    def _finish(self, key: str, future: Future, outcome: tuple | None, error: BaseException | None) -> None:
+        if outcome is not None:
+            self._cache.set(key, outcome)
+            future.set_result(outcome)
+        else:
+            future.set_exception(error)
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def _settle(self, session: Session, key: str, future: Future, outcome: tuple | None,
+                error: BaseException | None) -> None:
+        """
+        Stores the outcome of the request of a claimed key, or releases the key if there is nothing to store, and
+        hands the outcome to the duplicates waiting for it.
+        """
+        try:
+            if isinstance(error, IdempotencyConflict):
+                # The key was claimed by a request in another process, it is not ours to release.
+                pass
+            elif outcome is not None:
+                complete_idempotency_key(session, key, outcome[1], json.dumps(outcome[2]), self.ttl)
+            else:
+                release_idempotency_key(session, key)
+        finally:
+            self._finish(key, future, outcome, error)
+
+    @staticmethod
+    def _stored(row: IdempotencyKey) -> tuple[str, int, Any]:
+        if row.status_code is None:
+            raise IdempotencyConflict(status_code=409,
+                                      detail='A request with this Idempotency-Key is in progress, please retry',
+                                      headers={'Retry-After': '1'})
+        return row.fingerprint, row.status_code, json.loads(row.response)
+
+    @staticmethod
+    def _outcome(request_fingerprint: str, content: Any = None, error: HTTPException | None = None) -> tuple | None:
+        """
+        :return: The (fingerprint, status code, body) to store for a response or a client error, None for an error
+            that must not be stored.
+        """
+        if error is None:
+            return request_fingerprint, 200, to_jsonable_python(content)
+        if error.status_code < 500 and error.status_code not in TRANSIENT_STATUS_CODES:
+            return request_fingerprint, error.status_code, {'detail': error.detail}
+        return None
+
+    @staticmethod
+    def _replay(response: Response, request_fingerprint: str, outcome: tuple[str, int, Any]) -> Any:
+        stored_fingerprint, status_code, body = outcome
+        if stored_fingerprint != request_fingerprint:
+            raise IdempotencyConflict(status_code=422,
+                                      detail='This Idempotency-Key was already used for another request')
+        if status_code >= 400:
+            raise HTTPException(status_code=status_code, detail=body['detail'], headers={REPLAYED_HEADER: 'true'})
+        response.headers[REPLAYED_HEADER] = 'true'
+        return body
+
+    def run(self, session: Session, response: Response, key: str, endpoint: str, parameters: dict,
+            execute: Callable[[], Any]) -> Any:
+        """
+        Runs `execute` unless the request of `key` already ran, in which case its stored response is returned,
+        or its error raised again.
+
+        :param endpoint: Name of the operation, which with `parameters` must be the same for every retry.
+        :return: The content of the response, as JSON-compatible values.
+        """
+        request_fingerprint = fingerprint(endpoint, parameters)
+        future, owner = self._lookup(key)
+        if not owner:
+            return self._replay(response, request_fingerprint, future.result())
+
+        outcome = error = None
+        try:
+            existing = claim_idempotency_key(session, key, request_fingerprint, self.lease)
+            if existing is not None:
+                outcome = self._stored(existing)
+                self._finish(key, future, outcome, None)
+                return self._replay(response, request_fingerprint, outcome)
+            try:
+                content = execute()
+            except HTTPException as e:
+                outcome = self._outcome(request_fingerprint, error=e)
+                raise
+            outcome = self._outcome(request_fingerprint, content)
+            return outcome[2]
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if not future.done():
+                self._settle(session, key, future, outcome, error)
+
+    async def run_async(self, session: AsyncSession, response: Response, key: str, endpoint: str, parameters: dict,
+                        execute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Like `run`, for the async routes. Duplicates wait for the first request without blocking the event loop.
+        """
+        request_fingerprint = fingerprint(endpoint, parameters)
+        future, owner = self._lookup(key)
+        if not owner:
+            return self._replay(response, request_fingerprint, await asyncio.wrap_future(future))
+
+        outcome = error = None
+        try:
+            existing = await session.run_sync(claim_idempotency_key, key, request_fingerprint, self.lease)
+            if existing is not None:
+                outcome = self._stored(existing)
+                self._finish(key, future, outcome, None)
+                return self._replay(response, request_fingerprint, outcome)
+            try:
+                content = await execute()
+            except HTTPException as e:
+                outcome = self._outcome(request_fingerprint, error=e)
+                raise
+            outcome = self._outcome(request_fingerprint, content)
+            return outcome[2]
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if not future.done():
+                await session.run_sync(self._settle, key, future, outcome, error)
+
+
+_store = IdempotencyStore()
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    return _store
+
+
+def idempotent(session: Session, response: Response, key: str | None, endpoint: str, parameters: dict,
+               execute: Callable[[], Any]) -> Any:
+    """
+    Runs `execute` once per `key`, see `IdempotencyStore.run`, or every time if the request has no key.
+    """
+    if key is None:
+        return execute()
+    return _store.run(session, response, key, endpoint, parameters, execute)
+
+
+async def idempotent_async(session: AsyncSession, response: Response, key: str | None, endpoint: str,
+                           parameters: dict, execute: Callable[[], Awaitable[Any]]) -> Any:
+    if key is None:
+        return await execute()
+    return await _store.run_async(session, response, key, endpoint, parameters, execute)
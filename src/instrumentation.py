@@ -0,0 +1,113 @@
+import logging
+import os
+import time
+
+from sqlalchemy import event, Engine
+
+from metrics import REQUEST_METRICS, current_request_stats, start_request_stats, end_request_stats
+from orm_setup import _env_flag
+
+
+# Record per-request statement counts, database time and latency histograms.
+REQUEST_METRICS_ENABLED = _env_flag('REQUEST_METRICS', 'true')
+# Requests and statements slower than these go to the slow log, 0 logs all of them.
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+# Parameters can hold customer data, so they can be left out of the slow log.
+SLOW_LOG_PARAMETERS = _env_flag('SLOW_LOG_PARAMETERS', 'true')
+MAX_LOGGED_PARAMETERS_LENGTH = 500
+
+slow_logger = logging.getLogger('slow')
+
+
+def _statement_kind(statement: str) -> str:
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    return kind if kind in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH') else 'OTHER'
+
+
+def _format_statement(statement: str, parameters) -> str:
+    statement = ' '.join(statement.split())
+    if not SLOW_LOG_PARAMETERS or not parameters:
+        return statement
+    formatted = repr(parameters)
+    if len(formatted) > MAX_LOGGED_PARAMETERS_LENGTH:
+        formatted = f'{formatted[:MAX_LOGGED_PARAMETERS_LENGTH]}...'
+    return f'{statement} {formatted}'
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('statement_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - connection.info['statement_start'].pop()
+    REQUEST_METRICS.query_duration.observe(seconds, _statement_kind(statement))
+    stats = current_request_stats()
+    if stats is not None:
+        stats.observe_statement(seconds, cursor.rowcount, statement, parameters)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        slow_logger.warning(f"Slow statement ({seconds * 1000:.1f} ms): {_format_statement(statement, parameters)}")
+
+
+def _handle_error(exception_context):
+    # The statement failed, so `after_cursor_execute` won't pop its start time.
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('statement_start'):
+        connection.info['statement_start'].pop()
+
+
+def instrument_engines() -> None:
+    """
+    Times every statement of every engine of the process, including the sync engine behind the async one, for the
+    statement histogram, the stats of the current request and the slow log.
+    """
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware that records the latency and the database work of each request under its route template, adds
+    them as a `Server-Timing` header, and logs the requests slower than `SLOW_REQUEST_MS`.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        token = start_request_stats()
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                stats = current_request_stats()
+                timing = (f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.statements} statements", '
+                          f'total;dur={(time.perf_counter() - start) * 1000:.1f}')
+                message['headers'] = [*message.get('headers', []), (b'server-timing', timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            seconds = time.perf_counter() - start
+            stats = end_request_stats(token)
+            # The route template, not the path, so ids don't create a series per product.
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            REQUEST_METRICS.observe_request(scope['method'], route, status, seconds, stats)
+            if seconds * 1000 >= SLOW_REQUEST_MS:
+                message = (f"Slow request {scope['method']} {route} {status} ({seconds * 1000:.1f} ms): "
+                           f"{stats.statements} statements, {stats.db_seconds * 1000:.1f} ms in the database, "
+                           f"{stats.pool_wait_seconds * 1000:.1f} ms waiting for a connection, {stats.rows} rows")
+                if stats.slowest:
+                    slowest_seconds, statement, parameters = stats.slowest
+                    message += (f". Slowest statement ({slowest_seconds * 1000:.1f} ms): "
+                                f"{_format_statement(statement, parameters)}")
+                slow_logger.warning(message)
@@ -1,5 +1,14 @@
+import atexit
+import copy
+import json
+import logging.config
+import logging.handlers
 import pathlib
 import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
 
 PROJECT_ROOT_PATH = pathlib.Path(__file__).parent.parent
 LOG_PATH = f'{PROJECT_ROOT_PATH}/logs'
@@ -9,6 +18,125 @@ if not os.path.isfile(f'{LOG_PATH}/logs.log'):
     with open(f'{LOG_PATH}/logs.log', 'w') as f:
         pass
 
+
+def _env_flag(name: str, default: str = 'false') -> bool:
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+# Level of the root logger, DEBUG records are not even formatted below it.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# `text` or `json`, one JSON object per line.
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+# Write the records from a background thread, so requests don't wait on the console or the disk.
+LOG_QUEUE = _env_flag('LOG_QUEUE', 'true')
+# Log files are rotated at this size, or at the interval of LOG_ROTATE_WHEN (e.g. `midnight`) if that is set.
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_ROTATE_WHEN = os.environ.get('LOG_ROTATE_WHEN', '')
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+# Warnings and errors logged from the same line more than this many times per period are dropped, 0 disables it.
+LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT', 10))
+LOG_RATE_LIMIT_PERIOD = float(os.environ.get('LOG_RATE_LIMIT_PERIOD', 60))
+
+# Attributes every LogRecord has, anything else was passed with `extra`.
+_RECORD_ATTRIBUTES = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime',
+                                                                                     '_rate_limit_passed'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object, with the fields passed through `extra` as additional keys.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `rate` warnings and errors per `period` seconds from each line of code, so a failure that
+    repeats for every request doesn't flood the logs. The first record let through after a period notes how many
+    were dropped.
+    """
+
+    def __init__(self, rate: int = LOG_RATE_LIMIT, period: float = LOG_RATE_LIMIT_PERIOD):
+        super().__init__()
+        self.rate = rate
+        self.period = period
+        self._lock = threading.Lock()
+        # (path, line) -> [period start, records let through, records dropped]
+        self._windows: dict[tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.rate or record.levelno < logging.WARNING:
+            return True
+        # Every handler of the record asks, only the first one counts it.
+        decision = getattr(record, '_rate_limit_passed', None)
+        if decision is None:
+            decision = record._rate_limit_passed = self._count(record)
+        return decision
+
+    def _count(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                dropped = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.rate:
+                window[1] += 1
+                dropped = 0
+            else:
+                window[2] += 1
+                return False
+        if dropped:
+            record.msg = f'{record.getMessage()} ({dropped} similar messages dropped)'
+            record.args = None
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the default, leaves the formatting, and the traceback, to the listener thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _file_handler(filename: str, formatter: str, level: str) -> dict:
+    handler = {
+        'formatter': formatter,
+        'level': level,
+        'filename': f'{LOG_PATH}/{filename}',
+        'backupCount': LOG_BACKUP_COUNT,
+        'filters': ['rate_limit'],
+    }
+    if LOG_ROTATE_WHEN:
+        handler.update({'class': 'logging.handlers.TimedRotatingFileHandler', 'when': LOG_ROTATE_WHEN})
+    else:
+        handler.update({'class': 'logging.handlers.RotatingFileHandler', 'maxBytes': LOG_MAX_BYTES})
+    return handler
+
+
+_json = LOG_FORMAT == 'json'
+
 LOGGING_CONF = {
     "version": 1,
     "formatters": {
@@ -18,25 +146,38 @@ LOGGING_CONF = {
         "advanced": {
             "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
         },
+        "json": {
+            "()": JsonFormatter
+        },
+    },
+    "filters": {
+        "rate_limit": {
+            "()": RateLimitFilter
+        },
     },
     "handlers": {
         "console": {
             "class": "logging.StreamHandler",
-            "formatter": "simple",
+            "formatter": "json" if _json else "simple",
             "level": "DEBUG",
-            "stream": "ext://sys.stdout"
+            "stream": "ext://sys.stdout",
+            "filters": ["rate_limit"],
         },
-        "file": {
-            "class": "logging.FileHandler",
-            "formatter": "advanced",
-            "level": "INFO",
-            "filename": f'{LOG_PATH}/logs.log',
-            "mode": "a",
-        }
+        "file": _file_handler('logs.log', "json" if _json else "advanced", "INFO"),
+        "slow_file": _file_handler('slow.log', "json" if _json else "simple", "WARNING"),
     },
     "loggers": {
+        # Slow requests and statements, see `instrumentation`.
+        "slow": {
+            "level": "WARNING",
+            "handlers": [
+                "console",
+                "slow_file"
+            ],
+            "propagate": False
+        },
         "__main__": {
-            "level": "DEBUG",
+            "level": LOG_LEVEL,
             "handlers": [
                 "console",
                 "file"
@@ -45,10 +186,43 @@ LOGGING_CONF = {
         }
     },
     "root": {
-        "level": "DEBUG",
+        "level": LOG_LEVEL,
         "handlers": [
             "console",
             "file"
         ]
     }
 }
+
+_listeners: list[logging.handlers.QueueListener] = []
+
+
+def configure_logging() -> None:
+    """
+    Applies `LOGGING_CONF`. With `LOG_QUEUE`, the handlers of each configured logger are moved behind a queue that
+    a listener thread drains, so logging a record only costs putting it on the queue.
+    """
+    stop_logging()
+    logging.config.dictConfig(LOGGING_CONF)
+    if not LOG_QUEUE:
+        return
+    for logger in [logging.getLogger()] + [logging.getLogger(name) for name in LOGGING_CONF['loggers']]:
+        handlers = list(logger.handlers)
+        if not handlers:
+            continue
+        records = queue.SimpleQueue()
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(_QueueHandler(records))
+        listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+
+
+@atexit.register
+def stop_logging() -> None:
+    """
+    Writes the records still queued and stops the listener threads.
+    """
+    while _listeners:
+        _listeners.pop().stop()
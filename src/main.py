@@ -1,15 +1,67 @@
-import logging.config
+import importlib.util
+import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
 from routes.supplier import router as supplier_router
 from routes.product import router as product_router
+from routes.metrics import router as metrics_router
+from routes.hold import router as hold_router
+from routes.changes import router as changes_router
+from orm_setup import USE_ASYNC, SessionLocal, init_engine, dispose_engines
+from sweeper import start_background_tasks
+from group_commit import GROUP_COMMIT, start_group_commit, stop_group_commit
+from alerts import start_alert_dispatcher, stop_alert_dispatcher
+from instrumentation import REQUEST_METRICS_ENABLED, RequestMetricsMiddleware, instrument_engines
 
-from logger import LOGGING_CONF
+from logger import configure_logging
 
-logging.config.dictConfig(LOGGING_CONF)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+if importlib.util.find_spec('orjson') is not None:
+    # Serializes the validated responses several times faster than the json module.
+    DEFAULT_RESPONSE_CLASS = ORJSONResponse
+else:
+    logger.warning("orjson is not installed, responses are serialized with the json module")
+    DEFAULT_RESPONSE_CLASS = JSONResponse
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Engines are created per worker process, after gunicorn has forked it.
+    init_engine()
+    tasks = start_background_tasks(SessionLocal)
+    start_alert_dispatcher()
+    if GROUP_COMMIT:
+        start_group_commit(SessionLocal)
+    yield
+    # Commits the stock updates still queued before the engines go away.
+    stop_group_commit()
+    for task in tasks:
+        task.stop()
+    # Delivers the alerts still waiting for their debounce.
+    stop_alert_dispatcher()
+    await dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=DEFAULT_RESPONSE_CLASS)
+
+if REQUEST_METRICS_ENABLED:
+    instrument_engines()
+    app.add_middleware(RequestMetricsMiddleware)
+
+if USE_ASYNC:
+    # Registered first, so they take over the paths they define and the sync routes serve the rest.
+    from routes.async_supplier import router as async_supplier_router
+    from routes.async_product import router as async_product_router
+
+    app.include_router(async_supplier_router, prefix="/suppliers", tags=["suppliers"])
+    app.include_router(async_product_router, prefix="/products", tags=["products"])
 
 app.include_router(supplier_router, prefix="/suppliers", tags=["suppliers"])
 app.include_router(product_router, prefix="/products", tags=["products"])
+app.include_router(hold_router, prefix="/holds", tags=["holds"])
+app.include_router(changes_router, prefix="/changes", tags=["changes"])
+app.include_router(metrics_router, prefix="/metrics", tags=["metrics"])
@@ -0,0 +1,259 @@
+import threading
+from contextvars import ContextVar
+
+
+class PoolMetrics:
+    """
+    Thread-safe counters of connection pool checkouts, kept per process.
+
+    :ivar checkouts: Number of connections handed out by the pool.
+    :ivar connects: Number of new DBAPI connections opened.
+    :ivar timeouts: Number of checkouts that gave up waiting for a connection.
+    :ivar wait_seconds_total: Accumulated time spent waiting for a connection.
+    :ivar wait_seconds_max: Longest time spent waiting for a single connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def observe_checkout(self, wait_seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+        stats = current_request_stats()
+        if stats is not None:
+            stats.pool_wait_seconds += wait_seconds
+
+    def observe_connect(self) -> None:
+        with self._lock:
+            self.connects += 1
+
+    def observe_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_avg': self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+                'wait_seconds_max': self.wait_seconds_max,
+            }
+
+
+POOL_METRICS = PoolMetrics()
+
+
+class GroupCommitMetrics:
+    """
+    Thread-safe counters of the group-commit flusher, kept per process.
+
+    :ivar flushes: Number of batches committed, or failed, as one transaction.
+    :ivar entries: Number of stock movements flushed.
+    :ivar rejected: Number of movements refused because the queue was full.
+    :ivar batch_size_max: Largest batch flushed at once.
+    :ivar latency_seconds_total: Accumulated time from enqueueing a movement to its commit.
+    :ivar latency_seconds_max: Longest time from enqueueing a movement to its commit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.entries = 0
+        self.rejected = 0
+        self.batch_size_max = 0
+        self.latency_seconds_total = 0.0
+        self.latency_seconds_max = 0.0
+
+    def observe_flush(self, latencies: list[float]) -> None:
+        with self._lock:
+            self.flushes += 1
+            self.entries += len(latencies)
+            self.batch_size_max = max(self.batch_size_max, len(latencies))
+            self.latency_seconds_total += sum(latencies)
+            self.latency_seconds_max = max(self.latency_seconds_max, *latencies)
+
+    def observe_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'flushes': self.flushes,
+                'entries': self.entries,
+                'rejected': self.rejected,
+                'batch_size_avg': self.entries / self.flushes if self.flushes else 0.0,
+                'batch_size_max': self.batch_size_max,
+                'latency_seconds_avg': self.latency_seconds_total / self.entries if self.entries else 0.0,
+                'latency_seconds_max': self.latency_seconds_max,
+            }
+
+
+GROUP_COMMIT_METRICS = GroupCommitMetrics()
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """
+    Thread-safe histogram with one series per combination of label values, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> [count per bucket..., count, sum]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {label_values: list(values) for label_values, values in self._series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = list(zip(self.labels, label_values))
+            counts = values[:len(self.buckets)] + [values[-2]]
+            for bound, count in zip([*self.buckets, '+Inf'], counts):
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", bound)])} {count}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {values[-2]}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {values[-1]}')
+        return lines
+
+
+def _format_labels(labels: list[tuple[str, object]]) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class RequestStats:
+    """
+    Database work done on behalf of one API request, gathered by the engine event hooks of `instrumentation`.
+
+    :ivar statements: Number of SQL statements executed.
+    :ivar db_seconds: Time spent executing them.
+    :ivar pool_wait_seconds: Time spent waiting for a pooled connection.
+    :ivar rows: Rows returned or affected, as reported by the driver.
+    :ivar slowest: (seconds, statement, parameters) of the slowest statement.
+    """
+    __slots__ = ('statements', 'db_seconds', 'pool_wait_seconds', 'rows', 'slowest')
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.rows = 0
+        self.slowest: tuple[float, str, object] | None = None
+
+    def observe_statement(self, seconds: float, rows: int, statement: str, parameters) -> None:
+        self.statements += 1
+        self.db_seconds += seconds
+        self.rows += max(rows, 0)
+        if self.slowest is None or seconds > self.slowest[0]:
+            self.slowest = (seconds, statement, parameters)
+
+
+# Stats of the request being served. Sync routes run in a thread pool with a copy of the context, which still
+# refers to the same `RequestStats`.
+_request_stats: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+
+def current_request_stats() -> RequestStats | None:
+    return _request_stats.get()
+
+
+def start_request_stats():
+    """
+    :return: A token for `end_request_stats`.
+    """
+    return _request_stats.set(RequestStats())
+
+
+def end_request_stats(token) -> RequestStats:
+    stats = _request_stats.get()
+    _request_stats.reset(token)
+    return stats
+
+
+class RequestMetrics:
+    """
+    Histograms of the API requests and of the SQL statements, kept per process.
+    """
+
+    def __init__(self):
+        self.duration = Histogram('http_request_duration_seconds', 'Time to serve a request',
+                                  ('method', 'route', 'status'))
+        self.db_seconds = Histogram('http_request_db_seconds', 'Time spent executing SQL per request',
+                                    ('method', 'route'))
+        self.pool_wait = Histogram('http_request_pool_wait_seconds', 'Time spent waiting for a connection per request',
+                                   ('method', 'route'))
+        self.statements = Histogram('http_request_db_statements', 'SQL statements executed per request',
+                                    ('method', 'route'), COUNT_BUCKETS)
+        self.rows = Histogram('http_request_db_rows', 'Rows returned or affected per request', ('method', 'route'),
+                              (0, 1, 10, 100, 1000, 10000, 100000))
+        self.query_duration = Histogram('db_statement_duration_seconds', 'Time to execute an SQL statement',
+                                        ('kind',))
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, stats: RequestStats) -> None:
+        self.duration.observe(seconds, method, route, str(status))
+        self.db_seconds.observe(stats.db_seconds, method, route)
+        self.pool_wait.observe(stats.pool_wait_seconds, method, route)
+        self.statements.observe(stats.statements, method, route)
+        self.rows.observe(stats.rows, method, route)
+
+    def histograms(self) -> list[Histogram]:
+        return [self.duration, self.db_seconds, self.pool_wait, self.statements, self.rows, self.query_duration]
+
+
+REQUEST_METRICS = RequestMetrics()
+
+
+def _render_counters(prefix: str, snapshot: dict, counters: tuple[str, ...]) -> list[str]:
+    lines = []
+    for name, value in snapshot.items():
+        metric = f'{prefix}_{name}'
+        kind = 'counter' if name in counters else 'gauge'
+        lines.extend([f'# TYPE {metric} {kind}', f'{metric} {value}'])
+    return lines
+
+
+def render_prometheus() -> str:
+    """
+    Renders the request and statement histograms, and the pool and group-commit counters, in the Prometheus text
+    exposition format.
+    """
+    lines = []
+    for histogram in REQUEST_METRICS.histograms():
+        lines.extend(histogram.render())
+    lines.extend(_render_counters('db_pool', POOL_METRICS.snapshot(),
+                                  ('checkouts', 'connects', 'timeouts', 'wait_seconds_total')))
+    lines.extend(_render_counters('group_commit', GROUP_COMMIT_METRICS.snapshot(),
+                                  ('flushes', 'entries', 'rejected')))
+    return '\n'.join(lines) + '\n'
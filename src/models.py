@@ -1,15 +1,24 @@
-import enum
 from typing import List
-from sqlalchemy import String, ForeignKey, Enum
+from sqlalchemy import String, Text, ForeignKey, Enum, Index, PrimaryKeyConstraint, DDL, event, text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql import func
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from datetime import datetime
 
+from enums import OperationType, HoldStatus, ChangeType
+
 
 class Base(DeclarativeBase):
     pass
 
 
+# Full-text document of a product, in which the name weighs more than the description. Searches must use this exact
+# expression for PostgreSQL to match it with `ix_product_search`.
+PRODUCT_SEARCH_VECTOR = ("(setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+                         "setweight(to_tsvector('simple', coalesce(description, '')), 'B'))")
+
+
 class Supplier(Base):
     """
     Represents a supplier that provides products.
@@ -27,8 +36,15 @@ class Supplier(Base):
     :type email: str
     :ivar phone_number: The contact phone number of the supplier.
     :type phone_number: str
+    :ivar deleted_at: Timestamp when the supplier was soft-deleted, None while it is active. Soft-deleted suppliers
+        are left out of queries, see `soft_delete`.
+    :type deleted_at: datetime
+    :ivar reorder_threshold: Available stock under which its products need reordering, unless they have their own.
+        None to not watch them.
+    :type reorder_threshold: int
     :ivar products: A list of products associated with the supplier.
-    Deleting a supplier will also delete orphans in the `Product` association.
+    Deleting a supplier will also delete orphans in the `Product` association, through the ON DELETE CASCADE of
+    the foreign key rather than by loading them.
     :type products: List['Product']
     """
     __tablename__ = 'supplier'
@@ -37,11 +53,14 @@ class Supplier(Base):
     name: Mapped[str] = mapped_column(String(50), nullable=False)
     email: Mapped[str] = mapped_column(nullable=False, unique=True, index=True)
     phone_number: Mapped[str] = mapped_column(nullable=False)
+    deleted_at: Mapped[datetime | None] = mapped_column(nullable=True)
+    reorder_threshold: Mapped[int | None] = mapped_column(nullable=True)
 
     products: Mapped[List['Product']] = relationship(
         'Product',
         back_populates='supplier',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
     def __repr__(self):
@@ -73,33 +92,97 @@ class Product(Base):
     :type supplier: Supplier
     :ivar stock: The current stock level of the product. It defaults to 0 and cannot be null.
     :type stock: int
+    :ivar reserved: The part of the stock held by active holds, which can't be sold or removed.
+    :type reserved: int
+    :ivar available: The stock that can be sold or reserved, `stock - reserved`, usable in queries.
+    :type available: int
+    :ivar stripe_count: Number of `ProductStockStripe` rows the stock is split across, 0 if it isn't. The stock of a
+        striped product is `stock` plus the stock of its stripes, see `crud.stripe`.
+    :type stripe_count: int
+    :ivar deleted_at: Timestamp when the product was soft-deleted, None while it is active.
+    :type deleted_at: datetime
+    :ivar reorder_threshold: Available stock under which the product needs reordering, None to use the threshold of
+        its supplier.
+    :type reorder_threshold: int
+    :ivar low_stock_since: Timestamp when the available stock fell under the reorder threshold, None while it is not
+        under it. Kept up to date by every stock change, see `crud.alert`.
+    :type low_stock_since: datetime
     """
     __tablename__ = 'product'
+    __table_args__ = (
+        # Composite indexes ending in `id` serve the filters of the product listing with its keyset order.
+        Index('ix_product_supplier_id_id', 'supplier_id', 'id'),
+        Index('ix_product_price_id', 'price', 'id'),
+        Index('ix_product_stock_id', 'stock', 'id'),
+        Index('ix_product_name_pattern', 'name', postgresql_ops={'name': 'text_pattern_ops'}),
+        # Full-text, typo-tolerant name and SKU prefix search on PostgreSQL, see `crud.search`.
+        Index('ix_product_search', text(PRODUCT_SEARCH_VECTOR), postgresql_using='gin').ddl_if(dialect='postgresql'),
+        Index('ix_product_name_trgm', 'name', postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_product_sku_trgm', 'sku', postgresql_using='gin',
+              postgresql_ops={'sku': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        # Only the products under their reorder threshold, so listing them never scans the others.
+        Index('ix_product_low_stock', 'id', postgresql_where=text('low_stock_since IS NOT NULL'),
+              sqlite_where=text('low_stock_since IS NOT NULL')),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String(50), nullable=False)
     description: Mapped[str] = mapped_column(String(200), nullable=True)
     sku: Mapped[str] = mapped_column(String(50), nullable=False, unique=True, index=True)
     price: Mapped[float] = mapped_column(nullable=False)
-    supplier_id: Mapped[int] = mapped_column(ForeignKey('supplier.id'))
+    supplier_id: Mapped[int] = mapped_column(ForeignKey('supplier.id', ondelete='CASCADE'))
     stock: Mapped[int] = mapped_column(default=0, nullable=False)
+    reserved: Mapped[int] = mapped_column(default=0, server_default='0', nullable=False)
+    stripe_count: Mapped[int] = mapped_column(default=0, server_default='0', nullable=False)
+    deleted_at: Mapped[datetime | None] = mapped_column(nullable=True)
+    reorder_threshold: Mapped[int | None] = mapped_column(nullable=True)
+    low_stock_since: Mapped[datetime | None] = mapped_column(nullable=True)
 
     supplier: Mapped['Supplier'] = relationship(back_populates='products')
 
     transactions: Mapped[List['ProductTransaction']] = relationship(
         'ProductTransaction',
         back_populates='product',
-        cascade='all, delete-orphan'
+        cascade='all, delete-orphan',
+        passive_deletes=True
     )
 
+    @hybrid_property
+    def available(self) -> int:
+        return self.stock - self.reserved
+
     def __repr__(self):
-        return f"<Product(id={self.id!r}, name={self.name!r}, description={self.description!r}, sku={self.sku!r}, price={self.price!r}, supplier_id={self.supplier_id!r}, stock={self.stock!r})>"
+        return f"<Product(id={self.id!r}, name={self.name!r}, description={self.description!r}, sku={self.sku!r}, price={self.price!r}, supplier_id={self.supplier_id!r}, stock={self.stock!r}, reserved={self.reserved!r})>"
+
 
+# The trigram operator classes of the search indexes.
+event.listen(
+    Product.__table__,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'),
+)
 
-class OperationType(enum.Enum):
-    ADD = 'ADD'
-    SUBTRACT = 'SUBTRACT'
-    SALE = 'SALE'
+
+class ProductStockStripe(Base):
+    """
+    Represents a share of the stock of a hot product, so concurrent sales update different rows.
+
+    :ivar product_id: Identifier of the product.
+    :type product_id: int
+    :ivar stripe: Index of the stripe, from 0 to `Product.stripe_count - 1`.
+    :type stripe: int
+    :ivar stock: Stock held by this stripe.
+    :type stock: int
+    """
+    __tablename__ = 'product_stock_stripe'
+
+    product_id: Mapped[int] = mapped_column(ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    stripe: Mapped[int] = mapped_column(primary_key=True)
+    stock: Mapped[int] = mapped_column(default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<ProductStockStripe(product_id={self.product_id!r}, stripe={self.stripe!r}, stock={self.stock!r})>"
 
 
 class ProductTransaction(Base):
@@ -121,15 +204,26 @@ class ProductTransaction(Base):
     :type operation: OperationType
     :ivar quantity: The quantity affected by the transaction.
     :type quantity: int
-    :ivar date: Timestamp when the transaction was performed.
+    :ivar date: Timestamp when the transaction was performed. Part of the primary key on PostgreSQL, as the table
+        is partitioned by month on it.
     :type date: datetime
     :ivar product: The product associated with the transaction.
     :type product: Product
     """
     __tablename__ = 'product_transaction'
+    __table_args__ = (
+        # Serves a product's history in date order, and the lookups of the rows to delete with a product.
+        Index('ix_product_transaction_product_id_date', 'product_id', 'date'),
+        # Serves the exports in (date, id) order, read in order from the index of each partition instead of sorted.
+        Index('ix_product_transaction_date_id', 'date', 'id'),
+        # Monthly partitions on PostgreSQL, see `partitions.py`. The partition key must be part of the primary key,
+        # which only PostgreSQL gets, as other databases only autoincrement a single-column key.
+        PrimaryKeyConstraint('id', info={'postgresql_partition_key': 'date'}),
+        {'postgresql_partition_by': 'RANGE (date)'},
+    )
 
-    id: Mapped[int] = mapped_column(primary_key=True)
-    product_id: Mapped[int] = mapped_column(ForeignKey('product.id'))
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    product_id: Mapped[int] = mapped_column(ForeignKey('product.id', ondelete='CASCADE'))
     operation: Mapped[OperationType] = mapped_column(Enum(OperationType), nullable=False)
     quantity: Mapped[int] = mapped_column(nullable=False)
     date: Mapped[datetime] = mapped_column(default=func.now(), nullable=False)
@@ -138,3 +232,216 @@ class ProductTransaction(Base):
 
     def __repr__(self):
         return f"<ProductTransaction(id={self.id!r}, product_id={self.product_id!r}, operation={self.operation!r}, quantity={self.quantity!r}, date={self.date!r})>"
+
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def _compile_partitioned_primary_key(constraint, compiler, **kw):
+    # Adds the partition key of a partitioned table to its primary key, on PostgreSQL only.
+    partition_key = constraint.info.get('postgresql_partition_key')
+    if partition_key is None:
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+    columns = [column.name for column in constraint.columns] + [partition_key]
+    return f"PRIMARY KEY ({', '.join(compiler.preparer.quote(column) for column in columns)})"
+
+
+class StockSnapshot(Base):
+    """
+    Represents the stock level of a product at a point in time, derived from its transactions.
+
+    Snapshots are rolled forward periodically from the previous snapshot of each product, so the stock at
+    any date can be computed from one snapshot and the transactions that followed it.
+
+    :ivar product_id: Identifier of the product.
+    :type product_id: int
+    :ivar as_of: Point in time the stock level refers to. Transactions dated up to and including it are counted.
+    :type as_of: datetime
+    :ivar stock: Stock level of the product at `as_of`.
+    :type stock: int
+    """
+    __tablename__ = 'stock_snapshot'
+
+    product_id: Mapped[int] = mapped_column(ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    as_of: Mapped[datetime] = mapped_column(primary_key=True)
+    stock: Mapped[int] = mapped_column(nullable=False)
+
+    def __repr__(self):
+        return f"<StockSnapshot(product_id={self.product_id!r}, as_of={self.as_of!r}, stock={self.stock!r})>"
+
+
+class StockHold(Base):
+    """
+    Represents a quantity of a product held for a checkout until it is confirmed, released or expires.
+
+    Reserving a hold moves the quantity from the available stock to `Product.reserved` with one conditional
+    UPDATE, confirming it turns it into a sale and releasing or expiring it gives it back.
+
+    :ivar id: Unique identifier of the hold.
+    :type id: int
+    :ivar product_id: Identifier of the held product.
+    :type product_id: int
+    :ivar quantity: The held quantity.
+    :type quantity: int
+    :ivar status: Whether the hold is still active, or how it ended.
+    :type status: HoldStatus
+    :ivar created_at: Timestamp when the hold was placed.
+    :type created_at: datetime
+    :ivar expires_at: Timestamp after which the hold can no longer be confirmed and is released by the sweeper.
+    :type expires_at: datetime
+    """
+    __tablename__ = 'stock_hold'
+    __table_args__ = (
+        # Only active holds are ever swept, so the index stays as small as the number of open checkouts.
+        Index('ix_stock_hold_active_expires_at', 'expires_at', postgresql_where=text("status = 'ACTIVE'")),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    product_id: Mapped[int] = mapped_column(ForeignKey('product.id', ondelete='CASCADE'), index=True)
+    quantity: Mapped[int] = mapped_column(nullable=False)
+    status: Mapped[HoldStatus] = mapped_column(Enum(HoldStatus), default=HoldStatus.ACTIVE, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(default=func.now(), nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(nullable=False)
+
+    def __repr__(self):
+        return f"<StockHold(id={self.id!r}, product_id={self.product_id!r}, quantity={self.quantity!r}, status={self.status!r}, expires_at={self.expires_at!r})>"
+
+
+class SupplierSummary(Base):
+    """
+    Represents the precomputed totals of the products of a supplier, as of the last compaction of the
+    `SupplierSummaryDelta` rows, see `crud.summary`.
+
+    :ivar supplier_id: Identifier of the supplier.
+    :type supplier_id: int
+    :ivar product_count: Number of products of the supplier.
+    :type product_count: int
+    :ivar units: Total stock of the products.
+    :type units: int
+    :ivar inventory_value: Sum of `price * stock` over the products.
+    :type inventory_value: float
+    :ivar low_stock_count: Number of products with less stock than `LOW_STOCK_THRESHOLD`.
+    :type low_stock_count: int
+    """
+    __tablename__ = 'supplier_summary'
+
+    supplier_id: Mapped[int] = mapped_column(ForeignKey('supplier.id', ondelete='CASCADE'), primary_key=True)
+    product_count: Mapped[int] = mapped_column(default=0, nullable=False)
+    units: Mapped[int] = mapped_column(default=0, nullable=False)
+    inventory_value: Mapped[float] = mapped_column(default=0, nullable=False)
+    low_stock_count: Mapped[int] = mapped_column(default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<SupplierSummary(supplier_id={self.supplier_id!r}, product_count={self.product_count!r}, units={self.units!r}, inventory_value={self.inventory_value!r}, low_stock_count={self.low_stock_count!r})>"
+
+
+class SupplierSummaryDelta(Base):
+    """
+    Represents a change to the totals of a supplier that is not yet folded into its `SupplierSummary`.
+
+    Writers insert a delta in the transaction of the change instead of updating the summary row, so concurrent
+    stock movements of the products of one supplier don't wait on each other. The supplier has no foreign key,
+    which would lock its row for every delta, the deltas of deleted suppliers are dropped by the compaction.
+
+    :ivar id: Unique identifier of the delta.
+    :type id: int
+    :ivar supplier_id: Identifier of the supplier.
+    :type supplier_id: int
+    :ivar product_count: Change in the number of products.
+    :type product_count: int
+    :ivar units: Change in the total stock.
+    :type units: int
+    :ivar inventory_value: Change in the inventory value.
+    :type inventory_value: float
+    :ivar low_stock_count: Change in the number of products low on stock.
+    :type low_stock_count: int
+    """
+    __tablename__ = 'supplier_summary_delta'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    supplier_id: Mapped[int] = mapped_column(nullable=False, index=True)
+    product_count: Mapped[int] = mapped_column(default=0, nullable=False)
+    units: Mapped[int] = mapped_column(default=0, nullable=False)
+    inventory_value: Mapped[float] = mapped_column(default=0, nullable=False)
+    low_stock_count: Mapped[int] = mapped_column(default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<SupplierSummaryDelta(id={self.id!r}, supplier_id={self.supplier_id!r}, product_count={self.product_count!r}, units={self.units!r}, inventory_value={self.inventory_value!r}, low_stock_count={self.low_stock_count!r})>"
+
+
+class IdempotencyKey(Base):
+    """
+    Represents a request made with an `Idempotency-Key` header, and the response it got, so retries of the request
+    get the same response instead of applying it again, see `idempotency`.
+
+    :ivar key: The `Idempotency-Key` of the request, chosen by the client.
+    :type key: str
+    :ivar fingerprint: Hash of the endpoint and the parameters of the request, to reject a key reused for another
+        request.
+    :type fingerprint: str
+    :ivar status_code: Status code of the response, None while the request is being processed.
+    :type status_code: int
+    :ivar response: JSON body of the response, None while the request is being processed.
+    :type response: str
+    :ivar created_at: Timestamp when the request was first received.
+    :type created_at: datetime
+    :ivar expires_at: Timestamp after which the key is forgotten and purged, and can be used again. The end of the
+        lease of the claim while the request is being processed.
+    :type expires_at: datetime
+    """
+    __tablename__ = 'idempotency_key'
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    status_code: Mapped[int | None] = mapped_column(nullable=True)
+    response: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey(key={self.key!r}, status_code={self.status_code!r}, expires_at={self.expires_at!r})>"
+
+
+class ChangeEvent(Base):
+    """
+    Represents a change of a product, written in the transaction of the change, so consumers of the changes see
+    every committed change and nothing else, see `outbox`.
+
+    Events are written without a `sequence`. The relay numbers them in the order it publishes them, so a consumer
+    that has read the changes up to a sequence never misses one committed later with a lower `id`.
+
+    :ivar id: Unique identifier of the event, the same every time it is delivered.
+    :type id: int
+    :ivar product_id: Identifier of the changed product, which may no longer exist.
+    :type product_id: int
+    :ivar change: What changed.
+    :type change: ChangeType
+    :ivar stock: Stock of the product after the change, None once it is deleted.
+    :type stock: int
+    :ivar reserved: Stock of the product held by active holds after the change, None once it is deleted.
+    :type reserved: int
+    :ivar created_at: Timestamp of the change.
+    :type created_at: datetime
+    :ivar sequence: Position of the event in the change stream, None until it is published.
+    :type sequence: int
+    :ivar published_at: Timestamp when the event was published.
+    :type published_at: datetime
+    """
+    __tablename__ = 'change_event'
+    __table_args__ = (
+        # The relay only reads the events not yet published, so the index stays as small as its backlog.
+        Index('ix_change_event_unpublished', 'id',
+              postgresql_where=text('sequence IS NULL')).ddl_if(dialect='postgresql'),
+        # Ids are never reused once purged, as consumers tell the events they have seen by their id.
+        {'sqlite_autoincrement': True},
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    product_id: Mapped[int] = mapped_column(nullable=False)
+    change: Mapped[ChangeType] = mapped_column(Enum(ChangeType), nullable=False)
+    stock: Mapped[int | None] = mapped_column(nullable=True)
+    reserved: Mapped[int | None] = mapped_column(nullable=True)
+    created_at: Mapped[datetime] = mapped_column(default=func.now(), nullable=False)
+    sequence: Mapped[int | None] = mapped_column(nullable=True, unique=True)
+    published_at: Mapped[datetime | None] = mapped_column(nullable=True, index=True)
+
+    def __repr__(self):
+        return f"<ChangeEvent(id={self.id!r}, product_id={self.product_id!r}, change={self.change!r}, stock={self.stock!r}, sequence={self.sequence!r})>"
@@ -1,23 +1,172 @@
 import os
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event, Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from models import Base
+# Hides the soft-deleted rows from the queries of every session.
+import soft_delete  # noqa: F401
+from partitions import ensure_partitions
 from decorators import handle_exceptions
+from metrics import POOL_METRICS
+
+
+def _env_flag(name: str, default: str = 'false') -> bool:
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+# Serve the API through the AsyncSession-based CRUD and routes instead of the sync ones.
+USE_ASYNC = _env_flag('DB_ASYNC')
+# Run `Base.metadata.create_all` when the engine is initialized, instead of as a separate setup step.
+AUTO_CREATE = _env_flag('DB_AUTO_CREATE')
+
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+POOL_PRE_PING = _env_flag('DB_POOL_PRE_PING', 'true')
+# 0 disables the server-side statement timeout.
+STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+_engine: Engine | None = None
+_async_engine: AsyncEngine | None = None
+
+
+class _TimedPoolMixin:
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            POOL_METRICS.observe_timeout()
+            raise
+        finally:
+            POOL_METRICS.observe_checkout(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# Drivers of the async engine when the database is given as `DATABASE_URL`.
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+
+def get_database_url(driver: str = 'psycopg2') -> str:
+    """
+    Builds the database URL from the `DB_*` variables, or takes it from `DATABASE_URL` when that is set,
+    e.g. to run the benchmarks against another database.
+    """
+    if os.environ.get('DATABASE_URL'):
+        url = make_url(os.environ['DATABASE_URL'])
+        if driver != 'psycopg2':
+            url = url.set(drivername=f'{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}')
+        return url.render_as_string(hide_password=False)
+    return (f"postgresql+{driver}://{os.environ['DB_USER']}:{os.environ['DB_PASS']}"
+            f"@{os.environ['DB_HOST']}:{os.environ['DB_PORT']}/{os.environ['DB_NAME']}")
+
+
+def _pool_options() -> dict:
+    return {
+        'pool_size': POOL_SIZE,
+        'max_overflow': MAX_OVERFLOW,
+        'pool_timeout': POOL_TIMEOUT,
+        'pool_recycle': POOL_RECYCLE,
+        'pool_pre_ping': POOL_PRE_PING,
+    }
+
+
+def get_engine() -> Engine:
+    """
+    Returns the process-wide engine, creating it on first use and binding `SessionLocal` to it.
+    """
+    global _engine
+    if _engine is None:
+        connect_args = {'options': f'-c statement_timeout={STATEMENT_TIMEOUT_MS}'} if STATEMENT_TIMEOUT_MS else {}
+        _engine = create_engine(
+            get_database_url(),
+            isolation_level="SERIALIZABLE",
+            poolclass=TimedQueuePool,
+            connect_args=connect_args,
+            **_pool_options(),
+        )
+        event.listen(_engine, 'connect', lambda dbapi_connection, connection_record: POOL_METRICS.observe_connect())
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """
+    Returns the process-wide async engine, creating it on first use and binding `AsyncSessionLocal` to it.
+    """
+    global _async_engine
+    if _async_engine is None:
+        connect_args = {'server_settings': {'statement_timeout': str(STATEMENT_TIMEOUT_MS)}} \
+            if STATEMENT_TIMEOUT_MS else {}
+        _async_engine = create_async_engine(
+            get_database_url('asyncpg'),
+            isolation_level="SERIALIZABLE",
+            poolclass=TimedAsyncAdaptedQueuePool,
+            connect_args=connect_args,
+            **_pool_options(),
+        )
+        event.listen(_async_engine.sync_engine, 'connect',
+                     lambda dbapi_connection, connection_record: POOL_METRICS.observe_connect())
+        AsyncSessionLocal.configure(bind=_async_engine)
+    return _async_engine
 
 
 @handle_exceptions()
 def setup_database():
-    engine = create_engine(
-        f"postgresql+psycopg2://{os.environ['DB_USER']}:{os.environ['DB_PASS']}@{os.environ['DB_HOST']}:{os.environ['DB_PORT']}/{os.environ['DB_NAME']}",
-        isolation_level="SERIALIZABLE",
-    )
+    """
+    Creates the database tables and the upcoming transaction partitions. Run it once when deploying, not on
+    every process start.
+    """
+    with get_engine().begin() as connection:
+        Base.metadata.create_all(connection)
+        ensure_partitions(connection)
+    return SessionLocal
+
+
+@handle_exceptions()
+def init_engine() -> None:
+    """
+    Creates the engines used by this process. Call it after forking, e.g. from the FastAPI lifespan.
+    """
+    get_engine()
+    if USE_ASYNC:
+        get_async_engine()
+    if AUTO_CREATE:
+        setup_database()
+
 
-    Base.metadata.create_all(engine)
-    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async def dispose_engines() -> None:
+    global _engine, _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
 
 
-SessionLocal = setup_database()
+def pool_status() -> dict:
+    status = POOL_METRICS.snapshot()
+    if _engine is not None:
+        pool = _engine.pool
+        status.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                      overflow=pool.overflow())
+    return status
@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+from pydantic_core import to_jsonable_python
+from sqlalchemy.orm import Session
+
+from crud.outbox import latest_sequence
+
+logger = logging.getLogger(__name__)
+
+# Where the relay publishes the change events: none, memory, file or redis. The change stream of `GET /changes`
+# works with any of them.
+OUTBOX_SINK = os.environ.get('OUTBOX_SINK', 'none')
+# JSON lines file the file sink appends the events to.
+OUTBOX_FILE = os.environ.get('OUTBOX_FILE', 'logs/changes.jsonl')
+# Stream the redis sink adds the events to, trimmed to about OUTBOX_STREAM_MAXLEN events.
+OUTBOX_STREAM = os.environ.get('OUTBOX_STREAM', 'inventory:changes')
+OUTBOX_STREAM_MAXLEN = int(os.environ.get('OUTBOX_STREAM_MAXLEN', 100000))
+# Events kept by the memory sink.
+OUTBOX_MEMORY_SIZE = int(os.environ.get('OUTBOX_MEMORY_SIZE', 10000))
+# Seconds between two checks for new changes by the long polls and streams of a process.
+CHANGES_POLL_INTERVAL = float(os.environ.get('CHANGES_POLL_INTERVAL', 0.5))
+
+
+class ChangeSink:
+    """
+    Interface of the destinations of the change events. `publish` gets each batch in sequence order, and may get a
+    batch again after a failure, so consumers must skip the event ids they have seen.
+    """
+
+    def publish(self, events: list[dict]) -> None:
+        raise NotImplementedError
+
+
+class NullSink(ChangeSink):
+    def publish(self, events: list[dict]) -> None:
+        pass
+
+
+class MemorySink(ChangeSink):
+    """
+    Keeps the last `max_events` events in the process, e.g. for tests and in-process consumers.
+    """
+
+    def __init__(self, max_events: int = OUTBOX_MEMORY_SIZE):
+        self._lock = threading.Lock()
+        self._events: deque[dict] = deque(maxlen=max_events)
+
+    def publish(self, events: list[dict]) -> None:
+        with self._lock:
+            self._events.extend(to_jsonable_python(events))
+
+    def drain(self) -> list[dict]:
+        """
+        :return: The events kept, which are forgotten.
+        """
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+
+class FileSink(ChangeSink):
+    """
+    Appends the events to a JSON lines file, one event per line.
+    """
+
+    def __init__(self, path: str = OUTBOX_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def publish(self, events: list[dict]) -> None:
+        lines = ''.join(json.dumps(event) + '\n' for event in to_jsonable_python(events))
+        with self._lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(lines)
+
+
+class RedisStreamSink(ChangeSink):
+    """
+    Adds the events to a stream, on any client with the `pipeline` and `xadd` methods of redis-py, e.g. a
+    Redis-compatible server or an in-memory stand-in like fakeredis, as a message broker would.
+    """
+
+    def __init__(self, client, stream: str = OUTBOX_STREAM, maxlen: int = OUTBOX_STREAM_MAXLEN):
+        self.client = client
+        self.stream = stream
+        self.maxlen = maxlen
+
+    def publish(self, events: list[dict]) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        for event in to_jsonable_python(events):
+            pipeline.xadd(self.stream, {'event': json.dumps(event)}, maxlen=self.maxlen, approximate=True)
+        pipeline.execute()
+
+
+def build_sink(name: str = OUTBOX_SINK) -> ChangeSink:
+    if name == 'memory':
+        return MemorySink()
+    if name == 'file':
+        return FileSink()
+    if name == 'redis':
+        import redis
+        from cache import REDIS_URL
+        return RedisStreamSink(redis.Redis.from_url(REDIS_URL))
+    if name != 'none':
+        logger.warning(f"Unknown outbox sink {name!r}, change events are only served by GET /changes")
+    return NullSink()
+
+
+sink = build_sink()
+
+
+def configure_sink(change_sink: ChangeSink) -> None:
+    """
+    Replaces the sink the relay publishes to, e.g. with a `RedisStreamSink` on a stand-in client.
+    """
+    global sink
+    sink = change_sink
+
+
+def get_sink() -> ChangeSink:
+    return sink
+
+
+class ChangeFeed:
+    """
+    Sequence of the last published change, shared by the long polls and streams of a process. Waiting consumers
+    read it instead of the database, which is checked at most once per `poll_interval` for the whole process, and
+    right after the relay of the process publishes.
+    """
+
+    def __init__(self, poll_interval: float = CHANGES_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._latest = 0
+        self._checked_at = float('-inf')
+
+    def latest(self, session_factory: Callable[[], Session]) -> int:
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.poll_interval:
+                with session_factory() as session:
+                    self._latest = latest_sequence(session)
+                self._checked_at = time.monotonic()
+            return self._latest
+
+    def invalidate(self) -> None:
+        """
+        Makes the next `latest` check the database, after events were published.
+        """
+        with self._lock:
+            self._checked_at = float('-inf')
+
+
+_feed = ChangeFeed()
+
+
+def get_change_feed() -> ChangeFeed:
+    return _feed
@@ -0,0 +1,141 @@
+import logging
+from datetime import date
+
+from sqlalchemy import DDL, event, text
+from sqlalchemy.engine import Connection
+
+from models import ProductTransaction, StockSnapshot
+
+logger = logging.getLogger(__name__)
+
+TABLE = ProductTransaction.__tablename__
+DEFAULT_PARTITION = f'{TABLE}_default'
+DEFAULT_MONTHS_AHEAD = 3
+
+# Catches rows outside of the monthly partitions, so an insert never fails for lack of a partition.
+event.listen(
+    ProductTransaction.__table__,
+    'after_create',
+    DDL(f'CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT').execute_if(
+        dialect='postgresql'),
+)
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    year, index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return date(year, index + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'{TABLE}_y{month.year}m{month.month:02d}'
+
+
+def _bounds(month: date) -> str:
+    return f"FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+
+
+def _is_postgresql(connection: Connection) -> bool:
+    if connection.dialect.name != 'postgresql':
+        logger.info(f"Partitions are only managed on PostgreSQL, not on {connection.dialect.name}")
+        return False
+    return True
+
+
+def list_partitions(connection: Connection) -> list[str]:
+    """
+    Lists the monthly partitions attached to the transaction table, oldest first.
+    """
+    names = connection.scalars(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table"), {'table': TABLE})
+    return sorted(name for name in names if name != DEFAULT_PARTITION)
+
+
+def ensure_partitions(connection: Connection, months_ahead: int = DEFAULT_MONTHS_AHEAD,
+                      start: date | None = None) -> list[str]:
+    """
+    Creates the monthly partitions from the month of `start`, the current month by default, to `months_ahead`
+    months later. Run it ahead of time, e.g. daily, so rows are never routed to the default partition.
+
+    :return: The names of the created partitions.
+    """
+    if not _is_postgresql(connection):
+        return []
+    existing = set(list_partitions(connection))
+    first = month_start(start or date.today())
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(first, offset)
+        name = partition_name(month)
+        if name in existing:
+            continue
+        if _default_holds_month(connection, month):
+            _create_from_default(connection, name, month)
+        else:
+            # The (product_id, date) and (date, id) indexes and the primary key are created on the partition from the
+            # parent's.
+            connection.execute(text(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES {_bounds(month)}"))
+        created.append(name)
+    if created:
+        logger.info(f"Created transaction partitions {', '.join(created)}")
+    return created
+
+
+def _default_holds_month(connection: Connection, month: date) -> bool:
+    return connection.scalar(text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+                                  f"WHERE date >= :start AND date < :end)"),
+                             {'start': month, 'end': add_months(month, 1)})
+
+
+def _create_from_default(connection: Connection, name: str, month: date) -> None:
+    # A partition can't be created while the default partition holds rows of its range, so they are moved to a
+    # standalone table, which is then attached. Attaching creates its indexes and primary key from the parent's.
+    logger.warning(f"Moving the transactions of {month:%Y-%m} out of {DEFAULT_PARTITION} into {name}")
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    connection.execute(text(f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE date >= :start AND date < :end "
+                            f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"),
+                       {'start': month, 'end': add_months(month, 1)})
+    connection.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES {_bounds(month)}"))
+
+
+def _covered_by_snapshots(connection: Connection, name: str) -> bool:
+    # Every transaction of the partition is counted in a snapshot of its product, taken at or after it.
+    return not connection.scalar(text(
+        f"SELECT EXISTS (SELECT 1 FROM {name} t WHERE NOT EXISTS ("
+        f"SELECT 1 FROM {StockSnapshot.__tablename__} s WHERE s.product_id = t.product_id AND s.as_of >= t.date))"))
+
+
+def detach_partitions(connection: Connection, before: date, drop: bool = False) -> list[str]:
+    """
+    Detaches the monthly partitions that only hold transactions older than `before`. Detached partitions are
+    kept as standalone tables to be archived, unless `drop` is set.
+
+    A partition is only detached once the stock snapshots cover all its transactions, otherwise `get_stock_at` and
+    `reconcile_stock` would compute from a truncated ledger. It and the newer ones are kept until `snapshot_stock`
+    rolls the snapshots forward.
+
+    :return: The names of the detached partitions.
+    """
+    if not _is_postgresql(connection):
+        return []
+    detached = []
+    for name in list_partitions(connection):
+        if name >= partition_name(month_start(before)):
+            break
+        if not _covered_by_snapshots(connection, name):
+            logger.error(f"Keeping {name} and the newer partitions, the stock snapshots don't cover all their "
+                         f"transactions yet, run snapshot_stock first")
+            break
+        connection.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+        if drop:
+            connection.execute(text(f"DROP TABLE {name}"))
+        detached.append(name)
+    if detached:
+        logger.info(f"{'Dropped' if drop else 'Detached'} transaction partitions {', '.join(detached)}")
+    return detached
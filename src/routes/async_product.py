@@ -0,0 +1,147 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from crud.async_product import (get_product, create_product, update_product, delete_product, update_stock,
+                                bulk_update_stock, search_products)
+from validation.product import (ProductCreate, ProductUpdate, ProductUpdateStock, Product, ProductBulkUpdateStock,
+                                ProductStockMovementResult, ProductSearchPage, LowStockPage)
+from validation.common import Message
+from decorators import is_transient_conflict
+from group_commit import get_group_committer, GroupCommitBusy, GROUP_COMMIT_RESULT_TIMEOUT
+from idempotency import idempotent_async, IdempotencyKeyHeader
+from crud.alert import list_low_stock_products
+from routes.product import MAX_SEARCH_OFFSET
+from utils.db import get_async_db
+
+# Async counterparts of the routes in routes.product, registered in front of them when DB_ASYNC is set. Ids are
+# typed in the paths, so the static routes of routes.product, like /export, are not taken for an id.
+router = APIRouter()
+
+
+@router.get("/search", name='Search Products')
+async def search_products_endpoint(q: str = Query(..., min_length=1, description='Words of the name or description, '
+                                                                                 'or the start of a SKU'),
+                                   limit: int = Query(20, ge=1, le=100),
+                                   offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+                                   db: AsyncSession = Depends(get_async_db)) -> ProductSearchPage:
+    try:
+        products = await search_products(db, q, limit=limit + 1, offset=offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    next_offset = offset + limit if len(products) > limit else None
+    return {'products': products[:limit], 'next_offset': next_offset}
+
+
+@router.get("/low-stock", name='List Low-Stock Products')
+async def list_low_stock_products_endpoint(after: int | None = Query(None, description='Cursor: id of the last product '
+                                                                                         'of the previous page'),
+                                           limit: int = Query(100, ge=1, le=1000),
+                                           supplier_id: int | None = None,
+                                           db: AsyncSession = Depends(get_async_db)) -> LowStockPage:
+    try:
+        products = await db.run_sync(list_low_stock_products, after_id=after, limit=limit + 1,
+                                     supplier_id=supplier_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    next_cursor = products[limit - 1]['id'] if len(products) > limit else None
+    return {'products': products[:limit], 'next_cursor': next_cursor}
+
+
+@router.get("/{product_id:int}", name='Get Product')
+async def read_product(product_id: int, db: AsyncSession = Depends(get_async_db)) -> dict[str, Product]:
+    product = await get_product(db, product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="product not found")
+    return {'product': product}
+
+
+@router.post("/", name='Create Product')
+async def create_product_endpoint(product: ProductCreate, response: Response,
+                                  idempotency_key: str | None = IdempotencyKeyHeader,
+                                  db: AsyncSession = Depends(get_async_db)) -> dict[str, Product]:
+    async def execute():
+        try:
+            result = await create_product(db, name=product.name, description=product.description, sku=product.sku,
+                                          price=product.price, stock=product.stock, supplier_id=product.supplier_id)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {'product': Product.model_validate(result)}
+    return await idempotent_async(db, response, idempotency_key, 'create_product', product.model_dump(), execute)
+
+
+@router.put("/stock", name='Bulk Update Product Stock')
+async def bulk_update_stock_endpoint(bulk: ProductBulkUpdateStock, response: Response,
+                                     idempotency_key: str | None = IdempotencyKeyHeader,
+                                     db: AsyncSession = Depends(get_async_db)
+                                     ) -> dict[str, list[ProductStockMovementResult]]:
+    movements = [(movement.product_id, movement.quantity, movement.operation) for movement in bulk.movements]
+
+    async def execute():
+        try:
+            results = await bulk_update_stock(db, movements, all_or_nothing=bulk.all_or_nothing)
+        except DBAPIError as e:
+            if is_transient_conflict(e):
+                raise HTTPException(status_code=409, detail='Concurrent stock update conflict, please retry')
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {'results': results}
+    return await idempotent_async(db, response, idempotency_key, 'bulk_update_stock', bulk.model_dump(), execute)
+
+
+@router.put("/{product_id:int}", name='Update Product')
+async def update_product_endpoint(product_id: int, product: ProductUpdate,
+                                  db: AsyncSession = Depends(get_async_db)) -> Message:
+    try:
+        updated = await update_product(db, product_id, name=product.name, description=product.description,
+                                       sku=product.sku, price=product.price)
+        if not updated:
+            raise HTTPException(status_code=404, detail="product not found")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'message': 'product updated successfully'}
+
+
+@router.put("/{product_id:int}/stock", name='Update Product Stock')
+async def update_product_stock_endpoint(product_id: int, product: ProductUpdateStock, response: Response,
+                                        idempotency_key: str | None = IdempotencyKeyHeader,
+                                        db: AsyncSession = Depends(get_async_db)) -> Message:
+    committer = get_group_committer()
+
+    async def execute():
+        try:
+            if committer:
+                # Shielded, so the timeout doesn't cancel the future the flusher resolves.
+                future = asyncio.wrap_future(committer.submit(product_id, product.quantity, product.operation,
+                                                              block=False))
+                await asyncio.wait_for(asyncio.shield(future), GROUP_COMMIT_RESULT_TIMEOUT)
+            else:
+                await update_stock(db, product_id, quantity=product.quantity, operation=product.operation)
+        except GroupCommitBusy as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
+        except TimeoutError:
+            raise HTTPException(status_code=504, detail='The stock update is still pending, it may yet be applied')
+        except DBAPIError as e:
+            if is_transient_conflict(e):
+                raise HTTPException(status_code=409, detail='Concurrent stock update conflict, please retry')
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {'message': 'product stock updated successfully'}
+    return await idempotent_async(db, response, idempotency_key, 'update_product_stock',
+                                  {'product_id': product_id, **product.model_dump()}, execute)
+
+
+@router.delete("/{product_id:int}", name='Delete Product')
+async def delete_product_endpoint(product_id: int,
+                                  soft: bool = Query(False, description='Only mark as deleted'),
+                                  db: AsyncSession = Depends(get_async_db)) -> Message:
+    try:
+        deleted = await delete_product(db, product_id, soft)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="product not found")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'message': 'product deleted successfully'}
@@ -0,0 +1,78 @@
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from crud.async_supplier import (get_supplier, create_supplier, update_supplier, delete_supplier,
+                                 list_supplier_summaries, get_supplier_summary)
+from validation.supplier import SupplierCreate, SupplierUpdate, Supplier, SupplierSummary, SupplierSummaryPage
+from validation.common import Message
+from idempotency import idempotent_async, IdempotencyKeyHeader
+from utils.db import get_async_db
+
+# Async counterparts of the routes in routes.supplier, registered in front of them when DB_ASYNC is set. Ids are
+# typed in the paths, so the static routes of routes.supplier are not taken for an id.
+router = APIRouter()
+
+
+@router.get("/summary", name='List Supplier Summaries')
+async def list_supplier_summaries_endpoint(after: int | None = Query(None, description='Cursor: id of the last '
+                                                                                       'supplier of the previous page'),
+                                           limit: int = Query(100, ge=1, le=5000),
+                                           db: AsyncSession = Depends(get_async_db)) -> SupplierSummaryPage:
+    summaries = await list_supplier_summaries(db, after_id=after, limit=limit + 1)
+    next_cursor = summaries[limit - 1]['supplier_id'] if len(summaries) > limit else None
+    return {'summaries': summaries[:limit], 'next_cursor': next_cursor}
+
+
+@router.get("/{supplier_id:int}", name='Get Supplier')
+async def read_supplier(supplier_id: int, db: AsyncSession = Depends(get_async_db)) -> dict[str, Supplier]:
+    supplier = await get_supplier(db, supplier_id)
+    if not supplier:
+        raise HTTPException(status_code=404, detail="Supplier not found")
+    return {'supplier': supplier}
+
+
+@router.get("/{supplier_id:int}/summary", name='Get Supplier Summary')
+async def read_supplier_summary(supplier_id: int,
+                                db: AsyncSession = Depends(get_async_db)) -> dict[str, SupplierSummary]:
+    summary = await get_supplier_summary(db, supplier_id)
+    if not summary:
+        raise HTTPException(status_code=404, detail="Supplier not found")
+    return {'summary': summary}
+
+
+@router.post("/", name='Create Supplier')
+async def create_supplier_endpoint(supplier: SupplierCreate, response: Response,
+                                   idempotency_key: str | None = IdempotencyKeyHeader,
+                                   db: AsyncSession = Depends(get_async_db)) -> dict[str, Supplier]:
+    async def execute():
+        try:
+            result = await create_supplier(db, name=supplier.name, email=supplier.email,
+                                           phone_number=supplier.phone_number)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {'supplier': Supplier.model_validate(result)}
+    return await idempotent_async(db, response, idempotency_key, 'create_supplier', supplier.model_dump(), execute)
+
+
+@router.put("/{supplier_id:int}", name='Update Supplier')
+async def update_supplier_endpoint(supplier_id: int, supplier: SupplierUpdate,
+                                   db: AsyncSession = Depends(get_async_db)) -> Message:
+    try:
+        updated = await update_supplier(db, supplier_id, supplier.name, supplier.email, supplier.phone_number)
+        if not updated:
+            raise HTTPException(status_code=404, detail="Supplier not found")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'message': 'Supplier updated successfully'}
+
+
+@router.delete("/{supplier_id:int}", name='Delete Supplier')
+async def delete_supplier_endpoint(supplier_id: int,
+                                   soft: bool = Query(False, description='Only mark as deleted'),
+                                   db: AsyncSession = Depends(get_async_db)) -> Message:
+    try:
+        deleted = await delete_supplier(db, supplier_id, soft)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Supplier not found")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'message': 'Supplier deleted successfully'}
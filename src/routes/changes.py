@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from fastapi import APIRouter, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from crud.outbox import list_changes
+from outbox import get_change_feed
+from validation.change import Change, ChangePage
+from utils.db import db_session
+
+router = APIRouter()
+
+# Seconds a long poll can wait for changes.
+MAX_CHANGES_WAIT = 60
+# Seconds between two comments of an idle change stream, so proxies don't close it.
+STREAM_HEARTBEAT = 15
+STREAM_BATCH_SIZE = 500
+
+
+def _read_changes(since: int, limit: int) -> list[dict]:
+    with db_session() as db:
+        return list_changes(db, since, limit)
+
+
+async def _next_changes(since: int, limit: int, wait: float) -> list[dict]:
+    """
+    :return: The changes after `since`, waiting up to `wait` seconds for some if there are none yet. While waiting,
+        only the change feed of the process is checked, and no thread or connection is held.
+    """
+    feed = get_change_feed()
+    deadline = time.monotonic() + wait
+    while True:
+        if await run_in_threadpool(feed.latest, db_session) > since:
+            changes = await run_in_threadpool(_read_changes, since, limit)
+            if changes:
+                return changes
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return []
+        await asyncio.sleep(min(feed.poll_interval, remaining))
+
+
+@router.get("", name='List Changes')
+async def list_changes_endpoint(since: int = Query(0, ge=0, description='next_cursor of the previous page, 0 to '
+                                                                        'start from the oldest change kept'),
+                                limit: int = Query(100, ge=1, le=1000),
+                                wait: float = Query(0, ge=0, le=MAX_CHANGES_WAIT,
+                                                    description='Seconds to wait for a change if there is none yet'),
+                                ) -> ChangePage:
+    try:
+        changes = await _next_changes(since, limit, wait)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'changes': changes, 'next_cursor': changes[-1]['sequence'] if changes else since}
+
+
+@router.get("/stream", name='Stream Changes', response_class=StreamingResponse)
+async def stream_changes_endpoint(since: int = Query(0, ge=0, description='Sequence of the last change already '
+                                                                          'read, 0 to start from the oldest one kept'),
+                                  last_event_id: int | None = Header(None, alias='Last-Event-ID', ge=0),
+                                  ) -> StreamingResponse:
+    # A reconnecting EventSource resumes after the last event it received.
+    cursor = since if last_event_id is None else last_event_id
+
+    async def events():
+        nonlocal cursor
+        while True:
+            changes = await _next_changes(cursor, STREAM_BATCH_SIZE, STREAM_HEARTBEAT)
+            if not changes:
+                yield ': keep-alive\n\n'
+                continue
+            for change in changes:
+                yield f"id: {change['sequence']}\nevent: change\ndata: {Change(**change).model_dump_json()}\n\n"
+            cursor = changes[-1]['sequence']
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
@@ -0,0 +1,65 @@
+from fastapi import APIRouter, HTTPException, Depends, Response
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from crud.hold import reserve_stock, get_hold, confirm_hold, release_hold
+from validation.hold import HoldCreate, Hold
+from decorators import is_transient_conflict
+from idempotency import idempotent, IdempotencyKeyHeader
+from utils.db import get_db
+
+router = APIRouter()
+
+
+@router.post("/", name='Reserve Stock')
+def reserve_stock_endpoint(hold: HoldCreate, response: Response,
+                           idempotency_key: str | None = IdempotencyKeyHeader,
+                           db: Session = Depends(get_db)) -> dict[str, Hold]:
+    def execute():
+        try:
+            result = reserve_stock(db, hold.product_id, hold.quantity, hold.ttl)
+        except DBAPIError as e:
+            if is_transient_conflict(e):
+                raise HTTPException(status_code=409, detail='Concurrent stock update conflict, please retry')
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {'hold': Hold.model_validate(result)}
+    return idempotent(db, response, idempotency_key, 'reserve_stock', hold.model_dump(), execute)
+
+
+@router.get("/{hold_id}", name='Get Hold')
+def read_hold(hold_id: int, db: Session = Depends(get_db)) -> dict[str, Hold]:
+    hold = get_hold(db, hold_id)
+    if not hold:
+        raise HTTPException(status_code=404, detail="hold not found")
+    return {'hold': hold}
+
+
+@router.post("/{hold_id}/confirm", name='Confirm Hold')
+def confirm_hold_endpoint(hold_id: int, db: Session = Depends(get_db)) -> dict[str, Hold]:
+    try:
+        hold = confirm_hold(db, hold_id)
+    except DBAPIError as e:
+        if is_transient_conflict(e):
+            raise HTTPException(status_code=409, detail='Concurrent stock update conflict, please retry')
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not hold:
+        raise HTTPException(status_code=404, detail="hold not found")
+    return {'hold': hold}
+
+
+@router.post("/{hold_id}/release", name='Release Hold')
+def release_hold_endpoint(hold_id: int, db: Session = Depends(get_db)) -> dict[str, Hold]:
+    try:
+        hold = release_hold(db, hold_id)
+    except DBAPIError as e:
+        if is_transient_conflict(e):
+            raise HTTPException(status_code=409, detail='Concurrent stock update conflict, please retry')
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not hold:
+        raise HTTPException(status_code=404, detail="hold not found")
+    return {'hold': hold}
@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from orm_setup import pool_status
+from cache import get_cache
+from group_commit import get_group_committer
+from metrics import GROUP_COMMIT_METRICS, render_prometheus
+
+router = APIRouter()
+
+
+@router.get("", name='Prometheus Metrics', response_class=PlainTextResponse)
+def read_prometheus_metrics() -> PlainTextResponse:
+    return PlainTextResponse(render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+@router.get("/pool", name='Connection Pool Metrics')
+def read_pool_metrics() -> dict[str, dict]:
+    return {'pool': pool_status()}
+
+
+@router.get("/cache", name='Cache Metrics')
+def read_cache_metrics() -> dict[str, dict]:
+    cache = get_cache()
+    return {'cache': {'backend': type(cache).__name__, **cache.stats.snapshot()}}
+
+
+@router.get("/group-commit", name='Group Commit Metrics')
+def read_group_commit_metrics() -> dict[str, dict]:
+    committer = get_group_committer()
+    return {'group_commit': {'enabled': committer is not None,
+                             'queue_depth': committer.queue_depth() if committer else 0,
+                             **GROUP_COMMIT_METRICS.snapshot()}}
@@ -1,32 +1,241 @@
-from fastapi import APIRouter, HTTPException, Depends
+import io
+from datetime import datetime
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
-from crud.product import (get_product, create_product, update_product, delete_product, update_stock)
-from validation.product import ProductCreate, ProductUpdate, ProductUpdateStock, Product
-from utils.db import get_db
+from crud.product import (get_product, get_products, create_product, update_product, delete_product, update_stock,
+                          bulk_update_stock, list_products, list_transactions, set_reorder_threshold)
+from crud.alert import list_low_stock_products
+from crud.ledger import get_stock_at
+from crud.search import search_products
+from crud.delete import delete_products
+from crud.stripe import configure_stripes
+from validation.product import (ProductCreate, ProductUpdate, ProductUpdateStock, Product, ProductBulkUpdateStock,
+                                ProductStockMovementResult, ProductStripes, ProductBatchGet, ProductBatchGetResult,
+                                ProductBulkDelete, ProductPage, ProductSearchPage, ProductStock, ProductStripesResult,
+                                ProductTransactionPage, LowStockPage)
+from validation.common import Message, ImportResult, ReorderThreshold
+from decorators import is_transient_conflict
+from group_commit import get_group_committer, GroupCommitBusy, GROUP_COMMIT_RESULT_TIMEOUT
+from idempotency import idempotent, IdempotencyKeyHeader
+from bulk.importer import import_products, detect_format, DEFAULT_BATCH_SIZE
+from bulk.exporter import stream_export, STREAM_FORMATS, EXPORT_ENTITIES, MEDIA_TYPES
+from utils.db import get_db, db_session
 
 router = APIRouter()
 
+# Rejected rows returned by the import endpoint, the rest are only counted.
+MAX_REJECTED_IN_RESPONSE = 100
+# Search results are ranked as a whole, so deep pages cost as much as the first ones and are capped.
+MAX_SEARCH_OFFSET = 1000
+
+
+# Products only have the fields asked for with `fields`.
+@router.get("/", name='List Products', response_model_exclude_unset=True)
+def list_products_endpoint(after: int | None = Query(None, description='Cursor: id of the last product of the '
+                                                                         'previous page'),
+                           limit: int = Query(100, ge=1, le=1000),
+                           supplier_id: int | None = None,
+                           min_price: float | None = None,
+                           max_price: float | None = None,
+                           stock_below: int | None = Query(None, description='Only products with less stock'),
+                           name_prefix: str | None = None,
+                           fields: str | None = Query(None, description='Comma-separated fields to return'),
+                           db: Session = Depends(get_db)) -> ProductPage:
+    try:
+        # One extra row tells whether there is a next page.
+        products = list_products(db, after_id=after, limit=limit + 1, supplier_id=supplier_id, min_price=min_price,
+                                 max_price=max_price, stock_below=stock_below, name_prefix=name_prefix,
+                                 fields=[field.strip() for field in fields.split(',')] if fields else None)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    next_cursor = products[limit - 1]['id'] if len(products) > limit else None
+    return {'products': products[:limit], 'next_cursor': next_cursor}
+
+
+@router.get("/export", name='Export Products')
+def export_products_endpoint(entity: str = Query('product', description='product or transaction'),
+                             file_format: str = Query('csv', alias='format', description='csv or jsonl'),
+                             supplier_id: int | None = None,
+                             start: datetime | None = Query(None, description='Transactions on or after this date'),
+                             end: datetime | None = Query(None, description='Transactions before this date')
+                             ) -> StreamingResponse:
+    if entity not in EXPORT_ENTITIES or file_format not in STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"entity must be one of {', '.join(EXPORT_ENTITIES)} and "
+                                                    f"format one of {', '.join(STREAM_FORMATS)}")
+
+    def content():
+        # The session must stay open while the response streams, after the request dependencies are closed.
+        with db_session() as db:
+            yield from stream_export(db, entity, file_format, supplier_id=supplier_id, start=start, end=end)
+
+    filename = f"{entity}s.{file_format}"
+    return StreamingResponse(content(), media_type=MEDIA_TYPES[file_format],
+                             headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@router.get("/search", name='Search Products')
+def search_products_endpoint(q: str = Query(..., min_length=1, description='Words of the name or description, or '
+                                                                           'the start of a SKU'),
+                             limit: int = Query(20, ge=1, le=100),
+                             offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+                             db: Session = Depends(get_db)) -> ProductSearchPage:
+    try:
+        # One extra row tells whether there is a next page.
+        products = search_products(db, q, limit=limit + 1, offset=offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    next_offset = offset + limit if len(products) > limit else None
+    return {'products': products[:limit], 'next_offset': next_offset}
+
+
+@router.get("/low-stock", name='List Low-Stock Products')
+def list_low_stock_products_endpoint(after: int | None = Query(None, description='Cursor: id of the last product of '
+                                                                                   'the previous page'),
+                                     limit: int = Query(100, ge=1, le=1000),
+                                     supplier_id: int | None = None,
+                                     db: Session = Depends(get_db)) -> LowStockPage:
+    try:
+        # One extra row tells whether there is a next page.
+        products = list_low_stock_products(db, after_id=after, limit=limit + 1, supplier_id=supplier_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    next_cursor = products[limit - 1]['id'] if len(products) > limit else None
+    return {'products': products[:limit], 'next_cursor': next_cursor}
+
 
 @router.get("/{product_id}", name='Get Product')
-def read_product(product_id: int, db: Session = Depends(get_db)):
+def read_product(product_id: int, db: Session = Depends(get_db)) -> dict[str, Product]:
     product = get_product(db, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="product not found")
     return {'product': product}
 
 
+# Stock at a point in time has no reserved and available stock.
+@router.get("/{product_id}/stock", name='Get Product Stock', response_model_exclude_unset=True)
+def read_product_stock(product_id: int,
+                       as_of: datetime | None = Query(None, description='Point in time, defaults to now'),
+                       db: Session = Depends(get_db)) -> ProductStock:
+    if as_of is None:
+        product = get_product(db, product_id)
+        if not product:
+            raise HTTPException(status_code=404, detail="product not found")
+        return {'product_id': product_id, 'as_of': None, 'stock': product.stock, 'reserved': product.reserved,
+                'available': product.available}
+
+    stock = get_stock_at(db, product_id, as_of)
+    if stock is None:
+        raise HTTPException(status_code=404, detail="product not found")
+    return {'product_id': product_id, 'as_of': as_of, 'stock': stock}
+
+
+@router.get("/{product_id}/transactions", name='List Product Transactions')
+def list_product_transactions(product_id: int,
+                              before: str | None = Query(None, description='Cursor: next_cursor of the previous '
+                                                                           'page'),
+                              limit: int = Query(100, ge=1, le=1000),
+                              start: datetime | None = Query(None, description='Only transactions on or after this '
+                                                                               'date'),
+                              end: datetime | None = Query(None, description='Only transactions before this date'),
+                              db: Session = Depends(get_db)) -> ProductTransactionPage:
+    try:
+        cursor = None
+        if before:
+            date, _, transaction_id = before.rpartition('_')
+            cursor = (datetime.fromisoformat(date), int(transaction_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if not get_product(db, product_id):
+        raise HTTPException(status_code=404, detail="product not found")
+    # One extra row tells whether there is a next page.
+    transactions = list_transactions(db, product_id, before=cursor, limit=limit + 1, start=start, end=end)
+    next_cursor = None
+    if len(transactions) > limit:
+        last = transactions[limit - 1]
+        next_cursor = f'{last.date.isoformat()}_{last.id}'
+    return {'transactions': transactions[:limit], 'next_cursor': next_cursor}
+
+
 @router.post("/", name='Create Product')
-def create_product_endpoint(product: ProductCreate, db: Session = Depends(get_db)) -> dict[str, Product]:
+def create_product_endpoint(product: ProductCreate, response: Response,
+                            idempotency_key: str | None = IdempotencyKeyHeader,
+                            db: Session = Depends(get_db)) -> dict[str, Product]:
+    def execute():
+        try:
+            result = create_product(db, name=product.name, description=product.description, sku=product.sku,
+                                    price=product.price, stock=product.stock, supplier_id=product.supplier_id)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {'product': Product.model_validate(result)}
+    return idempotent(db, response, idempotency_key, 'create_product', product.model_dump(), execute)
+
+
+@router.post("/import", name='Import Products')
+def import_products_endpoint(file: UploadFile,
+                             file_format: str | None = Query(None, alias='format', description='csv or jsonl'),
+                             batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=10000),
+                             restore_deleted: bool = Query(False, description='Restore the soft-deleted products '
+                                                                              'of the file'),
+                             db: Session = Depends(get_db)) -> ImportResult:
+    rejected = []
+
+    def on_reject(row: dict) -> None:
+        if len(rejected) < MAX_REJECTED_IN_RESPONSE:
+            rejected.append(row)
+
+    stream = io.TextIOWrapper(file.file, encoding='utf-8', newline='')
     try:
-        result = create_product(db, name=product.name, description=product.description, sku=product.sku,
-                                price=product.price, stock=product.stock, supplier_id=product.supplier_id)
+        report = import_products(db, stream, file_format or detect_format(file.filename or ''), batch_size, on_reject,
+                                 restore_deleted)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    return {'product': result}
+    return {'report': report, 'rejected': rejected}
+
+
+@router.post("/batch-get", name='Get Products')
+def get_products_endpoint(batch: ProductBatchGet,
+                          db: Session = Depends(get_db)) -> dict[str, list[ProductBatchGetResult]]:
+    try:
+        results = get_products(db, ids=batch.ids, skus=batch.skus, include_supplier=batch.include_supplier)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'products': results}
+
+
+@router.post("/bulk-delete", name='Delete Products')
+def delete_products_endpoint(bulk: ProductBulkDelete, db: Session = Depends(get_db)) -> dict[str, int]:
+    try:
+        deleted = delete_products(db, bulk.ids, soft=bulk.soft)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'deleted': deleted}
+
+
+# Static paths must be registered before "/{product_id}" so they are not captured by it.
+@router.put("/stock", name='Bulk Update Product Stock')
+def bulk_update_stock_endpoint(bulk: ProductBulkUpdateStock, response: Response,
+                               idempotency_key: str | None = IdempotencyKeyHeader,
+                               db: Session = Depends(get_db)) -> dict[str, list[ProductStockMovementResult]]:
+    movements = [(movement.product_id, movement.quantity, movement.operation) for movement in bulk.movements]
+
+    def execute():
+        try:
+            results = bulk_update_stock(db, movements, all_or_nothing=bulk.all_or_nothing)
+        except DBAPIError as e:
+            if is_transient_conflict(e):
+                raise HTTPException(status_code=409, detail='Concurrent stock update conflict, please retry')
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {'results': results}
+    return idempotent(db, response, idempotency_key, 'bulk_update_stock', bulk.model_dump(), execute)
 
 
 @router.put("/{product_id}", name='Update Product')
-def update_product_endpoint(product_id: int, product: ProductUpdate, db: Session = Depends(get_db)):
+def update_product_endpoint(product_id: int, product: ProductUpdate, db: Session = Depends(get_db)) -> Message:
     try:
         updated = update_product(db, product_id, name=product.name, description=product.description,
                                  sku=product.sku, price=product.price)
@@ -38,18 +247,70 @@ def update_product_endpoint(product_id: int, product: ProductUpdate, db: Session
 
 
 @router.put("/{product_id}/stock", name='Update Product Stock')
-def update_product_stock_endpoint(product_id: int, product: ProductUpdateStock, db: Session = Depends(get_db)):
+def update_product_stock_endpoint(product_id: int, product: ProductUpdateStock, response: Response,
+                                  idempotency_key: str | None = IdempotencyKeyHeader,
+                                  db: Session = Depends(get_db)) -> Message:
+    committer = get_group_committer()
+
+    def execute():
+        try:
+            if committer:
+                committer.submit(product_id, product.quantity, product.operation).result(GROUP_COMMIT_RESULT_TIMEOUT)
+            else:
+                update_stock(db, product_id, quantity=product.quantity, operation=product.operation)
+        except GroupCommitBusy as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
+        except TimeoutError:
+            raise HTTPException(status_code=504, detail='The stock update is still pending, it may yet be applied')
+        except DBAPIError as e:
+            if is_transient_conflict(e):
+                raise HTTPException(status_code=409, detail='Concurrent stock update conflict, please retry')
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {'message': 'product stock updated successfully'}
+    return idempotent(db, response, idempotency_key, 'update_product_stock',
+                      {'product_id': product_id, **product.model_dump()}, execute)
+
+
+@router.put("/{product_id}/reorder-threshold", name='Set Product Reorder Threshold')
+def set_product_reorder_threshold_endpoint(product_id: int, reorder: ReorderThreshold,
+                                           db: Session = Depends(get_db)) -> Message:
+    try:
+        found = set_reorder_threshold(db, product_id, reorder.threshold)
+    except DBAPIError as e:
+        if is_transient_conflict(e):
+            raise HTTPException(status_code=409, detail='Concurrent stock update conflict, please retry')
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not found:
+        raise HTTPException(status_code=404, detail="product not found")
+    return {'message': 'product reorder threshold updated successfully'}
+
+
+@router.put("/{product_id}/stripes", name='Configure Product Stock Stripes')
+def configure_product_stripes_endpoint(product_id: int, stripes: ProductStripes,
+                                       db: Session = Depends(get_db)) -> ProductStripesResult:
     try:
-        update_stock(db, product_id, quantity=product.quantity, operation=product.operation)
+        stock = configure_stripes(db, product_id, stripes.stripe_count)
+    except DBAPIError as e:
+        if is_transient_conflict(e):
+            raise HTTPException(status_code=409, detail='Concurrent stock update conflict, please retry')
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    return {'message': 'product stock updated successfully'}
+    if stock is None:
+        raise HTTPException(status_code=404, detail="product not found")
+    return {'product_id': product_id, 'stripe_count': stripes.stripe_count, 'stock': stock}
 
 
 @router.delete("/{product_id}", name='Delete Product')
-def delete_product_endpoint(product_id: int, db: Session = Depends(get_db)):
+def delete_product_endpoint(product_id: int,
+                            soft: bool = Query(False, description='Only mark as deleted'),
+                            db: Session = Depends(get_db)) -> Message:
     try:
-        deleted = delete_product(db, product_id)
+        deleted = delete_product(db, product_id, soft)
         if not deleted:
             raise HTTPException(status_code=404, detail="product not found")
     except Exception as e:
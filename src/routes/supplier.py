@@ -1,32 +1,99 @@
-from fastapi import APIRouter, HTTPException, Depends
+import io
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, UploadFile
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from crud.supplier import (get_supplier, create_supplier, update_supplier, delete_supplier)
-from validation.supplier import SupplierCreate, SupplierUpdate, Supplier
+from crud.supplier import (get_supplier, create_supplier, update_supplier, delete_supplier,
+                           set_supplier_reorder_threshold)
+from crud.delete import delete_suppliers
+from crud.summary import list_supplier_summaries, get_supplier_summary
+from validation.supplier import (SupplierCreate, SupplierUpdate, Supplier, SupplierSummary, SupplierSummaryPage,
+                                 SupplierBulkDelete)
+from validation.common import Message, ImportResult, ReorderThreshold
+from bulk.importer import import_suppliers, detect_format, DEFAULT_BATCH_SIZE
+from idempotency import idempotent, IdempotencyKeyHeader
 from utils.db import get_db
 
 router = APIRouter()
 
+# Rejected rows returned by the import endpoint, the rest are only counted.
+MAX_REJECTED_IN_RESPONSE = 100
+
+
+@router.post("/bulk-delete", name='Delete Suppliers')
+def delete_suppliers_endpoint(bulk: SupplierBulkDelete, db: Session = Depends(get_db)) -> dict[str, int]:
+    try:
+        deleted = delete_suppliers(db, bulk.ids, soft=bulk.soft)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'deleted': deleted}
+
+
+@router.get("/summary", name='List Supplier Summaries')
+def list_supplier_summaries_endpoint(after: int | None = Query(None, description='Cursor: id of the last supplier '
+                                                                                 'of the previous page'),
+                                     limit: int = Query(100, ge=1, le=5000),
+                                     db: Session = Depends(get_db)) -> SupplierSummaryPage:
+    # One extra row tells whether there is a next page.
+    summaries = list_supplier_summaries(db, after_id=after, limit=limit + 1)
+    next_cursor = summaries[limit - 1]['supplier_id'] if len(summaries) > limit else None
+    return {'summaries': summaries[:limit], 'next_cursor': next_cursor}
+
 
 @router.get("/{supplier_id}", name='Get Supplier')
-def read_supplier(supplier_id: int, db: Session = Depends(get_db)):
+def read_supplier(supplier_id: int, db: Session = Depends(get_db)) -> dict[str, Supplier]:
     supplier = get_supplier(db, supplier_id)
     if not supplier:
         raise HTTPException(status_code=404, detail="Supplier not found")
     return {'supplier': supplier}
 
 
+@router.get("/{supplier_id}/summary", name='Get Supplier Summary')
+def read_supplier_summary(supplier_id: int, db: Session = Depends(get_db)) -> dict[str, SupplierSummary]:
+    summary = get_supplier_summary(db, supplier_id)
+    if not summary:
+        raise HTTPException(status_code=404, detail="Supplier not found")
+    return {'summary': summary}
+
+
 @router.post("/", name='Create Supplier')
-def create_supplier_endpoint(supplier: SupplierCreate, db: Session = Depends(get_db)) -> dict[str, Supplier]:
+def create_supplier_endpoint(supplier: SupplierCreate, response: Response,
+                             idempotency_key: str | None = IdempotencyKeyHeader,
+                             db: Session = Depends(get_db)) -> dict[str, Supplier]:
+    def execute():
+        try:
+            result = create_supplier(db, name=supplier.name, email=supplier.email, phone_number=supplier.phone_number)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {'supplier': Supplier.model_validate(result)}
+    return idempotent(db, response, idempotency_key, 'create_supplier', supplier.model_dump(), execute)
+
+
+@router.post("/import", name='Import Suppliers')
+def import_suppliers_endpoint(file: UploadFile,
+                              file_format: str | None = Query(None, alias='format', description='csv or jsonl'),
+                              batch_size: int = Query(DEFAULT_BATCH_SIZE, ge=1, le=10000),
+                              restore_deleted: bool = Query(False, description='Restore the soft-deleted suppliers '
+                                                                               'of the file'),
+                              db: Session = Depends(get_db)) -> ImportResult:
+    rejected = []
+
+    def on_reject(row: dict) -> None:
+        if len(rejected) < MAX_REJECTED_IN_RESPONSE:
+            rejected.append(row)
+
+    stream = io.TextIOWrapper(file.file, encoding='utf-8', newline='')
     try:
-        result = create_supplier(db, name=supplier.name, email=supplier.email, phone_number=supplier.phone_number)
+        report = import_suppliers(db, stream, file_format or detect_format(file.filename or ''), batch_size, on_reject,
+                                  restore_deleted)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
-    return {'supplier': result}
+    return {'report': report, 'rejected': rejected}
 
 
 @router.put("/{supplier_id}", name='Update Supplier')
-def update_supplier_endpoint(supplier_id: int, supplier: SupplierUpdate, db: Session = Depends(get_db)):
+def update_supplier_endpoint(supplier_id: int, supplier: SupplierUpdate,
+                             db: Session = Depends(get_db)) -> Message:
     try:
         updated = update_supplier(db, supplier_id, supplier.name, supplier.email, supplier.phone_number)
         if not updated:
@@ -36,10 +103,24 @@ def update_supplier_endpoint(supplier_id: int, supplier: SupplierUpdate, db: Ses
     return {'message': 'Supplier updated successfully'}
 
 
+@router.put("/{supplier_id}/reorder-threshold", name='Set Supplier Reorder Threshold')
+def set_supplier_reorder_threshold_endpoint(supplier_id: int, reorder: ReorderThreshold,
+                                            db: Session = Depends(get_db)) -> Message:
+    try:
+        found = set_supplier_reorder_threshold(db, supplier_id, reorder.threshold)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not found:
+        raise HTTPException(status_code=404, detail="Supplier not found")
+    return {'message': 'Supplier reorder threshold updated successfully'}
+
+
 @router.delete("/{supplier_id}", name='Delete Supplier')
-def delete_supplier_endpoint(supplier_id: int, db: Session = Depends(get_db)):
+def delete_supplier_endpoint(supplier_id: int,
+                             soft: bool = Query(False, description='Only mark as deleted'),
+                             db: Session = Depends(get_db)) -> Message:
     try:
-        deleted = delete_supplier(db, supplier_id)
+        deleted = delete_supplier(db, supplier_id, soft)
         if not deleted:
             raise HTTPException(status_code=404, detail="Supplier not found")
     except Exception as e:
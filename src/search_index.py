@@ -0,0 +1,171 @@
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import Product
+
+logger = logging.getLogger(__name__)
+
+# Seconds the in-memory index is used before it is rebuilt, which bounds how stale it gets when other processes
+# write products. Writes of this process rebuild it on the next search.
+SEARCH_INDEX_TTL = float(os.environ.get('SEARCH_INDEX_TTL', 60))
+# Minimum trigram similarity (0 to 1) of a misspelled word to a word of a product.
+SEARCH_SIMILARITY_THRESHOLD = float(os.environ.get('SEARCH_SIMILARITY_THRESHOLD', 0.4))
+
+# Weight of a match in each field, and of a match by prefix or by similarity relative to an exact one.
+NAME_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+SKU_PREFIX_SCORE = 1.0
+PREFIX_MATCH = 0.8
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text: str | None) -> list[str]:
+    return _WORD.findall(text.lower()) if text else []
+
+
+def trigrams(word: str) -> set[str]:
+    # Padded like pg_trgm, so the start and the end of a word count more.
+    padded = f'  {word} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def similarity(first: set[str], second: set[str]) -> float:
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared) if shared else 0.0
+
+
+class ProductSearchIndex:
+    """
+    In-memory search index of the products, for databases without full-text and trigram indexes, e.g. SQLite
+    in development and tests. It maps every word of the names and descriptions to the products that contain
+    it, every trigram to the words that contain it for typo-tolerant matching, and keeps the SKUs sorted for
+    prefix matching.
+
+    The index is built from the database on the first search, and rebuilt on the search that follows an
+    `invalidate` or after `SEARCH_INDEX_TTL` seconds.
+    """
+
+    def __init__(self, ttl: float = SEARCH_INDEX_TTL, threshold: float = SEARCH_SIMILARITY_THRESHOLD):
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._built_at: float | None = None
+        # Counts the invalidations, so a build that overlaps one doesn't count as fresh.
+        self._generation = 0
+        # word -> {product id: weight of the best field the word appears in}
+        self._postings: dict[str, dict[int, float]] = {}
+        self._vocabulary: list[str] = []
+        self._trigrams: dict[str, set[str]] = {}
+        self._skus: list[tuple[str, int]] = []
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._built_at = None
+
+    def _is_fresh(self) -> bool:
+        return self._built_at is not None and time.monotonic() - self._built_at < self.ttl
+
+    def build(self, session: Session) -> None:
+        started = time.monotonic()
+        generation = self._generation
+        postings = defaultdict(dict)
+        skus = []
+        rows = session.execute(select(Product.id, Product.name, Product.description, Product.sku)
+                               .execution_options(yield_per=10000))
+        for product_id, name, description, sku in rows:
+            for words, weight in ((tokenize(description), DESCRIPTION_WEIGHT), (tokenize(name), NAME_WEIGHT)):
+                for word in words:
+                    if postings[word].get(product_id, 0) < weight:
+                        postings[word][product_id] = weight
+            skus.append((sku.lower(), product_id))
+
+        index = defaultdict(set)
+        for word in postings:
+            for trigram in trigrams(word):
+                index[trigram].add(word)
+        skus.sort()
+        self._postings, self._vocabulary, self._trigrams, self._skus = (dict(postings), sorted(postings), dict(index),
+                                                                        skus)
+        if generation == self._generation:
+            self._built_at = started
+        logger.info(f"Built the product search index of {len(skus)} products, {len(postings)} words, in "
+                    f"{time.monotonic() - started:.2f} s")
+
+    def _matching_words(self, token: str) -> dict[str, float]:
+        """
+        :return: The words of the index matching a query word exactly, by prefix or by similarity, with the
+            quality of the match.
+        """
+        matches = {}
+        position = bisect.bisect_left(self._vocabulary, token)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(token):
+            word = self._vocabulary[position]
+            matches[word] = 1.0 if word == token else PREFIX_MATCH
+            position += 1
+
+        token_trigrams = trigrams(token)
+        candidates = set()
+        for trigram in token_trigrams:
+            candidates |= self._trigrams.get(trigram, set())
+        for word in candidates - matches.keys():
+            score = similarity(token_trigrams, trigrams(word))
+            if score >= self.threshold:
+                matches[word] = score * PREFIX_MATCH
+        return matches
+
+    def search(self, session: Session, query: str, limit: int, offset: int = 0) -> list[tuple[int, float]]:
+        """
+        Ranks the products matching every word of `query`, or whose SKU starts with it.
+
+        :return: (product id, score) pairs of the requested page, best first.
+        """
+        if not self._is_fresh():
+            with self._lock:
+                if not self._is_fresh():
+                    self.build(session)
+
+        scores = None
+        for token in tokenize(query):
+            token_scores = defaultdict(float)
+            for word, quality in self._matching_words(token).items():
+                for product_id, weight in self._postings[word].items():
+                    token_scores[product_id] = max(token_scores[product_id], quality * weight)
+            # Every word of the query must match.
+            scores = token_scores if scores is None else {product_id: score + token_scores[product_id]
+                                                          for product_id, score in scores.items()
+                                                          if product_id in token_scores}
+        scores = dict(scores or {})
+
+        prefix = query.strip().lower()
+        if prefix:
+            position = bisect.bisect_left(self._skus, (prefix,))
+            while position < len(self._skus) and self._skus[position][0].startswith(prefix):
+                product_id = self._skus[position][1]
+                scores[product_id] = scores.get(product_id, 0.0) + SKU_PREFIX_SCORE
+                position += 1
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[offset:offset + limit]
+
+
+_index = ProductSearchIndex()
+
+
+def get_search_index() -> ProductSearchIndex:
+    return _index
+
+
+def invalidate_search_index() -> None:
+    """
+    Marks the in-memory index as stale after products were written, so the next search rebuilds it.
+    """
+    _index.invalidate()
@@ -0,0 +1,26 @@
+from sqlalchemy import event
+from sqlalchemy.orm import Session, ORMExecuteState, with_loader_criteria
+
+from models import Product, Supplier
+
+# Execution option that makes a SELECT also return soft-deleted rows, e.g.
+# `session.execute(select(Product), execution_options={INCLUDE_DELETED: True})`.
+INCLUDE_DELETED = 'include_deleted'
+
+SOFT_DELETABLE = (Product, Supplier)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _hide_deleted(execute_state: ORMExecuteState) -> None:
+    """
+    Adds `deleted_at IS NULL` to every ORM SELECT of products and suppliers, including the column selects, joins
+    and the lazy loads of their relationships, so soft-deleted rows look deleted to all the CRUD functions.
+    Relationship loads are filtered even when their parent was loaded with `INCLUDE_DELETED`, e.g.
+    `supplier.products` never contains a soft-deleted product. Refreshing the columns of a loaded row isn't.
+    UPDATE and DELETE statements are not filtered, they check `deleted_at` themselves where it matters.
+    """
+    if (not execute_state.is_select or execute_state.is_column_load
+            or execute_state.execution_options.get(INCLUDE_DELETED, False)):
+        return
+    execute_state.statement = execute_state.statement.options(
+        *[with_loader_criteria(model, model.deleted_at.is_(None), include_aliases=True) for model in SOFT_DELETABLE])
@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Callable
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from crud.hold import expire_holds, DEFAULT_EXPIRE_BATCH_SIZE
+from crud.stripe import rebalance_stripes
+from crud.summary import compact_supplier_summaries
+from crud.idempotency import purge_idempotency_keys, DEFAULT_PURGE_BATCH_SIZE
+from crud.outbox import relay_change_events, purge_change_events, DEFAULT_RELAY_BATCH_SIZE
+from outbox import get_sink, get_change_feed
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two sweeps of expired holds, 0 disables the sweeper of the API processes.
+HOLD_SWEEP_INTERVAL = float(os.environ.get('HOLD_SWEEP_INTERVAL', 30))
+HOLD_SWEEP_BATCH_SIZE = int(os.environ.get('HOLD_SWEEP_BATCH_SIZE', DEFAULT_EXPIRE_BATCH_SIZE))
+# Seconds between two rebalances of the stock stripes of hot products, 0 disables the rebalancer. Off by default,
+# set it when products are striped.
+STRIPE_REBALANCE_INTERVAL = float(os.environ.get('STRIPE_REBALANCE_INTERVAL', 0))
+# Seconds between two compactions of the supplier summary deltas, 0 disables the compactor.
+SUMMARY_COMPACT_INTERVAL = float(os.environ.get('SUMMARY_COMPACT_INTERVAL', 5))
+# Seconds between two purges of expired idempotency keys, 0 disables the purger.
+IDEMPOTENCY_PURGE_INTERVAL = float(os.environ.get('IDEMPOTENCY_PURGE_INTERVAL', 60))
+IDEMPOTENCY_PURGE_BATCH_SIZE = int(os.environ.get('IDEMPOTENCY_PURGE_BATCH_SIZE', DEFAULT_PURGE_BATCH_SIZE))
+# Seconds between two runs of the change event relay, 0 disables it, and with it the change stream.
+OUTBOX_RELAY_INTERVAL = float(os.environ.get('OUTBOX_RELAY_INTERVAL', 0.2))
+OUTBOX_RELAY_BATCH_SIZE = int(os.environ.get('OUTBOX_RELAY_BATCH_SIZE', DEFAULT_RELAY_BATCH_SIZE))
+# Hours published change events are kept for the consumers of the change stream.
+OUTBOX_RETENTION_HOURS = float(os.environ.get('OUTBOX_RETENTION_HOURS', 7 * 24))
+
+
+class PeriodicTask:
+    """
+    Background thread that runs `task` with a new session every `interval` seconds.
+    """
+    name = 'periodic-task'
+
+    def __init__(self, session_factory: sessionmaker, interval: float, task: Callable[[Session], object]):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.task = task
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                with self.session_factory() as session:
+                    self.task(session)
+            except Exception as e:
+                # Logged by `handle_exceptions`, the next run tries again.
+                logger.warning(f"{self.name} failed: {e}")
+
+
+class HoldSweeper(PeriodicTask):
+    """
+    Releases expired stock holds.
+    """
+    name = 'hold-sweeper'
+
+    def __init__(self, session_factory: sessionmaker, interval: float = HOLD_SWEEP_INTERVAL,
+                 batch_size: int = HOLD_SWEEP_BATCH_SIZE):
+        super().__init__(session_factory, interval, lambda session: expire_holds(session, batch_size))
+
+
+class StripeRebalancer(PeriodicTask):
+    """
+    Evens out the stock stripes of striped products, so sales keep finding a stripe with enough stock.
+    """
+    name = 'stripe-rebalancer'
+
+    def __init__(self, session_factory: sessionmaker, interval: float = STRIPE_REBALANCE_INTERVAL):
+        super().__init__(session_factory, interval, rebalance_stripes)
+
+
+class SummaryCompactor(PeriodicTask):
+    """
+    Folds the supplier summary deltas into the summary rows, so reading a summary only adds up a few deltas.
+    """
+    name = 'summary-compactor'
+
+    def __init__(self, session_factory: sessionmaker, interval: float = SUMMARY_COMPACT_INTERVAL):
+        super().__init__(session_factory, interval, compact_supplier_summaries)
+
+
+class IdempotencyPurger(PeriodicTask):
+    """
+    Deletes the expired idempotency keys.
+    """
+    name = 'idempotency-purger'
+
+    def __init__(self, session_factory: sessionmaker, interval: float = IDEMPOTENCY_PURGE_INTERVAL,
+                 batch_size: int = IDEMPOTENCY_PURGE_BATCH_SIZE):
+        super().__init__(session_factory, interval, lambda session: purge_idempotency_keys(session, batch_size))
+
+
+class OutboxRelay(PeriodicTask):
+    """
+    Publishes the new change events to the configured sink and the change stream, and purges the old ones.
+    """
+    name = 'outbox-relay'
+
+    def __init__(self, session_factory: sessionmaker, interval: float = OUTBOX_RELAY_INTERVAL,
+                 batch_size: int = OUTBOX_RELAY_BATCH_SIZE, retention_hours: float = OUTBOX_RETENTION_HOURS):
+        self.batch_size = batch_size
+        self.retention = timedelta(hours=retention_hours)
+        super().__init__(session_factory, interval, self.relay)
+
+    def relay(self, session: Session) -> None:
+        if relay_change_events(session, get_sink().publish, self.batch_size):
+            get_change_feed().invalidate()
+        purge_change_events(session, datetime.now() - self.retention)
+
+
+def start_background_tasks(session_factory: sessionmaker) -> list[PeriodicTask]:
+    """
+    Starts the enabled background tasks of an API process.
+    """
+    tasks = []
+    if HOLD_SWEEP_INTERVAL > 0:
+        tasks.append(HoldSweeper(session_factory))
+    if STRIPE_REBALANCE_INTERVAL > 0:
+        tasks.append(StripeRebalancer(session_factory))
+    if SUMMARY_COMPACT_INTERVAL > 0:
+        tasks.append(SummaryCompactor(session_factory))
+    if IDEMPOTENCY_PURGE_INTERVAL > 0:
+        tasks.append(IdempotencyPurger(session_factory))
+    if OUTBOX_RELAY_INTERVAL > 0:
+        tasks.append(OutboxRelay(session_factory))
+    for task in tasks:
+        task.start()
+    return tasks
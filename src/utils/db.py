@@ -1,7 +1,25 @@
-from orm_setup import SessionLocal
+from contextlib import contextmanager
+
+from orm_setup import SessionLocal, AsyncSessionLocal, get_engine, get_async_engine
 
 
 def get_db():
+    with db_session() as db:
+        yield db
+
+
+async def get_async_db():
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+@contextmanager
+def db_session():
+    """
+    Opens a session that outlives the request dependencies, e.g. for streaming responses.
+    """
+    get_engine()
     db = SessionLocal()
     try:
         yield db
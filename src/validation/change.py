@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+from models import ChangeType
+
+
+class Change(BaseModel):
+    id: int
+    sequence: int
+    product_id: int
+    change: ChangeType
+    stock: int | None = None
+    reserved: int | None = None
+    created_at: datetime
+
+
+class ChangePage(BaseModel):
+    changes: list[Change]
+    # Pass as `since` to get the next changes, the same `since` if there were none.
+    next_cursor: int
@@ -0,0 +1,29 @@
+from pydantic import BaseModel, Field
+
+
+class Message(BaseModel):
+    message: str
+
+
+class ImportReport(BaseModel):
+    read: int
+    imported: int
+    rejected: int
+    seconds: float
+    rows_per_second: int
+
+
+class RejectedRow(BaseModel):
+    line: int
+    row: dict | None = None
+    errors: list[str]
+
+
+class ImportResult(BaseModel):
+    report: ImportReport
+    # The first MAX_REJECTED_IN_RESPONSE rejected rows, the rest are only counted.
+    rejected: list[RejectedRow]
+
+
+class ReorderThreshold(BaseModel):
+    threshold: int | None = Field(..., ge=0, description='Alert when less stock is available, null to unset it')
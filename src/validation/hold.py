@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field
+from models import HoldStatus
+
+
+class HoldCreate(BaseModel):
+    product_id: int
+    quantity: int = Field(gt=0)
+    ttl: int | None = Field(None, gt=0, le=86400, description='Seconds until the hold expires')
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [
+                {
+                    'product_id': 1,
+                    'quantity': 2,
+                    'ttl': 600
+                }
+            ]
+        }
+    }
+
+
+class Hold(BaseModel):
+    model_config = {'from_attributes': True}
+
+    id: int
+    product_id: int
+    quantity: int
+    status: HoldStatus
+    created_at: datetime
+    expires_at: datetime
@@ -1,5 +1,11 @@
-from pydantic import BaseModel
+from datetime import datetime
+
+from pydantic import BaseModel, Field, model_validator
 from models import OperationType
+from validation.supplier import Supplier, MAX_BULK_DELETE_IDS
+
+# Products resolved by one batch get, which are looked up with a single query.
+MAX_BATCH_GET_ITEMS = 5000
 
 
 class ProductCreate(BaseModel):
@@ -47,7 +53,7 @@ class ProductUpdate(BaseModel):
 
 
 class ProductUpdateStock(BaseModel):
-    quantity: int
+    quantity: int = Field(gt=0)
     operation: OperationType
 
     model_config = {
@@ -63,6 +69,8 @@ class ProductUpdateStock(BaseModel):
 
 
 class Product(BaseModel):
+    model_config = {'from_attributes': True}
+
     id: int
     name: str
     description: str | None = None
@@ -70,3 +78,178 @@ class Product(BaseModel):
     price: float
     supplier_id: int
     stock: int
+    reserved: int = 0
+    stripe_count: int = 0
+
+
+class ProductFields(BaseModel):
+    # A product of a listing, with only the fields that were asked for.
+    id: int | None = None
+    name: str | None = None
+    description: str | None = None
+    sku: str | None = None
+    price: float | None = None
+    supplier_id: int | None = None
+    stock: int | None = None
+    reserved: int | None = None
+    stripe_count: int | None = None
+
+
+class ProductPage(BaseModel):
+    products: list[ProductFields]
+    next_cursor: int | None = None
+
+
+class LowStockProduct(BaseModel):
+    id: int
+    sku: str
+    name: str
+    supplier_id: int
+    available: int
+    threshold: int
+    low_stock_since: datetime
+
+
+class LowStockPage(BaseModel):
+    products: list[LowStockProduct]
+    next_cursor: int | None = None
+
+
+class ProductSearchResult(BaseModel):
+    id: int
+    name: str
+    description: str | None = None
+    sku: str
+    price: float
+    supplier_id: int
+    stock: int
+    score: float
+
+
+class ProductSearchPage(BaseModel):
+    products: list[ProductSearchResult]
+    next_offset: int | None = None
+
+
+class ProductStock(BaseModel):
+    product_id: int
+    as_of: datetime | None = None
+    stock: int
+    reserved: int | None = None
+    available: int | None = None
+
+
+class ProductStripes(BaseModel):
+    stripe_count: int = Field(ge=0, le=64, description='Stock rows to split the stock across, 0 to stop striping')
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [
+                {
+                    'stripe_count': 8
+                }
+            ]
+        }
+    }
+
+
+class ProductTransaction(BaseModel):
+    model_config = {'from_attributes': True}
+
+    id: int
+    product_id: int
+    operation: OperationType
+    quantity: int
+    date: datetime
+
+
+class ProductTransactionPage(BaseModel):
+    transactions: list[ProductTransaction]
+    next_cursor: str | None = None
+
+
+class ProductStripesResult(BaseModel):
+    product_id: int
+    stripe_count: int
+    stock: int
+
+
+class ProductStockMovement(ProductUpdateStock):
+    product_id: int
+
+
+class ProductBulkUpdateStock(BaseModel):
+    movements: list[ProductStockMovement]
+    all_or_nothing: bool = False
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [
+                {
+                    'movements': [
+                        {'product_id': 1, 'quantity': 2, 'operation': OperationType.SALE},
+                        {'product_id': 2, 'quantity': 50, 'operation': OperationType.ADD},
+                    ],
+                    'all_or_nothing': False
+                }
+            ]
+        }
+    }
+
+
+class ProductStockMovementResult(BaseModel):
+    index: int
+    product_id: int
+    success: bool
+    stock: int | None = None
+    detail: str | None = None
+
+
+class ProductBatchGet(BaseModel):
+    ids: list[int] | None = Field(None, max_length=MAX_BATCH_GET_ITEMS)
+    skus: list[str] | None = Field(None, max_length=MAX_BATCH_GET_ITEMS)
+    include_supplier: bool = Field(False, description='Add the supplier of each product, read with the same query')
+
+    @model_validator(mode='after')
+    def check_keys(self):
+        if (self.ids is None) == (self.skus is None):
+            raise ValueError('Pass either ids or skus')
+        return self
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [
+                {
+                    'ids': [1, 2, 3],
+                    'include_supplier': True
+                },
+                {
+                    'skus': ['LTP123', 'MSE100']
+                }
+            ]
+        }
+    }
+
+
+class ProductBatchGetResult(BaseModel):
+    id: int | None = None
+    sku: str | None = None
+    found: bool
+    product: Product | None = None
+    supplier: Supplier | None = None
+
+
+class ProductBulkDelete(BaseModel):
+    ids: list[int] = Field(..., min_length=1, max_length=MAX_BULK_DELETE_IDS)
+    soft: bool = Field(False, description='Only mark the products as deleted')
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [
+                {
+                    'ids': [1, 2, 3],
+                    'soft': True
+                }
+            ]
+        }
+    }
@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+# Ids of one bulk delete request. They are deleted in batches of DELETE_BATCH_SIZE products either way.
+MAX_BULK_DELETE_IDS = 10000
 
 
 class SupplierCreate(BaseModel):
@@ -44,6 +47,7 @@ class Supplier(BaseModel):
     phone_number: str
 
     model_config = {
+        'from_attributes': True,
         'json_schema_extra': {
             'examples': [
                 {
@@ -56,9 +60,52 @@ class Supplier(BaseModel):
         }
     }
 
+
+class SupplierSummary(BaseModel):
+    supplier_id: int
+    product_count: int
+    units: int
+    inventory_value: float
+    low_stock_count: int
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [
+                {
+                    'supplier_id': 1,
+                    'product_count': 120,
+                    'units': 5400,
+                    'inventory_value': 81250.5,
+                    'low_stock_count': 3
+                }
+            ]
+        }
+    }
+
 # class ProductTransaction(BaseModel):
 #     id: int
 #     product_id: int
 #     quantity: int
 #     operation_type: str  # Assuming this is a string, e.g., 'add' or 'subtract'
 #     timestamp: str  # Assuming this is a string, e.g., ISO format
+
+
+class SupplierSummaryPage(BaseModel):
+    summaries: list[SupplierSummary]
+    next_cursor: int | None = None
+
+
+class SupplierBulkDelete(BaseModel):
+    ids: list[int] = Field(..., min_length=1, max_length=MAX_BULK_DELETE_IDS)
+    soft: bool = Field(False, description='Only mark the suppliers and their products as deleted')
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [
+                {
+                    'ids': [1, 2, 3],
+                    'soft': False
+                }
+            ]
+        }
+    }
@@ -0,0 +1,68 @@
+"""
+Shared fixtures of the tests, which run the CRUD functions against an in-memory SQLite database, a new one for every
+test, so they need no PostgreSQL server.
+"""
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'src'))
+# Read by the modules that connect on their own, so they never reach for the `DB_*` variables of `.env`.
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from cache import LRUCache, configure_cache
+from models import Base
+# Hides the soft-deleted rows from the queries of every session, as the application does.
+import soft_delete  # noqa: F401
+from crud.supplier import create_supplier
+from crud.product import create_product
+
+
+@pytest.fixture
+def engine():
+    # A single connection, as every connection to `sqlite://` opens its own empty database.
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(autouse=True)
+def cache():
+    # The cache outlives the databases of the tests, a stale entry would hide what a test wrote.
+    cache = LRUCache()
+    configure_cache(cache)
+    return cache
+
+
+@pytest.fixture
+def supplier(session):
+    return create_supplier(session, 'Acme', 'orders@acme.test', '555-0100')
+
+
+@pytest.fixture
+def make_product(session, supplier):
+    """
+    Creates products with a unique SKU, e.g. `make_product(stock=10)`.
+    """
+    created = []
+
+    def make(stock: int = 0, price: float = 10.0, sku: str | None = None):
+        product = create_product(session, f'Product {len(created) + 1}', 'Made for a test',
+                                 sku or f'TEST-{len(created) + 1}', price, stock, supplier.id)
+        created.append(product)
+        return product
+
+    return make
+
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import HoldStatus, OperationType
+from crud.product import get_product, update_stock
+from crud.hold import reserve_stock, confirm_hold, release_hold, expire_holds, get_hold
+from crud.stripe import get_total_stock
+
+
+def _levels(session, product_id: int) -> tuple[int, int]:
+    # Read past the cache and the identity map, as the holds update the product with bulk statements.
+    session.expire_all()
+    product = get_product(session, product_id)
+    return product.stock, product.reserved
+
+
+def test_reserve_stock_holds_the_quantity(session, make_product):
+    product = make_product(stock=10)
+
+    hold = reserve_stock(session, product.id, 4, ttl=60)
+
+    assert hold.status == HoldStatus.ACTIVE
+    assert hold.expires_at > datetime.now() + timedelta(seconds=50)
+    assert _levels(session, product.id) == (10, 4)
+
+
+def test_reserve_stock_refuses_more_than_the_available_stock(session, make_product):
+    product = make_product(stock=10)
+    reserve_stock(session, product.id, 8)
+
+    with pytest.raises(ValueError, match='Available: 2, Requested: 3'):
+        reserve_stock(session, product.id, 3)
+    assert _levels(session, product.id) == (10, 8)
+
+
+def test_reserved_stock_can_not_be_sold(session, make_product):
+    product = make_product(stock=10)
+    reserve_stock(session, product.id, 8)
+
+    with pytest.raises(ValueError, match='Not enough stock'):
+        update_stock(session, product.id, 3, OperationType.SALE)
+    assert update_stock(session, product.id, 2, OperationType.SALE) == 8
+
+
+def test_confirm_hold_sells_the_held_quantity(session, make_product):
+    product = make_product(stock=10)
+    hold = reserve_stock(session, product.id, 4)
+
+    confirmed = confirm_hold(session, hold.id)
+
+    assert confirmed.status == HoldStatus.CONFIRMED
+    assert _levels(session, product.id) == (6, 0)
+
+
+def test_release_hold_gives_the_quantity_back(session, make_product):
+    product = make_product(stock=10)
+    hold = reserve_stock(session, product.id, 4)
+
+    released = release_hold(session, hold.id)
+
+    assert released.status == HoldStatus.RELEASED
+    assert _levels(session, product.id) == (10, 0)
+
+
+def test_a_hold_ends_only_once(session, make_product):
+    product = make_product(stock=10)
+    hold = reserve_stock(session, product.id, 4)
+    release_hold(session, hold.id)
+
+    with pytest.raises(ValueError, match='already released'):
+        confirm_hold(session, hold.id)
+    with pytest.raises(ValueError, match='already released'):
+        release_hold(session, hold.id)
+    assert _levels(session, product.id) == (10, 0)
+
+
+def test_missing_holds(session):
+    assert confirm_hold(session, 42) is None
+    assert release_hold(session, 42) is None
+
+
+def test_expire_holds_releases_the_expired_holds(session, make_product):
+    product = make_product(stock=10)
+    expiring = reserve_stock(session, product.id, 3, ttl=60)
+    lasting = reserve_stock(session, product.id, 2, ttl=3600)
+
+    assert expire_holds(session, now=datetime.now() + timedelta(seconds=120)) == 1
+
+    assert get_hold(session, expiring.id).status == HoldStatus.EXPIRED
+    assert get_hold(session, lasting.id).status == HoldStatus.ACTIVE
+    assert _levels(session, product.id) == (10, 2)
+    assert expire_holds(session, now=datetime.now() + timedelta(seconds=120)) == 0
+
+
+def test_an_expired_hold_can_not_be_confirmed(session, make_product):
+    product = make_product(stock=10)
+    hold = reserve_stock(session, product.id, 3, ttl=1)
+    session.execute(hold.__table__.update().values(expires_at=datetime.now() - timedelta(seconds=1)))
+    session.commit()
+
+    with pytest.raises(ValueError, match='expired'):
+        confirm_hold(session, hold.id)
+    assert get_total_stock(session, product.id) == 10
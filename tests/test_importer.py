@@ -0,0 +1,121 @@
+import io
+import json
+
+import pytest
+from sqlalchemy import select
+
+from models import Product, ProductTransaction, Supplier, OperationType
+from bulk.importer import import_products, import_suppliers
+from crud.product import delete_product, get_product
+from crud.stripe import get_total_stock
+
+PRODUCTS_CSV = """sku,name,description,price,stock,supplier_email
+A-1,Anvil,Heavy,99.5,10,orders@acme.test
+A-2,Rocket,Fast,250,0,orders@acme.test
+"""
+
+
+def _import_products(session, content: str, file_format: str = 'csv', **kwargs) -> tuple[dict, list[dict]]:
+    rejected = []
+    report = import_products(session, io.StringIO(content), file_format, on_reject=rejected.append, **kwargs)
+    return report, rejected
+
+
+def _product(session, sku: str) -> Product:
+    session.expire_all()
+    return session.scalars(select(Product).where(Product.sku == sku)).one()
+
+
+def test_import_products(session, supplier):
+    report, rejected = _import_products(session, PRODUCTS_CSV)
+
+    assert (report['read'], report['imported'], report['rejected']) == (2, 2, 0)
+    assert rejected == []
+    anvil = _product(session, 'A-1')
+    assert (anvil.name, anvil.price, anvil.supplier_id, anvil.stock) == ('Anvil', 99.5, supplier.id, 10)
+    # The stock of a new SKU is its first ADD transaction, a SKU without stock gets none.
+    assert list(session.execute(select(ProductTransaction.operation, ProductTransaction.quantity)
+                                .where(ProductTransaction.product_id == anvil.id)).tuples()) == [
+        (OperationType.ADD, 10)]
+    assert session.scalars(select(ProductTransaction)
+                           .where(ProductTransaction.product_id == _product(session, 'A-2').id)).all() == []
+
+
+def test_import_updates_existing_skus_but_not_their_stock(session, supplier, make_product):
+    product = make_product(stock=5, sku='A-1')
+    get_product(session, product.id)
+
+    report, _ = _import_products(session, PRODUCTS_CSV)
+
+    assert report['imported'] == 2
+    updated = _product(session, 'A-1')
+    assert (updated.id, updated.name, updated.price) == (product.id, 'Anvil', 99.5)
+    assert get_total_stock(session, product.id) == 5
+    # The import invalidated the cached product.
+    session.expunge_all()
+    assert get_product(session, product.id).name == 'Anvil'
+
+
+def test_import_rejects_invalid_rows(session, supplier):
+    row = {'description': 'd', 'price': 1, 'stock': 1, 'supplier_id': supplier.id}
+    content = '\n'.join([json.dumps({**row, 'sku': 'J-1', 'name': 'Valid'}),
+                         json.dumps({**row, 'sku': 'J-2', 'name': 'Unpriced', 'price': 'cheap'}),
+                         'not json',
+                         json.dumps({**row, 'sku': 'J-3', 'name': 'Unknown', 'supplier_id': None,
+                                     'supplier_email': 'nobody@acme.test'})])
+
+    report, rejected = _import_products(session, content, 'jsonl')
+
+    assert (report['read'], report['imported'], report['rejected']) == (4, 1, 3)
+    errors = {row['line']: row['errors'] for row in rejected}
+    assert errors[2][0].startswith('price')
+    assert errors[3][0].startswith('Invalid JSON')
+    assert errors[4] == ['supplier_email: Supplier with email nobody@acme.test not found']
+    assert session.scalars(select(Product.sku)).all() == ['J-1']
+
+
+def test_the_last_row_of_a_sku_wins(session, supplier):
+    content = PRODUCTS_CSV + 'A-1,Anvil XL,Heavier,120,10,orders@acme.test\n'
+
+    report, _ = _import_products(session, content, batch_size=10)
+
+    assert report['imported'] == 2
+    assert _product(session, 'A-1').name == 'Anvil XL'
+
+
+def test_import_rejects_soft_deleted_skus(session, supplier, make_product):
+    product = make_product(stock=5, sku='A-1')
+    delete_product(session, product.id, soft=True)
+
+    report, rejected = _import_products(session, PRODUCTS_CSV)
+
+    assert (report['imported'], report['rejected']) == (1, 1)
+    assert 'A-1 belongs to a deleted product' in rejected[0]['errors'][0]
+    assert get_product(session, product.id) is None
+
+
+def test_import_restores_soft_deleted_skus(session, supplier, make_product):
+    product = make_product(stock=5, sku='A-1')
+    delete_product(session, product.id, soft=True)
+
+    report, rejected = _import_products(session, PRODUCTS_CSV, restore_deleted=True)
+
+    assert (report['imported'], rejected) == (2, [])
+    restored = get_product(session, product.id)
+    assert (restored.name, restored.stock) == ('Anvil', 5)
+
+
+def test_import_suppliers(session, supplier):
+    content = 'name,email,phone_number\nAcme Corp,orders@acme.test,555-0199\nBeta,sales@beta.test,555-0200\n'
+
+    report = import_suppliers(session, io.StringIO(content), 'csv')
+
+    assert (report['imported'], report['rejected']) == (2, 0)
+    session.expire_all()
+    assert [(row.name, row.phone_number) for row in session.scalars(select(Supplier).order_by(Supplier.id))] == [
+        ('Acme Corp', '555-0199'), ('Beta', '555-0200')]
+
+
+def test_import_refuses_unknown_formats(session):
+    with pytest.raises(ValueError, match='Unsupported format'):
+        import_products(session, io.StringIO(''), 'xml')
@@ -0,0 +1,106 @@
+import pytest
+from sqlalchemy import select
+
+from models import ProductTransaction, OperationType
+from crud.product import update_stock, bulk_update_stock, get_product
+from crud.hold import reserve_stock
+from crud.stripe import get_total_stock
+
+
+def _ledger(session, product_id: int) -> list[tuple[OperationType, int]]:
+    return list(session.execute(select(ProductTransaction.operation, ProductTransaction.quantity)
+                                .where(ProductTransaction.product_id == product_id)
+                                .order_by(ProductTransaction.id)).tuples())
+
+
+def test_create_product_records_the_initial_stock(session, make_product):
+    product = make_product(stock=10)
+
+    assert _ledger(session, product.id) == [(OperationType.ADD, 10)]
+
+
+@pytest.mark.parametrize('operation, quantity, expected', [
+    (OperationType.ADD, 5, 15),
+    (OperationType.SUBTRACT, 4, 6),
+    (OperationType.SALE, 10, 0),
+])
+def test_update_stock(session, make_product, operation, quantity, expected):
+    product = make_product(stock=10)
+
+    assert update_stock(session, product.id, quantity, operation) == expected
+    assert get_total_stock(session, product.id) == expected
+    assert _ledger(session, product.id)[-1] == (operation, quantity)
+
+
+def test_update_stock_refuses_more_than_the_stock(session, make_product):
+    product = make_product(stock=3)
+
+    with pytest.raises(ValueError, match='Not enough stock'):
+        update_stock(session, product.id, 4, OperationType.SALE)
+    assert get_total_stock(session, product.id) == 3
+    assert len(_ledger(session, product.id)) == 1
+
+
+def test_update_stock_of_a_missing_product(session):
+    with pytest.raises(ValueError, match='Product 42 not found'):
+        update_stock(session, 42, 1, OperationType.ADD)
+
+
+@pytest.mark.parametrize('operation', [OperationType.RESERVE, OperationType.RELEASE])
+def test_update_stock_refuses_the_hold_operations(session, make_product, operation):
+    product = make_product(stock=10)
+
+    with pytest.raises(ValueError, match='use the hold endpoints'):
+        update_stock(session, product.id, 1, operation)
+
+
+def test_get_product_reads_the_current_stock_of_a_cached_product(session, make_product):
+    product_id = make_product(stock=10).id
+    get_product(session, product_id)
+
+    update_stock(session, product_id, 3, OperationType.SALE)
+
+    session.expunge_all()
+    assert get_product(session, product_id).stock == 7
+
+
+def test_bulk_update_stock_checks_the_running_stock(session, make_product):
+    first, second = make_product(stock=5), make_product(stock=1)
+
+    results = bulk_update_stock(session, [(first.id, 3, OperationType.SALE),
+                                          (second.id, 2, OperationType.SALE),
+                                          (first.id, 3, OperationType.SALE),
+                                          (first.id, 10, OperationType.ADD)])
+
+    assert [result['success'] for result in results] == [True, False, False, True]
+    assert [result.get('stock') for result in results] == [2, None, None, 12]
+    assert 'Available: 2, Requested: 3' in results[2]['detail']
+    assert get_total_stock(session, first.id) == 12
+    assert get_total_stock(session, second.id) == 1
+    assert _ledger(session, first.id) == [(OperationType.ADD, 5), (OperationType.SALE, 3), (OperationType.ADD, 10)]
+
+
+def test_bulk_update_stock_all_or_nothing(session, make_product):
+    product = make_product(stock=5)
+
+    results = bulk_update_stock(session, [(product.id, 2, OperationType.SALE),
+                                          (product.id, 4, OperationType.SALE),
+                                          (42, 1, OperationType.ADD)],
+                                all_or_nothing=True)
+
+    assert not any(result['success'] for result in results)
+    assert results[0]['detail'] == 'Batch rolled back'
+    assert results[2]['detail'] == 'Product 42 not found'
+    assert get_total_stock(session, product.id) == 5
+    assert len(_ledger(session, product.id)) == 1
+
+
+def test_bulk_update_stock_leaves_the_reserved_stock(session, make_product):
+    product = make_product(stock=5)
+    reserve_stock(session, product.id, 4)
+
+    results = bulk_update_stock(session, [(product.id, 2, OperationType.SALE),
+                                          (product.id, 1, OperationType.SALE)])
+
+    assert [result['success'] for result in results] == [False, True]
+    assert get_total_stock(session, product.id) == 4
@@ -0,0 +1,127 @@
+import pytest
+from sqlalchemy import select, update
+
+from models import Product, ProductStockStripe, OperationType
+from crud.product import update_stock, bulk_update_stock
+from crud.hold import reserve_stock, confirm_hold, release_hold
+from crud.stripe import configure_stripes, get_total_stock, split_evenly, MAX_STRIPES
+
+
+def _stripes(session, product_id: int) -> list[int]:
+    return list(session.scalars(select(ProductStockStripe.stock)
+                                .where(ProductStockStripe.product_id == product_id)
+                                .order_by(ProductStockStripe.stripe)))
+
+
+def _row_stock(session, product_id: int) -> tuple[int, int, int]:
+    return tuple(session.execute(select(Product.stock, Product.reserved, Product.stripe_count)
+                                 .where(Product.id == product_id)).one())
+
+
+def test_split_evenly():
+    assert split_evenly(10, 4) == [3, 3, 2, 2]
+    assert split_evenly(2, 4) == [1, 1, 0, 0]
+
+
+def test_configure_stripes_spreads_the_stock(session, make_product):
+    product = make_product(stock=10)
+
+    assert configure_stripes(session, product.id, 4) == 10
+
+    assert _stripes(session, product.id) == [3, 3, 2, 2]
+    assert _row_stock(session, product.id) == (0, 0, 4)
+    assert get_total_stock(session, product.id) == 10
+
+
+def test_configure_stripes_keeps_the_reserved_stock_on_the_product(session, make_product):
+    product = make_product(stock=10)
+    reserve_stock(session, product.id, 4)
+
+    configure_stripes(session, product.id, 3)
+
+    assert _stripes(session, product.id) == [2, 2, 2]
+    assert _row_stock(session, product.id) == (4, 4, 3)
+
+
+def test_configure_stripes_back_to_none(session, make_product):
+    product = make_product(stock=10)
+    configure_stripes(session, product.id, 4)
+
+    assert configure_stripes(session, product.id, 0) == 10
+
+    assert _stripes(session, product.id) == []
+    assert _row_stock(session, product.id) == (10, 0, 0)
+
+
+@pytest.mark.parametrize('stripe_count', [-1, MAX_STRIPES + 1])
+def test_configure_stripes_refuses_bad_counts(session, make_product, stripe_count):
+    product = make_product(stock=10)
+
+    with pytest.raises(ValueError, match='stripe count'):
+        configure_stripes(session, product.id, stripe_count)
+
+
+def test_configure_stripes_of_a_missing_product(session):
+    assert configure_stripes(session, 42, 2) is None
+
+
+def test_update_stock_of_a_striped_product(session, make_product):
+    product = make_product(stock=10)
+    configure_stripes(session, product.id, 4)
+
+    assert update_stock(session, product.id, 5, OperationType.ADD) == 15
+    assert update_stock(session, product.id, 4, OperationType.SALE) == 11
+    assert sum(_stripes(session, product.id)) == 11
+
+
+def test_a_sale_gathers_the_stock_of_several_stripes(session, make_product):
+    product = make_product(stock=10)
+    configure_stripes(session, product.id, 4)
+
+    assert update_stock(session, product.id, 9, OperationType.SALE) == 1
+    with pytest.raises(ValueError, match='Available: 1, Requested: 2'):
+        update_stock(session, product.id, 2, OperationType.SALE)
+    assert get_total_stock(session, product.id) == 1
+
+
+def test_bulk_update_stock_of_a_striped_product(session, make_product):
+    striped, plain = make_product(stock=10), make_product(stock=10)
+    configure_stripes(session, striped.id, 2)
+
+    results = bulk_update_stock(session, [(striped.id, 7, OperationType.SALE),
+                                          (plain.id, 7, OperationType.SALE),
+                                          (striped.id, 4, OperationType.SALE),
+                                          (striped.id, 1, OperationType.ADD)])
+
+    assert [result['success'] for result in results] == [True, True, False, True]
+    assert get_total_stock(session, striped.id) == 4
+    assert sum(_stripes(session, striped.id)) == 4
+    assert get_total_stock(session, plain.id) == 3
+
+
+def test_holds_of_a_striped_product(session, make_product):
+    product = make_product(stock=10)
+    configure_stripes(session, product.id, 2)
+
+    confirmed = reserve_stock(session, product.id, 4)
+    released = reserve_stock(session, product.id, 3)
+    with pytest.raises(ValueError, match='Available: 3, Requested: 4'):
+        reserve_stock(session, product.id, 4)
+
+    confirm_hold(session, confirmed.id)
+    release_hold(session, released.id)
+    assert get_total_stock(session, product.id) == 6
+    assert _row_stock(session, product.id)[1] == 0
+
+
+def test_adding_to_a_missing_stripe_fails(session, make_product):
+    product = make_product(stock=10)
+    # A stripe count set without `configure_stripes`, so the stripes don't exist.
+    session.execute(update(Product).where(Product.id == product.id).values(stripe_count=2))
+    session.commit()
+
+    with pytest.raises(ValueError, match='is missing'):
+        update_stock(session, product.id, 1, OperationType.ADD)
+    with pytest.raises(ValueError, match='is missing'):
+        bulk_update_stock(session, [(product.id, 1, OperationType.ADD)])
+    assert get_total_stock(session, product.id) == 10